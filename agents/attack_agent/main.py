@@ -10,12 +10,13 @@ from dotenv import load_dotenv
 import random
 import websockets.client
 
-from fastmcp import FastMCP
 from langchain_deepseek import ChatDeepSeek
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.tools import tool
 
+from mcp_pool import MCPSessionPool
+
 # --- 设置日志 ---
 logging.basicConfig(
     level=logging.INFO,
@@ -492,6 +493,11 @@ dotenv_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path=dotenv_path)
 
 ATTACK_SERVICE_URL = os.getenv("ATTACK_SERVICE_URL", "http://127.0.0.1:8001/mcp/")
+ATTACK_SERVICE_POOL_SIZE = int(os.getenv("ATTACK_SERVICE_POOL_SIZE", "4"))
+ATTACK_SERVICE_CALL_TIMEOUT = float(os.getenv("ATTACK_SERVICE_CALL_TIMEOUT", "120"))
+ATTACK_SERVICE_CONNECT_TIMEOUT = float(os.getenv("ATTACK_SERVICE_CONNECT_TIMEOUT", "10"))
+ATTACK_SERVICE_HEALTH_INTERVAL = float(os.getenv("ATTACK_SERVICE_HEALTH_INTERVAL", "30"))
+ATTACK_SERVICE_PING_TIMEOUT = float(os.getenv("ATTACK_SERVICE_PING_TIMEOUT", "5"))
 # 受害者主机的基础URL，指向Docker容器的IP地址和端口
 # 由于我们现在使用Docker容器而不是本地进程，所以只能使用这些URL
 VICTIM_HOST_URLS = {
@@ -503,8 +509,15 @@ VICTIM_HOST_URLS = {
 # --- 初始化LLM和工具 ---
 llm = ChatDeepSeek(model="deepseek-chat", api_key=os.getenv("DEEPSEEK_API_KEY"))
 
-# 使用FastMCP客户端连接到攻击服务
-attack_service_client = FastMCP.as_proxy(ATTACK_SERVICE_URL)
+# 所有工具共用的攻击服务MCP会话池
+attack_service_pool = MCPSessionPool(
+    ATTACK_SERVICE_URL,
+    size=ATTACK_SERVICE_POOL_SIZE,
+    call_timeout=ATTACK_SERVICE_CALL_TIMEOUT,
+    connect_timeout=ATTACK_SERVICE_CONNECT_TIMEOUT,
+    health_interval=ATTACK_SERVICE_HEALTH_INTERVAL,
+    ping_timeout=ATTACK_SERVICE_PING_TIMEOUT,
+)
 
 # --- 为Agent手动定义可用的工具 ---
 # LangChain Agent需要一个明确的工具列表来了解其能力。
@@ -517,11 +530,10 @@ async def run_nmap(target_ip: str, options: str = "-T4 --top-ports 20") -> str:
         # 记录工具开始执行
         await attack_log_handler.log_tool_start("run_nmap", {"target_ip": target_ip, "options": options})
 
-        async with attack_service_client.client as client:
-            response = await client.call_tool(
-                "run_nmap",
-                arguments={'target_ip': target_ip, 'options': options}
-            )
+        response = await attack_service_pool.call_tool(
+            "run_nmap",
+            arguments={'target_ip': target_ip, 'options': options}
+        )
         # 从CallToolResult对象中安全地提取文本
         result = "\n".join([b.text for b in response.content if hasattr(b, "text")])
 
@@ -539,11 +551,10 @@ async def fetch_url_content(url: str) -> str:
         # 记录工具开始执行
         await attack_log_handler.log_tool_start("fetch_url_content", {"url": url})
 
-        async with attack_service_client.client as client:
-            response = await client.call_tool(
-                "fetch_url_content",
-                arguments={'url': url}
-            )
+        response = await attack_service_pool.call_tool(
+            "fetch_url_content",
+            arguments={'url': url}
+        )
         result = "\n".join([b.text for b in response.content if hasattr(b, "text")])
 
         # 记录工具执行完成
@@ -586,11 +597,10 @@ async def craft_phishing_email(target_name: str, company: str, malicious_link: s
         if email:
             args['email'] = email
             
-        async with attack_service_client.client as client:
-            response = await client.call_tool(
-                "craft_phishing_email",
-                arguments=args
-            )
+        response = await attack_service_pool.call_tool(
+            "craft_phishing_email",
+            arguments=args
+        )
         
         # 记录工具开始执行
         await attack_log_handler.log_tool_start("craft_phishing_email", args)
@@ -657,26 +667,25 @@ async def send_payload_to_victim(victim_url: str, phishing_email_json: str) -> s
 
         # 调用攻击服务中的send_payload_to_victim工具
         # 注意：我们需要确保攻击服务中有这个工具
-        async with attack_service_client.client as client:
-            # 构建参数
-            args = {
-                'victim_url': target_url,
-                'phishing_email_json': phishing_email_json
-            }
-
-            # 调用工具
-            response = await client.call_tool(
-                "send_payload_to_victim",
-                arguments=args
-            )
-
-            # 从CallToolResult对象中安全地提取文本
-            result = "\n".join([b.text for b in response.content if hasattr(b, "text")])
-
-            # 记录工具执行完成
-            await attack_log_handler.log_tool_end("send_payload_to_victim", result)
-
-            return result
+        # 构建参数
+        args = {
+            'victim_url': target_url,
+            'phishing_email_json': phishing_email_json
+        }
+
+        # 调用工具
+        response = await attack_service_pool.call_tool(
+            "send_payload_to_victim",
+            arguments=args
+        )
+
+        # 从CallToolResult对象中安全地提取文本
+        result = "\n".join([b.text for b in response.content if hasattr(b, "text")])
+
+        # 记录工具执行完成
+        await attack_log_handler.log_tool_end("send_payload_to_victim", result)
+
+        return result
     except Exception as e:
         return f"执行send_payload_to_victim工具时出错: {e}"
     except Exception as e:
@@ -686,11 +695,10 @@ async def send_payload_to_victim(victim_url: str, phishing_email_json: str) -> s
 async def get_network_info(session_id: str) -> str:
     """获取当前会话可达的内网主机信息。"""
     try:
-        async with attack_service_client.client as client:
-            response = await client.call_tool(
-                "get_network_info",
-                arguments={"session_id": session_id}
-            )
+        response = await attack_service_pool.call_tool(
+            "get_network_info",
+            arguments={"session_id": session_id}
+        )
         return "\n".join([b.text for b in response.content if hasattr(b, "text")])
     except Exception as e:
         return f"执行get_network_info工具时出错: {e}"
@@ -699,11 +707,10 @@ async def get_network_info(session_id: str) -> str:
 async def search_exploit(service: str, version: str) -> str:
     """搜索可利用漏洞模块。"""
     try:
-        async with attack_service_client.client as client:
-            response = await client.call_tool(
-                "search_exploit",
-                arguments={"service": service, "version": version}
-            )
+        response = await attack_service_pool.call_tool(
+            "search_exploit",
+            arguments={"service": service, "version": version}
+        )
         return "\n".join([b.text for b in response.content if hasattr(b, "text")])
     except Exception as e:
         return f"执行search_exploit工具时出错: {e}"
@@ -712,11 +719,10 @@ async def search_exploit(service: str, version: str) -> str:
 async def execute_exploit_module(module: str, target: str) -> str:
     """执行指定漏洞利用模块，返回 session_id"""
     try:
-        async with attack_service_client.client as client:
-            response = await client.call_tool(
-                "execute_exploit_module",
-                arguments={"module": module, "target": target}
-            )
+        response = await attack_service_pool.call_tool(
+            "execute_exploit_module",
+            arguments={"module": module, "target": target}
+        )
         return "\n".join([b.text for b in response.content if hasattr(b, "text")])
     except Exception as e:
         return f"执行execute_exploit_module工具时出错: {e}"
@@ -725,11 +731,10 @@ async def execute_exploit_module(module: str, target: str) -> str:
 async def execute_shell_command(session_id: str, command: str) -> str:
     """在已控目标上执行命令。"""
     try:
-        async with attack_service_client.client as client:
-            response = await client.call_tool(
-                "execute_shell_command",
-                arguments={"session_id": session_id, "command": command}
-            )
+        response = await attack_service_pool.call_tool(
+            "execute_shell_command",
+            arguments={"session_id": session_id, "command": command}
+        )
         return "\n".join([b.text for b in response.content if hasattr(b, "text")])
     except Exception as e:
         return f"执行execute_shell_command工具时出错: {e}"
@@ -750,37 +755,33 @@ tools = [
 @tool
 async def craft_doc_with_enable_macro(victim_name: str) -> str:
     """生成诱导启用宏的文档下载链接。"""
-    async with attack_service_client.client as client:
-        res = await client.call_tool("craft_doc_with_enable_macro", arguments={"victim_name": victim_name})
+    res = await attack_service_pool.call_tool("craft_doc_with_enable_macro", arguments={"victim_name": victim_name})
     return "\n".join([b.text for b in res.content if hasattr(b, "text")])
 
 @tool
 async def simulate_sextortion_email(victim_name: str, position: str) -> str:
     """生成性勒索邮件内容。"""
-    async with attack_service_client.client as client:
-        res = await client.call_tool("simulate_sextortion_email", arguments={"victim_name": victim_name, "position": position})
+    res = await attack_service_pool.call_tool("simulate_sextortion_email", arguments={"victim_name": victim_name, "position": position})
     return "\n".join([b.text for b in res.content if hasattr(b, "text")])
 
 @tool
 async def craft_affinity_chat(common_interest: str, first_question: str = "能加个微信聊细节吗？") -> str:
     """基于共同爱好生成亲和聊天脚本并返回对话开场白。"""
-    async with attack_service_client.client as client:
-        res = await client.call_tool("craft_affinity_chat", arguments={"common_interest": common_interest, "first_question": first_question})
+    res = await attack_service_pool.call_tool("craft_affinity_chat", arguments={"common_interest": common_interest, "first_question": first_question})
     return "\n".join([b.text for b in res.content if hasattr(b, "text")])
 
 @tool
 async def craft_fake_job_offer(target_name: str, desired_role: str, salary_range: str, form_link: str) -> str:
     """生成虚假的招聘信息，诱导受害者填写个人信息。"""
-    async with attack_service_client.client as client:
-        res = await client.call_tool(
-            "craft_fake_job_offer",
-            arguments={
-                "target_name": target_name,
-                "desired_role": desired_role,
-                "salary_range": salary_range,
-                "form_link": form_link,
-            },
-        )
+    res = await attack_service_pool.call_tool(
+        "craft_fake_job_offer",
+        arguments={
+            "target_name": target_name,
+            "desired_role": desired_role,
+            "salary_range": salary_range,
+            "form_link": form_link,
+        },
+    )
     return "\n".join([b.text for b in res.content if hasattr(b, "text")])
 # --------------------------------------------------------------------------
 
@@ -853,21 +854,20 @@ async def send_payload_to_victim_social(victim_url: str, payload: dict) -> str:
         print(f"选择社会工程学攻击目标URL: {target_url}")
         
         # 调用攻击服务中的send_payload_to_victim_social工具
-        async with attack_service_client.client as client:
-            # 构建参数
-            args = {
-                'victim_url': target_url,
-                'payload': payload
-            }
-            
-            # 调用工具
-            response = await client.call_tool(
-                "send_payload_to_victim_social",
-                arguments=args
-            )
-            
-            # 从CallToolResult对象中安全地提取文本
-            return "\n".join([b.text for b in response.content if hasattr(b, "text")])
+        # 构建参数
+        args = {
+            'victim_url': target_url,
+            'payload': payload
+        }
+
+        # 调用工具
+        response = await attack_service_pool.call_tool(
+            "send_payload_to_victim_social",
+            arguments=args
+        )
+
+        # 从CallToolResult对象中安全地提取文本
+        return "\n".join([b.text for b in response.content if hasattr(b, "text")])
     except Exception as e:
         return f"执行send_payload_to_victim_social工具时出错: {e}"
 
@@ -925,6 +925,20 @@ app = FastAPI(
 class AttackRequest(BaseModel):
     target_host: str = Field(description="攻击目标的主机地址，例如 http://127.0.0.1:8005")
 
+@app.get("/health")
+async def health_check():
+    """健康检查（轻量，供后端的健康注册表定期调用）"""
+    return {"status": "healthy", "service": "攻击智能体"}
+
+@app.get("/mcp_stats")
+async def mcp_stats():
+    """攻击服务MCP会话池的状态和各工具的调用耗时"""
+    return attack_service_pool.stats()
+
+@app.on_event("shutdown")
+async def close_attack_service_pool():
+    await attack_service_pool.close()
+
 @app.post("/execute_full_attack")
 async def execute_full_attack(request: AttackRequest):
     """
@@ -0,0 +1,222 @@
+"""
+攻击服务的MCP会话池
+
+所有工具共用少量长连接的MCP会话，避免每次工具调用都重新建立会话。
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("attack-agent")
+
+
+def _default_client_factory(url: str):
+    from fastmcp import Client
+    return Client(url)
+
+
+class MCPSession:
+    """一个MCP会话，由专属的协程进入和退出客户端上下文
+
+    MCP传输基于anyio，取消作用域要求在同一个任务中进入和退出，
+    所以会话的建立和关闭都在 _run 中完成，其他任务只通过 client 发起调用。
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.closed = False
+        self._ready = None
+        self._closing = None
+        self._task = None
+
+    async def open(self, timeout: float):
+        self._ready = asyncio.get_running_loop().create_future()
+        self._closing = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(asyncio.shield(self._ready), timeout=timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _run(self):
+        try:
+            async with self.client:
+                self._ready.set_result(None)
+                await self._closing.wait()
+        except Exception as e:
+            if not self._ready.done():
+                self._ready.set_exception(e)
+            else:
+                logger.debug(f"MCP会话异常结束: {e}")
+        finally:
+            self.closed = True
+            if not self._ready.done():
+                self._ready.set_exception(ConnectionError("MCP会话已关闭"))
+
+    async def close(self, timeout: float = 5.0):
+        if self._closing is not None:
+            self._closing.set()
+        if self._task is not None:
+            try:
+                # 超时后 wait_for 会取消会话协程
+                await asyncio.wait_for(self._task, timeout=timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            except Exception as e:
+                logger.debug(f"关闭MCP会话时出错: {e}")
+        self.closed = True
+
+
+class MCPSessionPool:
+    """到攻击服务的长连接MCP会话池，所有工具共用
+
+    会话在第一次调用时才建立，用完放回池中复用，不再每次工具调用都重新握手。
+    后台定期 ping 空闲会话，断开的会话会被关闭，下次调用时重新连接；
+    调用失败且会话已断开时，换一个新会话重试一次（超时的调用可能已经执行，不重试）。
+    """
+
+    def __init__(self, url: str, size: int = 4, call_timeout: float = 120, connect_timeout: float = 10,
+                 health_interval: float = 30, ping_timeout: float = 5, client_factory=None):
+        self.url = url
+        self.size = size
+        self.call_timeout = call_timeout
+        self.connect_timeout = connect_timeout
+        self.health_interval = health_interval
+        self.ping_timeout = ping_timeout
+        self.client_factory = client_factory or _default_client_factory
+        self._idle = []
+        self._open_count = 0  # 已建立的会话数（空闲 + 使用中）
+        self._cond = None
+        self._health_task = None
+        self.opened = 0
+        self.reconnects = 0
+        self.health_failures = 0
+        self.tool_stats = {}
+
+    async def _connect(self) -> MCPSession:
+        session = MCPSession(self.client_factory(self.url))
+        await session.open(self.connect_timeout)
+        self.opened += 1
+        return session
+
+    async def _alive(self, session: MCPSession) -> bool:
+        if session.closed:
+            return False
+        try:
+            return await asyncio.wait_for(session.client.ping(), timeout=self.ping_timeout) is not False
+        except Exception:
+            return False
+
+    async def acquire(self) -> MCPSession:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._health_loop())
+        async with self._cond:
+            while not self._idle and self._open_count >= self.size:
+                await self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._open_count += 1
+        try:
+            return await self._connect()
+        except BaseException:
+            await self._discard(None)
+            raise
+
+    async def release(self, session: MCPSession):
+        async with self._cond:
+            self._idle.append(session)
+            self._cond.notify()
+
+    async def _discard(self, session):
+        if session is not None:
+            await session.close()
+        async with self._cond:
+            self._open_count -= 1
+            self._cond.notify()
+
+    async def _drop_idle(self):
+        """会话断开通常是攻击服务重启，其余空闲会话也已失效，全部关闭后重新连接"""
+        async with self._cond:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            await self._discard(session)
+
+    async def call_tool(self, name: str, arguments: dict):
+        """调用攻击服务的工具，返回 CallToolResult"""
+        stats = self.tool_stats.setdefault(name, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        started = time.monotonic()
+        try:
+            for attempt in range(2):
+                session = await self.acquire()
+                try:
+                    result = await asyncio.wait_for(session.client.call_tool(name, arguments=arguments),
+                                                    timeout=self.call_timeout)
+                except asyncio.CancelledError:
+                    await self._discard(session)
+                    raise
+                except Exception as e:
+                    # 工具本身报错时会话仍然可用；会话断开时换一个新会话重试一次
+                    if await self._alive(session):
+                        await self.release(session)
+                        raise
+                    await self._discard(session)
+                    if attempt == 1 or isinstance(e, asyncio.TimeoutError):
+                        raise
+                    await self._drop_idle()
+                    self.reconnects += 1
+                    logger.warning(f"攻击服务MCP会话已断开，重新连接后重试 {name}: {e}")
+                    continue
+                await self.release(session)
+                return result
+        except BaseException:
+            stats["errors"] += 1
+            raise
+        finally:
+            elapsed_ms = (time.monotonic() - started) * 1000
+            stats["calls"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            async with self._cond:
+                idle, self._idle = self._idle, []
+            checks = await asyncio.gather(*(self._alive(session) for session in idle))
+            for session, ok in zip(idle, checks):
+                if ok:
+                    await self.release(session)
+                else:
+                    self.health_failures += 1
+                    await self._discard(session)
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        if self._cond is not None:
+            await self._drop_idle()
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "size": self.size,
+            "open": self._open_count,
+            "idle": len(self._idle),
+            "opened": self.opened,
+            "reconnects": self.reconnects,
+            "health_failures": self.health_failures,
+            "tools": {
+                name: {**s, "avg_ms": round(s["total_ms"] / s["calls"], 1) if s["calls"] else 0.0,
+                       "total_ms": round(s["total_ms"], 1), "max_ms": round(s["max_ms"], 1)}
+                for name, s in self.tool_stats.items()
+            },
+        }
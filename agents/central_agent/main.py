@@ -161,6 +161,11 @@ async def broadcast_progress(message: str, progress_type: str = "info"):
         logger.error(f"发送日志到后端WebSocket失败: {e}")
 
 # --- API端点 ---
+@app.get("/health")
+async def health_check():
+    """健康检查（轻量，供后端的健康注册表定期调用）"""
+    return {"status": "healthy", "service": "中控智能体", "attack_status": attack_status}
+
 @app.post("/process_command")
 async def process_command(request: CommandRequest):
     """
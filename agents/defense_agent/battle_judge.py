@@ -5,6 +5,7 @@
 
 import asyncio
 import json
+import time
 import logging
 import websockets.client
 from datetime import datetime
@@ -25,14 +26,20 @@ dotenv_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path=dotenv_path)
 
 BACKEND_WS_URL = "ws://localhost:8080/ws/logs"
+# 裁判只关心攻击智能体和防御智能体的日志
+JUDGE_LOG_SOURCES = ["攻击智能体", "威胁阻断", "漏洞修复", "攻击溯源"]
 
 class BattleJudge:
     def __init__(self):
         self.ws_connection = None
+        # 上一次随日志发送的战况快照，战况未变化时不再重复附带
+        self.last_sent_state = None
         self.battle_state = {
             "status": "ongoing",  # ongoing, attack_victory, defense_victory
             "start_time": None,
             "end_time": None,
+            "start_seq": None,
+            "end_seq": None,
             "attack_progress": {
                 "reconnaissance": False,
                 "weaponization": False,
@@ -79,6 +86,11 @@ class BattleJudge:
         """连接到后端WebSocket"""
         try:
             self.ws_connection = await websockets.client.connect(BACKEND_WS_URL)
+            self.last_sent_state = None
+            await self.ws_connection.send(json.dumps({
+                "type": "subscribe",
+                "sources": JUDGE_LOG_SOURCES
+            }, ensure_ascii=False))
             logger.info("攻防演练裁判系统已连接到WebSocket")
             return True
         except Exception as e:
@@ -91,18 +103,22 @@ class BattleJudge:
             try:
                 # 转换set为list以支持JSON序列化
                 serializable_state = self.battle_state.copy()
-                serializable_state["compromised_assets"] = list(self.battle_state["compromised_assets"])
-                serializable_state["recovered_assets"] = list(self.battle_state["recovered_assets"])
-                serializable_state["blocked_ips"] = list(self.battle_state["blocked_ips"])
-                serializable_state["patched_vulnerabilities"] = list(self.battle_state["patched_vulnerabilities"])
+                serializable_state["compromised_assets"] = sorted(self.battle_state["compromised_assets"])
+                serializable_state["recovered_assets"] = sorted(self.battle_state["recovered_assets"])
+                serializable_state["blocked_ips"] = sorted(self.battle_state["blocked_ips"])
+                serializable_state["patched_vulnerabilities"] = sorted(self.battle_state["patched_vulnerabilities"])
                 
                 log_data = {
                     "level": level,
                     "source": "攻防演练裁判",
                     "message": message,
-                    "timestamp": asyncio.get_event_loop().time(),
-                    "battle_state": serializable_state
+                    "timestamp": time.time()
                 }
+                # 只在战况变化时附带完整快照，减少重复传输
+                state_snapshot = json.dumps(serializable_state, ensure_ascii=False, sort_keys=True)
+                if state_snapshot != self.last_sent_state:
+                    log_data["battle_state"] = serializable_state
+                    self.last_sent_state = state_snapshot
                 await self.ws_connection.send(json.dumps(log_data, ensure_ascii=False))
             except Exception as e:
                 logger.error(f"发送裁判日志失败: {e}")
@@ -226,10 +242,20 @@ class BattleJudge:
         
         return "ongoing"
     
-    async def declare_victory(self, winner: str):
+    @staticmethod
+    def event_time(message_data: Dict[str, Any]) -> str:
+        """优先使用后端统一的接收时间，使各进程的时间线可以对齐"""
+        ingest_ts_ns = message_data.get("ingest_ts_ns")
+        if ingest_ts_ns:
+            return datetime.fromtimestamp(ingest_ts_ns / 1e9).isoformat()
+        return datetime.now().isoformat()
+
+    async def declare_victory(self, winner: str, message_data: Dict[str, Any] = None):
         """宣布胜负结果"""
+        message_data = message_data or {}
         self.battle_state["status"] = winner
-        self.battle_state["end_time"] = datetime.now().isoformat()
+        self.battle_state["end_time"] = self.event_time(message_data)
+        self.battle_state["end_seq"] = message_data.get("seq")
         
         if winner == "attack_victory":
             await self.send_log("critical", "🔴 ═══════════════════════════════════════")
@@ -331,7 +357,8 @@ class BattleJudge:
             
             # 初始化战斗状态
             if not self.battle_state["start_time"] and "攻击智能体" in log_source:
-                self.battle_state["start_time"] = datetime.now().isoformat()
+                self.battle_state["start_time"] = self.event_time(message_data)
+                self.battle_state["start_seq"] = message_data.get("seq")
                 await self.send_log("critical", "🚀 ═══════════════════════════════════════")
                 await self.send_log("critical", "🎯 攻防演练正式开始！")
                 await self.send_log("critical", "⚔️  红蓝对抗演练现在开始，请各方做好准备")
@@ -349,7 +376,7 @@ class BattleJudge:
             if self.battle_state["status"] == "ongoing":
                 result = self.check_victory_conditions()
                 if result != "ongoing":
-                    await self.declare_victory(result)
+                    await self.declare_victory(result, message_data)
                     
         except Exception as e:
             logger.error(f"处理战况更新失败: {e}")
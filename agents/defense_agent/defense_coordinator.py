@@ -33,6 +33,8 @@ DEFENSE_AGENTS = {
     "vulnerability_remediation": "http://127.0.0.1:8012/execute_vulnerability_remediation",
     "attack_attribution": "http://127.0.0.1:8013/execute_attack_attribution"
 }
+# 需要进行防御响应的攻击相关日志来源
+ATTACK_LOG_SOURCES = ['中控智能体', '攻击智能体', 'attack_agent', 'central_agent']
 
 class DefenseCoordinator:
     def __init__(self):
@@ -99,6 +101,11 @@ class DefenseCoordinator:
         """连接到后端WebSocket"""
         try:
             self.ws_connection = await websockets.client.connect(BACKEND_WS_URL)
+            # 只订阅攻击方和裁判的日志，由后端过滤掉其余日志
+            await self.ws_connection.send(json.dumps({
+                "type": "subscribe",
+                "sources": ATTACK_LOG_SOURCES + ["攻防演练裁判"]
+            }, ensure_ascii=False))
             logger.info(f"防御协调器已连接到WebSocket: {BACKEND_WS_URL}")
             return True
         except Exception as e:
@@ -124,15 +131,8 @@ class DefenseCoordinator:
         triggered_agents = []
         
         # 只对攻击相关的智能体日志进行防御响应
-        attack_agent_sources = [
-            '中控智能体',
-            '攻击智能体',
-            'attack_agent',
-            'central_agent'
-        ]
-        
         # 检查是否来自攻击智能体
-        is_from_attack_agent = any(agent_source in log_source for agent_source in attack_agent_sources)
+        is_from_attack_agent = any(agent_source in log_source for agent_source in ATTACK_LOG_SOURCES)
         
         if not is_from_attack_agent:
             return triggered_agents
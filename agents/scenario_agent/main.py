@@ -616,6 +616,11 @@ class ScenarioGenerationRequest(BaseModel):
     description: Optional[str] = Field(None, description="详细描述")
     custom_config: Optional[Dict] = Field(None, description="自定义配置")
 
+@app.get("/health")
+async def health_check():
+    """健康检查（轻量，供后端的健康注册表定期调用）"""
+    return {"status": "healthy", "service": "场景智能体"}
+
 @app.post("/analyze_prompt")
 async def analyze_prompt_endpoint(request: PromptAnalysisRequest):
     """
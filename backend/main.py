@@ -1,5 +1,6 @@
 from fastapi import FastAPI, HTTPException, APIRouter, WebSocket, WebSocketDisconnect
-from pydantic import BaseModel, Field
+from fastapi.responses import PlainTextResponse, JSONResponse
+from pydantic import BaseModel, Field, ConfigDict
 import subprocess
 import os
 import json
@@ -8,7 +9,32 @@ import httpx
 import asyncio
 import yaml
 import tempfile
-from typing import List, Dict, Optional, Any, Set
+import time
+import zlib
+import gzip
+import struct
+import re
+import hashlib
+import uuid
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Any, Set, Tuple
+from collections import deque, OrderedDict, defaultdict
+
+try:
+    import orjson  # 可选的高性能JSON编码库
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack  # 可选的二进制日志传输编码
+except ImportError:
+    msgpack = None
+
+try:
+    import fcntl  # 多worker部署时用文件锁选出主worker（仅类Unix系统）
+except ImportError:
+    fcntl = None
 
 # 设置日志
 logging.basicConfig(
@@ -24,10 +50,226 @@ DEFAULT_TEMPLATE = "company-topology.yml"
 
 app = FastAPI(title="Topology Orchestrator API")
 
+# ---------------------------------------------------------------------------
+# Docker 命令的异步执行与编排任务
+# ---------------------------------------------------------------------------
+
+DOCKER_COMMAND_TIMEOUT = float(os.getenv("DOCKER_COMMAND_TIMEOUT", "600"))
+DOCKER_OUTPUT_LIMIT = 4 * 1024 * 1024  # 单行输出上限，docker inspect 的输出可能很长
+TOPOLOGY_JOB_HISTORY = int(os.getenv("TOPOLOGY_JOB_HISTORY", "100"))
+TOPOLOGY_LOG_SOURCE = "拓扑编排"
+AGENT_JOB_HISTORY = int(os.getenv("AGENT_JOB_HISTORY", "100"))
+AGENT_JOB_LOG_SOURCE = "智能体任务"
+JOB_LONG_POLL_MAX = float(os.getenv("JOB_LONG_POLL_MAX", "50"))  # 长轮询最长等待时间，需小于反向代理的空闲超时
+
+
+async def run_docker(args: List[str], cwd: Optional[str] = None, timeout: Optional[float] = DOCKER_COMMAND_TIMEOUT,
+                     check: bool = True, on_output=None) -> subprocess.CompletedProcess:
+    """异步执行 docker / docker-compose 命令，不阻塞事件循环
+
+    on_output 为可选的协程函数，每读到一行输出调用一次，用于推送进度。
+    check=True 时返回码非0抛出 subprocess.CalledProcessError，与原来的 check_call/check_output 一致。
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *args, cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        limit=DOCKER_OUTPUT_LIMIT
+    )
+    stdout: List[str] = []
+    stderr: List[str] = []
+
+    async def pump(stream: asyncio.StreamReader, chunks: List[str]):
+        async for raw in stream:
+            line = raw.decode(errors="replace")
+            chunks.append(line)
+            if on_output is not None and line.strip():
+                await on_output(line.rstrip())
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(pump(proc.stdout, stdout), pump(proc.stderr, stderr), proc.wait()),
+            timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise subprocess.TimeoutExpired(args, timeout)
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+
+    result = subprocess.CompletedProcess(list(args), proc.returncode, "".join(stdout), "".join(stderr))
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, list(args), result.stdout, result.stderr)
+    return result
+
+
+class OrchestrationJob:
+    """一次后台操作（启动/停止拓扑、攻击、场景生成等），进度和结果通过日志中心推送给前端"""
+
+    def __init__(self, kind: str, params: Optional[Dict[str, Any]] = None, source: str = TOPOLOGY_LOG_SOURCE):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params or {}
+        self.source = source
+        self.status = "pending"  # pending / running / succeeded / failed / cancelled
+        self.progress: deque = deque(maxlen=50)
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.exception: Optional[BaseException] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def report(self, message: str, level: str = "info", **fields):
+        """记录一条进度并推送到日志中心"""
+        self.progress.append(message)
+        await log_ingest.submit({
+            "level": level,
+            "source": self.source,
+            "message": message,
+            "job_id": self.job_id,
+            "job_kind": self.kind,
+            "job_status": self.status,
+            **fields,
+        })
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "progress": list(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class OrchestrationJobManager:
+    """在后台协程中执行耗时操作，保留最近的任务记录供查询"""
+
+    def __init__(self, history: int = TOPOLOGY_JOB_HISTORY, source: str = TOPOLOGY_LOG_SOURCE):
+        self.history = history
+        self.source = source
+        self.jobs: "OrderedDict[str, OrchestrationJob]" = OrderedDict()
+
+    def submit(self, kind: str, operation, *args, params: Optional[Dict[str, Any]] = None) -> OrchestrationJob:
+        """提交任务，operation 为协程函数，调用方式为 operation(*args, job=job)"""
+        job = OrchestrationJob(kind, params, self.source)
+        self.jobs[job.job_id] = job
+        job.task = asyncio.create_task(self._run(job, operation, args))
+        self._trim()
+        return job
+
+    async def _run(self, job: OrchestrationJob, operation, args):
+        job.status = "running"
+        job.started_at = time.time()
+        await job.report(f"{job.kind} 开始执行")
+        try:
+            job.result = await operation(*args, job=job)
+            job.status = "succeeded"
+        except asyncio.CancelledError:
+            job.exception = HTTPException(status_code=409, detail=f"Job '{job.job_id}' was cancelled")
+            job.error = "cancelled"
+            job.status = "cancelled"
+        except Exception as e:
+            job.exception = e
+            job.error = e.detail if isinstance(e, HTTPException) else str(e)
+            job.status = "failed"
+        job.finished_at = time.time()
+        if job.status == "succeeded":
+            await job.report(f"{job.kind} 完成，耗时 {job.finished_at - job.started_at:.1f}s", job_result=job.result)
+        elif job.status == "cancelled":
+            await job.report(f"{job.kind} 已取消", level="warning")
+        else:
+            await job.report(f"{job.kind} 失败: {job.error}", level="error")
+
+    async def wait(self, job: OrchestrationJob) -> Any:
+        """等待任务完成并返回结果；请求被取消时任务仍在后台继续执行"""
+        await asyncio.wait({job.task})
+        if job.exception is not None:
+            raise job.exception
+        return job.result
+
+    def cancel(self, job: OrchestrationJob) -> bool:
+        """取消未完成的任务，已完成的任务返回 False"""
+        if job.done or job.task is None:
+            return False
+        job.task.cancel()
+        if job.status == "pending":
+            # 协程还没开始执行，不会进入 _run 的取消处理
+            job.exception = HTTPException(status_code=409, detail=f"Job '{job.job_id}' was cancelled")
+            job.error = "cancelled"
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        return True
+
+    def get(self, job_id: str) -> Optional[OrchestrationJob]:
+        return self.jobs.get(job_id)
+
+    def _trim(self):
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.history:
+                break
+            if self.jobs[job_id].done:
+                del self.jobs[job_id]
+
+
+topology_jobs = OrchestrationJobManager()
+agent_jobs = OrchestrationJobManager(AGENT_JOB_HISTORY, AGENT_JOB_LOG_SOURCE)
+
+
+def find_job(job_id: str) -> Optional[OrchestrationJob]:
+    """在编排任务和智能体任务中查找"""
+    return topology_jobs.get(job_id) or agent_jobs.get(job_id)
+
+
+def job_output(job: Optional[OrchestrationJob]):
+    """把命令输出作为任务进度推送，没有任务时不推送"""
+    return job.report if job is not None else None
+
+
+async def run_job(manager: OrchestrationJobManager, kind: str, operation, *args, async_job: bool = False,
+                  params: Optional[Dict[str, Any]] = None):
+    """提交任务：async_job=True 时立即返回任务ID，否则等待完成后返回结果
+
+    任务记录保存在当前进程内，多worker部署时后续的查询/取消可能落到其他worker上，
+    因此只在单进程部署时接受 async_job。
+    """
+    if async_job and log_pubsub.backend != "memory":
+        raise HTTPException(
+            status_code=400,
+            detail="async_job is only supported with a single backend worker (BACKEND_WORKERS=1)"
+        )
+    job = manager.submit(kind, operation, *args, params=params)
+    if async_job:
+        return JSONResponse(status_code=202, content={"status": "accepted", "job_id": job.job_id, "kind": kind})
+    result = await manager.wait(job)
+    # 智能体可能返回列表或标量，这时原样返回
+    if not isinstance(result, dict):
+        return result
+    return {**result, "job_id": job.job_id}
+
+
+async def run_topology_job(kind: str, operation, *args, async_job: bool = False,
+                           params: Optional[Dict[str, Any]] = None):
+    return await run_job(topology_jobs, kind, operation, *args, async_job=async_job, params=params)
+
+
 class TopologyAction(BaseModel):
     action: str  # start | stop | status
     template: Optional[str] = Field(None, description="Docker compose template name (without .yml extension)")
     config: Optional[Dict[str, Any]] = Field(None, description="Additional configuration parameters")
+    async_job: bool = Field(False, description="为 true 时 start/stop 立即返回任务ID，进度通过 /ws/logs 推送")
 
 @app.post("/topology")
 async def manage_topology(req: TopologyAction):
@@ -54,23 +296,26 @@ async def manage_topology(req: TopologyAction):
         )
     
     if req.action == "start":
-        return _compose_up(compose_file)
+        return await run_topology_job("topology_start", _compose_up, compose_file,
+                                      async_job=req.async_job, params={"template": template})
     if req.action == "stop":
-        return _compose_down(compose_file)
+        return await run_topology_job("topology_stop", _compose_down, compose_file,
+                                      async_job=req.async_job, params={"template": template})
     if req.action == "status":
-        return _compose_ps(compose_file)
+        return await topology_status.get(compose_file, lambda: _compose_ps(compose_file))
     
     logger.error(f"Invalid action: {req.action}")
     raise HTTPException(status_code=400, detail=f"Invalid action: {req.action}")
 
-def _compose_up(compose_file: str):
+async def _compose_up(compose_file: str, job: Optional[OrchestrationJob] = None):
     """启动容器并返回详细信息"""
     try:
         logger.info(f"Starting containers using template: {compose_file}")
-        subprocess.check_call(["docker-compose", "-f", compose_file, "up", "-d"])
+        await run_docker(["docker-compose", "-f", compose_file, "up", "-d"], on_output=job_output(job))
         
         # 返回当前运行的服务信息，以便前端立即渲染容器
-        services_info = _compose_ps(compose_file)
+        services_info = await _compose_ps(compose_file)
+        topology_status.store(compose_file, services_info)
         return {"status": "started", **services_info}
     except subprocess.CalledProcessError as e:
         logger.error(f"Error starting containers: {str(e)}")
@@ -79,11 +324,12 @@ def _compose_up(compose_file: str):
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
-def _compose_down(compose_file: str):
+async def _compose_down(compose_file: str, job: Optional[OrchestrationJob] = None):
     """停止并移除容器"""
     try:
         logger.info(f"Stopping containers from template: {compose_file}")
-        subprocess.check_call(["docker-compose", "-f", compose_file, "down", "--remove-orphans"])
+        await run_docker(["docker-compose", "-f", compose_file, "down", "--remove-orphans"], on_output=job_output(job))
+        topology_status.invalidate(compose_file)
         return {"status": "stopped"}
     except subprocess.CalledProcessError as e:
         logger.error(f"Error stopping containers: {str(e)}")
@@ -92,90 +338,160 @@ def _compose_down(compose_file: str):
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
-def _compose_ps(compose_file: str):
+DOCKER_API_SOCKET = os.getenv("DOCKER_API_SOCKET", "")  # 例如 /var/run/docker.sock，设置后通过 Engine API 查询容器
+DOCKER_API_TIMEOUT = float(os.getenv("DOCKER_API_TIMEOUT", "10"))
+COMPOSE_SERVICE_LABEL = "com.docker.compose.service"
+COMPOSE_PROJECT_LABEL = "com.docker.compose.project"
+
+_docker_api_client: Optional[httpx.AsyncClient] = None
+
+
+def docker_api_client() -> httpx.AsyncClient:
+    """通过Unix套接字访问Docker Engine API的共享客户端"""
+    global _docker_api_client
+    if _docker_api_client is None:
+        _docker_api_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=DOCKER_API_SOCKET),
+            base_url="http://docker",
+            timeout=DOCKER_API_TIMEOUT
+        )
+    return _docker_api_client
+
+
+async def close_docker_api_client():
+    global _docker_api_client
+    if _docker_api_client is not None:
+        await _docker_api_client.aclose()
+        _docker_api_client = None
+
+
+async def docker_inspect(container_ids: List[str]) -> List[Dict[str, Any]]:
+    """一次查询多个容器的详细信息（一次 docker inspect 调用，或并发请求 Engine API）"""
+    if not container_ids:
+        return []
+    if DOCKER_API_SOCKET:
+        client = docker_api_client()
+        responses = await asyncio.gather(*(client.get(f"/containers/{cid}/json") for cid in container_ids))
+        return [r.json() for r in responses if r.status_code == 200]
+
+    # 部分容器已被删除时 docker inspect 返回非0，但仍会输出其余容器的信息
+    result = await run_docker(["docker", "inspect", *container_ids], check=False)
+    if not result.stdout.strip():
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+        return []
+    return json.loads(result.stdout)
+
+
+async def compose_services(compose_file: str) -> List[str]:
+    """读取compose文件中定义的服务名，无法解析时退回 docker-compose ps --services"""
+    try:
+        with open(compose_file, "r", encoding="utf-8") as f:
+            services = (yaml.safe_load(f) or {}).get("services") or {}
+        return list(services)
+    except Exception as e:
+        logger.warning(f"解析compose文件失败，改用 docker-compose ps --services: {str(e)}")
+    output = (await run_docker(["docker-compose", "-f", compose_file, "ps", "--services"])).stdout
+    return output.strip().split("\n") if output and output.strip() else []
+
+
+def container_service_info(service: str, container_info: Dict[str, Any]) -> Dict[str, Any]:
+    """从 docker inspect 的结果提取前端需要的服务信息"""
+    networks = container_info.get("NetworkSettings", {}).get("Networks", {}) or {}
+    ip_addresses = {}
+    for network_name, network_config in networks.items():
+        ip_addresses[network_name] = network_config.get("IPAddress", "")
+
+    # 检查容器状态
+    state = container_info.get("State", {})
+    status = "running" if state.get("Running", False) else "stopped"
+    error_msg = state.get("Error", "") if status == "stopped" else ""
+    health = (state.get("Health") or {}).get("Status")
+    labels = container_info.get("Config", {}).get("Labels") or {}
+
+    return {
+        "name": service,
+        "id": container_info.get("Id", ""),
+        "ip": next(iter(ip_addresses.values()), ""),  # 取第一个IP地址作为主IP
+        "networks": ip_addresses,
+        "status": status,
+        "image": container_info.get("Config", {}).get("Image", ""),
+        "created": container_info.get("Created", ""),
+        "ports": container_info.get("NetworkSettings", {}).get("Ports", {}),
+        "error": error_msg,
+        "health": health,
+        "project": labels.get(COMPOSE_PROJECT_LABEL, "")
+    }
+
+
+async def compose_containers(compose_file: str, cwd: Optional[str] = None,
+                             project: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """查询compose项目的全部容器，返回 服务名 -> docker inspect 结果
+
+    不论服务数量多少，只调用一次 docker-compose ps -q 取得全部容器ID，
+    再用一次 docker inspect 查询所有容器。
+    """
+    cmd = ["docker-compose", "-f", compose_file, "ps", "-q"]
+    if project:
+        cmd[1:1] = ["-p", project, "--project-directory", cwd or TEMPLATES_DIR]
+    container_ids = (await run_docker(cmd, cwd=cwd)).stdout.split()
+    return containers_by_service(await docker_inspect(container_ids))
+
+
+async def project_containers(project: str) -> Dict[str, Dict[str, Any]]:
+    """按compose的项目标签查询项目的全部容器（包括已停止的），返回 服务名 -> docker inspect 结果
+
+    与 compose ps 不同，结果不取决于传入的compose文件，已从新配置中删除的服务的容器也会列出。
+    """
+    result = await run_docker(["docker", "ps", "-aq", "--filter", f"label={COMPOSE_PROJECT_LABEL}={project}"])
+    return containers_by_service(await docker_inspect(result.stdout.split()))
+
+
+def containers_by_service(container_infos: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    containers: Dict[str, Dict[str, Any]] = {}
+    for container_info in container_infos:
+        labels = container_info.get("Config", {}).get("Labels") or {}
+        containers.setdefault(labels.get(COMPOSE_SERVICE_LABEL, ""), container_info)
+    return containers
+
+
+async def _compose_ps(compose_file: str):
     """获取所有容器的详细信息（包括运行中和已停止的）"""
     try:
         logger.info(f"Getting container status for template: {compose_file}")
         
         # 获取所有服务名称（不过滤状态）
-        output = subprocess.check_output(["docker-compose", "-f", compose_file, "ps", "--services"])
-        services: List[str] = output.decode().strip().split("\n") if output and output.decode().strip() else []
+        services = await compose_services(compose_file)
         
         if not services:
             logger.info("No services found")
             return {"running_services": [], "all_services": [], "failed_services": []}
         
-        # 获取详细的容器信息
+        # 一次取得所有容器（包括已停止的）的详细信息
+        containers = await compose_containers(compose_file)
+        
         all_services = []
         running_services = []
         failed_services = []
         
         for service in services:
-            try:
-                # 获取容器ID（可能为空，如果容器未创建）
-                container_id_output = subprocess.check_output(
-                    ["docker-compose", "-f", compose_file, "ps", "-q", service]
-                ).decode().strip()
-                
-                if not container_id_output:
-                    # 容器未创建，记录为失败
-                    failed_services.append({
-                        "name": service,
-                        "status": "not_created",
-                        "error": "Container not created"
-                    })
-                    continue
-                    
-                # 获取容器详细信息
-                container_info = json.loads(subprocess.check_output(
-                    ["docker", "inspect", container_id_output]
-                ).decode())[0]
-                
-                # 提取关键信息
-                networks = container_info.get("NetworkSettings", {}).get("Networks", {})
-                ip_addresses = {}
-                for network_name, network_config in networks.items():
-                    ip_addresses[network_name] = network_config.get("IPAddress", "")
-                
-                # 检查容器状态
-                state = container_info.get("State", {})
-                status = "running" if state.get("Running", False) else "stopped"
-                error_msg = state.get("Error", "") if status == "stopped" else ""
-                
-                # 构建服务信息
-                service_info = {
-                    "name": service,
-                    "id": container_id_output,
-                    "ip": next(iter(ip_addresses.values()), ""),  # 取第一个IP地址作为主IP
-                    "networks": ip_addresses,
-                    "status": status,
-                    "image": container_info.get("Config", {}).get("Image", ""),
-                    "created": container_info.get("Created", ""),
-                    "ports": container_info.get("NetworkSettings", {}).get("Ports", {}),
-                    "error": error_msg
-                }
-                
-                all_services.append(service_info)
-                
-                if status == "running":
-                    running_services.append(service_info)
-                else:
-                    failed_services.append(service_info)
-                    
-            except subprocess.CalledProcessError as e:
-                # 处理命令执行错误
-                failed_services.append({
-                    "name": service,
-                    "status": "error",
-                    "error": str(e)
-                })
-            except Exception as e:
-                # 处理其他错误
+            container_info = containers.get(service)
+            if container_info is None:
+                # 容器未创建，记录为失败
                 failed_services.append({
                     "name": service,
-                    "status": "error",
-                    "error": str(e)
+                    "status": "not_created",
+                    "error": "Container not created"
                 })
+                continue
+            
+            service_info = container_service_info(service, container_info)
+            all_services.append(service_info)
+            
+            if service_info["status"] == "running":
+                running_services.append(service_info)
+            else:
+                failed_services.append(service_info)
         
         logger.info(f"Found {len(running_services)} running services, {len(failed_services)} failed services")
         return {
@@ -190,26 +506,1599 @@ def _compose_ps(compose_file: str):
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+READINESS_CONCURRENCY = int(os.getenv("READINESS_CONCURRENCY", "8"))
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", "60"))
+READINESS_POLL_INTERVAL = float(os.getenv("READINESS_POLL_INTERVAL", "1"))
+READINESS_PROBE_TIMEOUT = float(os.getenv("READINESS_PROBE_TIMEOUT", "2"))
+# 按节点类型（服务名前缀）配置的就绪探测，例如 {"cnt-sql": "tcp:3306", "web": "http:80/"}；
+# 也可以在服务的 labels 中用 readiness.probe=tcp:3306 单独指定
+READINESS_PROBES = json.loads(os.getenv("READINESS_PROBES", "{}"))
+READINESS_PROBE_LABEL = "readiness.probe"
+
+
+def parse_readiness_probe(value: Any) -> Optional[Dict[str, Any]]:
+    """把 "tcp:3306" / "http:80/health" 或字典形式的探测配置统一成字典"""
+    if not value:
+        return None
+    if isinstance(value, dict):
+        return {"type": value.get("type", "tcp"), "port": int(value["port"]), "path": value.get("path", "/")}
+    kind, _, target = str(value).partition(":")
+    port, slash, path = target.partition("/")
+    return {"type": kind, "port": int(port), "path": slash + path or "/"}
+
+
+def service_labels(spec: Dict[str, Any]) -> Dict[str, str]:
+    """compose服务的 labels 可以是列表（k=v）或字典"""
+    labels = spec.get("labels") or {}
+    if isinstance(labels, list):
+        return dict(item.split("=", 1) if "=" in item else (item, "") for item in labels)
+    return {str(k): str(v) for k, v in labels.items()}
+
+
+def readiness_probe_for(service: str, spec: Dict[str, Any],
+                        probes: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """服务的就绪探测：优先使用服务自己的label，其次按服务名前缀匹配节点类型（最长前缀优先）"""
+    label = service_labels(spec or {}).get(READINESS_PROBE_LABEL)
+    if label:
+        return parse_readiness_probe(label)
+    probes = READINESS_PROBES if probes is None else probes
+    matches = [node_type for node_type in probes if service.startswith(node_type)]
+    return parse_readiness_probe(probes[max(matches, key=len)]) if matches else None
+
+
+class ReadinessChecker:
+    """并发检查一组容器是否就绪
+
+    每轮用一次 docker inspect 查询所有尚未就绪的容器，依据结构化的 State 和 healthcheck 状态判断，
+    配置了探测的服务再并发做 TCP/HTTP 探测（并发数受限）。总耗时取决于最慢的容器，而不是所有容器之和。
+    """
+
+    def __init__(self, concurrency: int = READINESS_CONCURRENCY, timeout: float = READINESS_TIMEOUT,
+                 interval: float = READINESS_POLL_INTERVAL, probe_timeout: float = READINESS_PROBE_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+
+    async def wait(self, containers: Dict[str, str], probes: Optional[Dict[str, Optional[Dict[str, Any]]]] = None,
+                   on_progress=None) -> Dict[str, Dict[str, Any]]:
+        """containers 为 服务名 -> 容器ID，返回每个服务的检查结果"""
+        probes = probes or {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        pending = dict(containers)
+        results: Dict[str, Dict[str, Any]] = {}
+
+        while pending:
+            inspected = {info.get("Id", ""): info for info in await docker_inspect(list(pending.values()))}
+            verdicts = await asyncio.gather(*(
+                self._check(service, self._find(inspected, container_id), probes.get(service), semaphore)
+                for service, container_id in pending.items()
+            ))
+            for service, verdict in zip(list(pending), verdicts):
+                if verdict["status"] == "waiting":
+                    results[service] = verdict
+                    continue
+                verdict["ready_after"] = round(time.monotonic() - started, 3)
+                results[service] = verdict
+                del pending[service]
+                if on_progress is not None:
+                    await on_progress(f"{service}: {verdict['status']}"
+                                      + (f" ({verdict['error']})" if verdict.get("error") else ""))
+            if not pending or time.monotonic() - started >= self.timeout:
+                break
+            await asyncio.sleep(self.interval)
+
+        for service in pending:
+            results[service]["status"] = "failed"
+            results[service]["error"] = results[service].get("error") or f"not ready after {self.timeout:.0f}s"
+        return results
+
+    @staticmethod
+    def _find(inspected: Dict[str, Dict[str, Any]], container_id: str) -> Optional[Dict[str, Any]]:
+        if container_id in inspected:
+            return inspected[container_id]
+        # docker-compose ps -q 可能返回短ID
+        return next((info for full_id, info in inspected.items() if full_id.startswith(container_id)), None)
+
+    async def _check(self, service: str, container_info: Optional[Dict[str, Any]],
+                     probe: Optional[Dict[str, Any]], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        if container_info is None:
+            return {"name": service, "status": "failed", "state": "missing", "error": "Container not found"}
+        info = container_service_info(service, container_info)
+        state = container_info.get("State", {})
+        verdict = {"name": service, "id": info["id"], "ip": info["ip"], "state": state.get("Status", ""),
+                   "health": info["health"], "status": "waiting", "error": ""}
+
+        if not state.get("Running", False):
+            if state.get("Status") in ("exited", "dead"):
+                verdict.update(status="failed", error=state.get("Error") or f"exit code {state.get('ExitCode', '')}")
+            return verdict
+        if info["health"] == "unhealthy":
+            verdict.update(status="failed", error="healthcheck unhealthy")
+            return verdict
+        if info["health"] not in (None, "healthy"):
+            return verdict
+
+        if probe is not None:
+            async with semaphore:
+                ok, detail = await self._probe(info["ip"], probe)
+            verdict["probe"] = {**probe, "ok": ok, "detail": detail}
+            if not ok:
+                verdict["error"] = detail
+                return verdict
+        verdict["status"] = "running"
+        return verdict
+
+    async def _probe(self, host: str, probe: Dict[str, Any]) -> Tuple[bool, str]:
+        if not host:
+            return False, "no ip address"
+        try:
+            if probe["type"] == "http":
+                async with httpx.AsyncClient(timeout=self.probe_timeout) as client:
+                    response = await client.get(f"http://{host}:{probe['port']}{probe.get('path', '/')}")
+                return response.status_code < 500, f"HTTP {response.status_code}"
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, probe["port"]), timeout=self.probe_timeout)
+            writer.close()
+            return True, "connected"
+        except Exception as e:
+            return False, str(e) or type(e).__name__
+
+
+readiness_checker = ReadinessChecker()
+
+
+TOPOLOGY_STATUS_MAX_AGE = float(os.getenv("TOPOLOGY_STATUS_MAX_AGE", "300"))
+TOPOLOGY_EVENTS_RETRY = float(os.getenv("TOPOLOGY_EVENTS_RETRY", "5"))
+TOPOLOGY_STATUS_SOURCE = "拓扑状态"
+DOCKER_STATUS_EVENTS = ["create", "start", "stop", "die", "destroy", "health_status"]
+DYNAMIC_STATUS_KEY = "__dynamic__"
+
+
+class TopologyStatusCache:
+    """拓扑状态缓存：首次查询时加载，之后由 docker events 事件流保持最新
+
+    事件流正常时状态查询直接返回内存中的结果，容器状态变化时把增量推送到日志中心；
+    事件流不可用时不使用缓存，每次查询仍直接访问docker（并发的相同查询只执行一次）。
+    """
+
+    def __init__(self, max_age: float = TOPOLOGY_STATUS_MAX_AGE):
+        self.max_age = max_age
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._watch_task: Optional[asyncio.Task] = None
+        self._last_event_time: Optional[int] = None
+        self.watching = False
+        self.hits = 0
+        self.misses = 0
+        self.events = 0
+        self.deltas = 0
+
+    async def get(self, key: str, loader):
+        """返回缓存的状态，缓存不可用时调用 loader() 重新加载"""
+        self.ensure_watching()
+        entry = self.entries.get(key)
+        if entry is not None and self.watching and time.monotonic() - entry["loaded_at"] < self.max_age:
+            self.hits += 1
+            return entry["result"]
+
+        self.misses += 1
+        pending = self._loading.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._load(key, loader))
+            self._loading[key] = pending
+            pending.add_done_callback(lambda f: self._loading.pop(key, None) if self._loading.get(key) is f else None)
+        return await asyncio.shield(pending)
+
+    async def _load(self, key: str, loader):
+        result = await loader()
+        self.store(key, result)
+        return result
+
+    def store(self, key: str, result: Dict[str, Any]):
+        """保存一次完整查询的结果"""
+        if key == DYNAMIC_STATUS_KEY:
+            items = OrderedDict((c.get("id", "")[:12], c) for c in result.get("running_services", []))
+        else:
+            items = OrderedDict()
+            for info in result.get("all_services", []) + result.get("failed_services", []):
+                items.setdefault(info["name"], info)
+        self.entries[key] = {"items": items, "result": result, "loaded_at": time.monotonic()}
+
+    def invalidate(self, key: Optional[str] = None):
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+    @staticmethod
+    def _render(key: str, items: "OrderedDict[str, Dict[str, Any]]") -> Dict[str, Any]:
+        if key == DYNAMIC_STATUS_KEY:
+            return {"status": "success", "running_services": list(items.values())}
+        all_services = [info for info in items.values() if info["status"] != "not_created"]
+        return {
+            "running_services": [info for info in all_services if info["status"] == "running"],
+            "all_services": all_services,
+            "failed_services": [info for info in items.values() if info["status"] != "running"],
+        }
+
+    # ---- docker events ----
+
+    def ensure_watching(self):
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            try:
+                async for event in self._event_stream():
+                    await self._handle_event(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Docker事件流中断: {str(e)}")
+            # 事件流断开期间可能错过变化，缓存全部失效
+            self.watching = False
+            self.invalidate()
+            await asyncio.sleep(TOPOLOGY_EVENTS_RETRY)
+
+    async def _event_stream(self):
+        """逐条产出 docker events 事件，断线重连时从上次收到的事件时间继续"""
+        since = str(self._last_event_time or int(time.time()))
+        if DOCKER_API_SOCKET:
+            params = {
+                "since": since,
+                "filters": json.dumps({"type": ["container"], "event": DOCKER_STATUS_EVENTS}),
+            }
+            async with docker_api_client().stream("GET", "/events", params=params, timeout=None) as response:
+                response.raise_for_status()
+                self.watching = True
+                async for line in response.aiter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+            return
+
+        args = ["docker", "events", "--since", since, "--format", "{{json .}}", "--filter", "type=container"]
+        for event in DOCKER_STATUS_EVENTS:
+            args += ["--filter", f"event={event}"]
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL, limit=DOCKER_OUTPUT_LIMIT
+        )
+        self.watching = True
+        try:
+            async for raw in proc.stdout:
+                if raw.strip():
+                    yield json.loads(raw)
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+            await proc.wait()
+
+    async def _handle_event(self, event: Dict[str, Any]):
+        self.events += 1
+        self._last_event_time = event.get("time") or self._last_event_time
+        action = event.get("Action") or event.get("status", "")
+        kind = action.split(":")[0]
+        actor = event.get("Actor") or {}
+        container_id = actor.get("ID") or event.get("id", "")
+        attributes = actor.get("Attributes") or {}
+        service = attributes.get(COMPOSE_SERVICE_LABEL)
+        inspected: Optional[List[Dict[str, Any]]] = None
+
+        for key, entry in list(self.entries.items()):
+            items = entry["items"]
+            if key == DYNAMIC_STATUS_KEY:
+                # 动态拓扑只列出运行中的容器，根据事件即可更新
+                short_id = container_id[:12]
+                if kind == "start":
+                    item = {"id": short_id, "name": attributes.get("name", ""), "status": "running",
+                            "image": attributes.get("image", "")}
+                elif kind in ("stop", "die", "destroy") and short_id in items:
+                    item = None
+                else:
+                    continue
+                old = items.pop(short_id, None)
+                if item is not None:
+                    items[short_id] = item
+                await self._publish_delta(key, entry, item or old, action)
+                continue
+
+            if not service or service not in items:
+                continue
+            project = items[service].get("project")
+            if project and attributes.get(COMPOSE_PROJECT_LABEL, project) != project:
+                continue
+            if kind == "destroy":
+                info = {"name": service, "status": "not_created", "error": "Container not created"}
+            else:
+                if inspected is None:
+                    inspected = await docker_inspect([container_id])
+                if not inspected:
+                    continue
+                info = container_service_info(service, inspected[0])
+            old = items[service]
+            items[service] = info
+            if (old.get("status"), old.get("health"), old.get("ip")) != (info["status"], info.get("health"), info.get("ip")):
+                await self._publish_delta(key, entry, info, action)
+
+    async def _publish_delta(self, key: str, entry: Dict[str, Any], info: Dict[str, Any], action: str):
+        entry["result"] = self._render(key, entry["items"])
+        self.deltas += 1
+        topology = "dynamic" if key == DYNAMIC_STATUS_KEY else os.path.splitext(os.path.basename(key))[0]
+        await log_ingest.submit({
+            "level": "info",
+            "source": TOPOLOGY_STATUS_SOURCE,
+            "message": f"{info.get('name', '')} {action} ({info.get('id', '')[:12]} @ {time.strftime('%H:%M:%S')})",
+            "topology_delta": {"topology": topology, "action": action, "service": info},
+        })
+
+    async def stop(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+        self.watching = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "watching": self.watching,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "events": self.events,
+            "deltas": self.deltas,
+        }
+
+
+topology_status = TopologyStatusCache()
+
 # WebSocket连接管理
-connected_clients: Set[WebSocket] = set()
-# 添加日志去重缓存
-log_cache: Set[str] = set()
+# 每个订阅者的发送队列上限，以及队列满时的处理策略:
+#   drop_oldest    - 丢弃队列中最旧的一条
+#   drop_low_level - 优先丢弃 debug/info 级别的日志，没有可丢弃的再丢最旧的
+#   disconnect     - 直接断开跟不上的慢客户端
+LOG_CLIENT_QUEUE_SIZE = int(os.getenv("LOG_CLIENT_QUEUE_SIZE", "500"))
+LOG_CLIENT_OVERFLOW_POLICY = os.getenv("LOG_CLIENT_OVERFLOW_POLICY", "drop_oldest")
+LOW_PRIORITY_LEVELS = {"debug", "info"}
+OVERFLOW_POLICIES = {"drop_oldest", "drop_low_level", "disconnect"}
+
+# 日志中心监控指标，以Prometheus文本格式从 /metrics 导出
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+
+
+class Histogram:
+    """简单的累积直方图，桶的含义与Prometheus一致(le)"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def render(self, name: str, labels: Dict[str, str]) -> List[str]:
+        lines = []
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f"{name}_bucket{_format_labels({**labels, 'le': repr(bound)})} {count}")
+        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {self.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {self.count}")
+        return lines
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class LogHubMetrics:
+    """按来源统计的日志计数以及事件循环延迟"""
+
+    COUNTERS = {
+        "ingested": "收到的日志数",
+        "deduplicated": "被去重丢弃的日志数",
+        "filtered": "被过滤规则丢弃的日志数",
+        "broadcast": "分配序号并广播的日志数",
+    }
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[str, int]] = {name: {} for name in self.COUNTERS}
+        self.event_loop_lag = Histogram()
+        self.last_event_loop_lag = 0.0
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def inc(self, counter: str, source: str):
+        by_source = self.counters[counter]
+        by_source[source] = by_source.get(source, 0) + 1
+
+    def start_lag_monitor(self, interval: float = EVENT_LOOP_LAG_INTERVAL):
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = asyncio.create_task(self._monitor_lag(interval))
+
+    async def _monitor_lag(self, interval: float):
+        """定时休眠，实际唤醒时间比预期晚多少即为事件循环延迟"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - started - interval)
+            self.last_event_loop_lag = lag
+            self.event_loop_lag.observe(lag)
+
+    def stop_lag_monitor(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+
+class LogFilter:
+    """订阅过滤条件：来源(子串匹配)、级别、攻击阶段，各维度为空时表示不限制
+
+    来源匹配结果按来源字符串缓存，日志来源种类很少，每个来源只需匹配一次。
+    """
+
+    MAX_SOURCE_INDEX = 256
+
+    def __init__(self, sources: Optional[List[str]] = None, levels: Optional[List[str]] = None,
+                 stages: Optional[List[str]] = None):
+        self.sources = [str(source) for source in sources or [] if source]
+        self.levels = {str(level).lower() for level in levels or [] if level}
+        self.stages = {str(stage) for stage in stages or [] if stage}
+        self._source_index: Dict[str, bool] = {}
+
+    def match_source(self, source: str) -> bool:
+        if not self.sources:
+            return True
+        matched = self._source_index.get(source)
+        if matched is None:
+            matched = any(pattern in source for pattern in self.sources)
+            if len(self._source_index) >= self.MAX_SOURCE_INDEX:
+                self._source_index.clear()
+            self._source_index[source] = matched
+        return matched
+
+    def matches(self, source: str, level: str, stage: Optional[str]) -> bool:
+        if self.levels and level not in self.levels:
+            return False
+        if self.stages and stage not in self.stages:
+            return False
+        return self.match_source(source)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "sources": self.sources,
+            "levels": sorted(self.levels),
+            "stages": sorted(self.stages),
+        }
+
+
+class LogSubscriber:
+    """WebSocket订阅者：拥有独立的有界发送队列和写协程，慢客户端不会拖慢其他客户端"""
+
+    def __init__(self, websocket: WebSocket, max_queue: int = LOG_CLIENT_QUEUE_SIZE,
+                 overflow_policy: str = LOG_CLIENT_OVERFLOW_POLICY):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            logger.warning(f"未知的队列溢出策略 {overflow_policy}，改用 drop_oldest")
+            overflow_policy = "drop_oldest"
+        self.websocket = websocket
+        client = getattr(websocket, "client", None)
+        self.client_id = f"{client.host}:{client.port}" if client else f"client-{id(websocket):x}"
+        self.max_queue = max(1, max_queue)
+        self.overflow_policy = overflow_policy
+        self.send_latency = Histogram()
+        # 日志记录的传输编码：json 文本帧或 msgpack 二进制帧，控制消息始终为JSON文本帧
+        self.encoding = "json"
+        # 队列元素为 (level, frame, seq)，frame 为已编码好的 str/bytes，控制消息的 seq 为 None
+        self.queue: deque = deque()
+        self.closed = False
+        # 订阅过滤条件，None 表示接收全部日志
+        self.log_filter: Optional[LogFilter] = None
+        # 开启后，因队列溢出丢弃日志时会在下一条消息前发送 {"type": "gap"} 通知
+        self.gap_detection = False
+        self._missed: Optional[Dict[str, int]] = None
+        # 批处理：window 秒内或满 batch_max 条的日志合并成一个数组帧，默认关闭
+        self.batch_window = 0.0
+        self.batch_max = 1
+        self.batches_sent = 0
+        self.sent_count = 0
+        self.dropped_count = 0
+        # 队列中控制消息的数量；有控制消息时不等待批处理窗口，立即发送
+        self._control_pending = 0
+        self._wakeup = asyncio.Event()
+        self._flush = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """启动写协程"""
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, frame: Any, level: str = "info", seq: Optional[int] = None) -> bool:
+        """非阻塞入队，返回该消息是否被接收"""
+        if self.closed:
+            return False
+
+        if len(self.queue) >= self.max_queue:
+            if self.overflow_policy == "disconnect":
+                logger.warning(f"WebSocket客户端发送队列已满({self.max_queue})，断开慢客户端")
+                self.disconnect(code=1013)
+                return False
+            if self.overflow_policy == "drop_low_level" and not self._drop_low_level(level):
+                self._record_drop(seq)
+                return False
+            if self.overflow_policy == "drop_oldest" or len(self.queue) >= self.max_queue:
+                self._record_drop(self._pop(0))
+
+        self.queue.append((level, frame, seq))
+        if seq is None:
+            self._control_pending += 1
+            self._flush.set()
+        self._wakeup.set()
+        return True
+
+    def _pop(self, index: int) -> Optional[int]:
+        """移除队列中的一条消息，返回其序号"""
+        _, _, seq = self.queue[index]
+        del self.queue[index]
+        if seq is None:
+            self._control_pending -= 1
+        return seq
+
+    def _drop_low_level(self, level: str) -> bool:
+        """为新消息腾出位置，返回是否应继续入队"""
+        if level in LOW_PRIORITY_LEVELS:
+            # 新消息本身是低级别日志，直接丢弃新消息
+            return False
+        for index, (queued_level, _, _) in enumerate(self.queue):
+            if queued_level in LOW_PRIORITY_LEVELS:
+                self._record_drop(self._pop(index))
+                return True
+        # 队列中没有低级别日志，退化为丢弃最旧的一条
+        return True
+
+    def _record_drop(self, seq: Optional[int]):
+        """记录被丢弃的日志序号范围，用于缺口通知"""
+        self.dropped_count += 1
+        if seq is None or not self.gap_detection:
+            return
+        # 缺口通知属于控制消息，不等待批处理窗口
+        self._flush.set()
+        if self._missed is None:
+            self._missed = {"first_seq": seq, "last_seq": seq, "count": 1}
+        else:
+            self._missed["first_seq"] = min(self._missed["first_seq"], seq)
+            self._missed["last_seq"] = max(self._missed["last_seq"], seq)
+            self._missed["count"] += 1
+
+    def _next_frame(self) -> Tuple[Any, int]:
+        """取出下一帧；开启批处理时把连续的同类型日志记录合并为一个数组帧"""
+        _, frame, seq = self.queue[0]
+        self._pop(0)
+        if self.batch_max <= 1 or seq is None:
+            return frame, 1
+
+        frames = [frame]
+        while self.queue and len(frames) < self.batch_max:
+            _, next_frame, next_seq = self.queue[0]
+            # 控制消息和不同编码的帧不合并
+            if next_seq is None or type(next_frame) is not type(frame):
+                break
+            self.queue.popleft()
+            frames.append(next_frame)
+        if len(frames) == 1:
+            return frame, 1
+        # 已编码的帧直接拼接，无需重新编码
+        if isinstance(frame, bytes):
+            return msgpack.Packer().pack_array_header(len(frames)) + b"".join(frames), len(frames)
+        return "[" + ",".join(frames) + "]", len(frames)
+
+    async def _writer(self):
+        """逐条发送队列中的消息，发送失败时清理该订阅者"""
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                if (self.batch_window > 0 and len(self.queue) < self.batch_max
+                        and not self._control_pending and self._missed is None):
+                    # 等待一个批处理窗口，把窗口内产生的日志合并成一帧发送；
+                    # 期间有控制消息(缺口通知、补发完成、订阅确认等)入队时立即结束等待
+                    self._flush.clear()
+                    try:
+                        await asyncio.wait_for(self._flush.wait(), timeout=self.batch_window)
+                    except asyncio.TimeoutError:
+                        pass
+                    if not self.queue:
+                        continue
+                if self._missed is not None:
+                    # 先告知客户端缺失的序号范围，客户端可据此发送 resume 补齐
+                    gap, self._missed = self._missed, None
+                    await self.websocket.send_text(encode_log_frame({"type": "gap", **gap}))
+                frame, count = self._next_frame()
+                started = time.perf_counter()
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                self.send_latency.observe(time.perf_counter() - started)
+                self.sent_count += count
+                if count > 1:
+                    self.batches_sent += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"向WebSocket客户端发送消息失败: {str(e)}")
+            self.close()
+
+    def disconnect(self, code: int = 1000):
+        """主动断开客户端连接"""
+        self.close()
+        asyncio.create_task(self._close_websocket(code))
+
+    async def _close_websocket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def close(self):
+        """停止写协程并从连接列表中移除"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self._control_pending = 0
+        connected_clients.pop(self.websocket, None)
+        log_subscriber_index.discard(self)
+        if self._writer_task and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+
+
+class LogSubscriberIndex:
+    """按级别索引订阅者，并按 (来源, 级别) 缓存匹配的订阅者列表
+
+    分发日志时只需一次字典查找即可得到候选订阅者，不必逐个检查每个订阅者的过滤条件；
+    订阅条件变化或客户端断开时清空路由缓存。阶段过滤只对设置了 stages 的订阅者逐条检查。
+    """
+
+    MAX_ROUTES = 1024
+
+    def __init__(self):
+        # 级别 -> 订阅者集合，键 None 表示不限制级别的订阅者
+        self._by_level: Dict[Optional[str], Set[LogSubscriber]] = defaultdict(set)
+        self._levels: Dict[LogSubscriber, Tuple[Optional[str], ...]] = {}
+        # (source, level) -> 匹配来源和级别的订阅者
+        self._routes: Dict[Tuple[str, str], Tuple[LogSubscriber, ...]] = {}
+        self.route_hits = 0
+        self.route_misses = 0
+
+    def update(self, subscriber: LogSubscriber):
+        """新连接或订阅条件变化时调用"""
+        self._unlink(subscriber)
+        log_filter = subscriber.log_filter
+        levels: Tuple[Optional[str], ...] = tuple(log_filter.levels) if log_filter and log_filter.levels else (None,)
+        for level in levels:
+            self._by_level[level].add(subscriber)
+        self._levels[subscriber] = levels
+        self._routes.clear()
+
+    def discard(self, subscriber: LogSubscriber):
+        if self._unlink(subscriber):
+            self._routes.clear()
+
+    def _unlink(self, subscriber: LogSubscriber) -> bool:
+        levels = self._levels.pop(subscriber, None)
+        if levels is None:
+            return False
+        for level in levels:
+            bucket = self._by_level.get(level)
+            if bucket is not None:
+                bucket.discard(subscriber)
+                if not bucket:
+                    del self._by_level[level]
+        return True
+
+    def lookup(self, source: str, level: str, stage: Optional[str]) -> List[LogSubscriber]:
+        """返回应接收该日志的订阅者"""
+        key = (source, level)
+        candidates = self._routes.get(key)
+        if candidates is None:
+            self.route_misses += 1
+            candidates = tuple(
+                subscriber
+                for bucket_level in (None, level)
+                for subscriber in self._by_level.get(bucket_level, ())
+                if subscriber.log_filter is None or subscriber.log_filter.match_source(source)
+            )
+            if len(self._routes) >= self.MAX_ROUTES:
+                self._routes.clear()
+            self._routes[key] = candidates
+        else:
+            self.route_hits += 1
+        return [
+            subscriber for subscriber in candidates
+            if subscriber.log_filter is None or not subscriber.log_filter.stages
+            or stage in subscriber.log_filter.stages
+        ]
+
+    def __len__(self):
+        return len(self._levels)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self._levels),
+            "levels": {str(level or "*"): len(bucket) for level, bucket in self._by_level.items()},
+            "routes": len(self._routes),
+            "route_hits": self.route_hits,
+            "route_misses": self.route_misses,
+        }
+
+
+LOG_DEDUP_MAX_ENTRIES = int(os.getenv("LOG_DEDUP_MAX_ENTRIES", "1000"))
+LOG_DEDUP_TTL = float(os.getenv("LOG_DEDUP_TTL", "60"))
+
+
+class LogDedupCache:
+    """带时间窗口的LRU去重缓存，插入、查询、过期均为O(1)
+
+    键为 source:message 的64位非加密哈希(crc32与adler32拼接)，结果在进程间确定。
+    在窗口内再次出现的日志视为重复，并刷新其时间戳和LRU位置。
+    """
+
+    def __init__(self, max_entries: int = LOG_DEDUP_MAX_ENTRIES, ttl: float = LOG_DEDUP_TTL):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        # key -> 最近一次出现的时间，按最近使用顺序排列
+        self._entries: "OrderedDict[int, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(source: str, message: str) -> int:
+        data = f"{source}:{message}".encode("utf-8")
+        return (zlib.crc32(data) << 32) | zlib.adler32(data)
+
+    def _expire(self, now: float):
+        # 最旧的条目在最前面，遇到未过期的就可以停止
+        while self._entries:
+            key, seen_at = next(iter(self._entries.items()))
+            if now - seen_at < self.ttl:
+                break
+            self._entries.popitem(last=False)
+            self.expirations += 1
+
+    def is_duplicate(self, source: str, message: str) -> bool:
+        """判断日志是否在窗口内出现过，并记录本次出现"""
+        now = time.monotonic()
+        self._expire(now)
+        key = self.make_key(source, message)
+
+        if key in self._entries:
+            self.hits += 1
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            return True
+
+        self.misses += 1
+        self._entries[key] = now
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# 日志持久化：分段的追加写日志文件，用于断线重连后的补发和演练复盘
+LOG_JOURNAL_DIR = os.getenv("LOG_JOURNAL_DIR", os.path.join(os.path.dirname(__file__), "log_journal"))
+LOG_JOURNAL_SEGMENT_BYTES = int(os.getenv("LOG_JOURNAL_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+LOG_JOURNAL_MAX_SEGMENTS = int(os.getenv("LOG_JOURNAL_MAX_SEGMENTS", "50"))
+LOG_JOURNAL_COMPRESS = os.getenv("LOG_JOURNAL_COMPRESS", "0") == "1"
+LOG_JOURNAL_MEMORY_RECORDS = int(os.getenv("LOG_JOURNAL_MEMORY_RECORDS", "2000"))
+LOG_REPLAY_MAX_LIMIT = 5000
+
+
+class LogJournal:
+    """分段追加写的日志文件
+
+    每条记录为 4字节长度 + 8字节序号 + JSON文本，单个分段超过大小后切换到新分段，
+    可选把写满的分段gzip压缩。写文件在单独的线程中进行，不阻塞事件循环；
+    最近的记录同时保存在内存中，重连补发时优先从内存读取。
+    """
+
+    RECORD_HEADER = struct.Struct(">IQ")
+    SEGMENT_PREFIX = "segment-"
+
+    def __init__(self, directory: str = LOG_JOURNAL_DIR, segment_bytes: int = LOG_JOURNAL_SEGMENT_BYTES,
+                 max_segments: int = LOG_JOURNAL_MAX_SEGMENTS, compress: bool = LOG_JOURNAL_COMPRESS,
+                 memory_records: int = LOG_JOURNAL_MEMORY_RECORDS):
+        self.directory = directory
+        self.segment_bytes = max(1024, segment_bytes)
+        self.max_segments = max(1, max_segments)
+        self.compress = compress
+        self.enabled = True
+        # 多worker部署时只有主worker写文件，其他worker只在内存中保留最近的记录
+        self.writable = True
+        self.last_seq = 0
+        self.records_written = 0
+        self.bytes_written = 0
+        # 最近的 (seq, frame)，用于快速补发
+        self.recent: deque = deque(maxlen=max(1, memory_records))
+        self._pending: List[Tuple[int, bytes]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # 单线程执行器保证写入和读取按提交顺序执行
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._segment_file = None
+        self._segment_size = 0
+        try:
+            self._recover()
+        except OSError as e:
+            logger.error(f"日志持久化目录不可用，已禁用持久化: {str(e)}")
+            self.enabled = False
+
+    def _segment_paths(self) -> List[Tuple[int, str]]:
+        """返回按起始序号排序的 (起始序号, 路径) 列表"""
+        segments = []
+        for name in os.listdir(self.directory):
+            if not name.startswith(self.SEGMENT_PREFIX):
+                continue
+            try:
+                first_seq = int(name[len(self.SEGMENT_PREFIX):].split(".")[0])
+            except ValueError:
+                continue
+            segments.append((first_seq, os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def _iter_segment(self, path: str):
+        """逐条读取分段中的 (seq, payload)，遇到不完整的尾部记录时停止"""
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            while True:
+                header = f.read(self.RECORD_HEADER.size)
+                if len(header) < self.RECORD_HEADER.size:
+                    return
+                length, seq = self.RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                yield seq, payload
+
+    def _recover(self):
+        """启动时从分段恢复序号，恢复结果不会小于内存中已有的序号
+
+        只读取不修改已有分段（其他worker可能正在写），下一次写入时总是新开一个分段，
+        旧分段末尾写了一半的记录在读取时会被忽略。最新的分段可能是空的或被截断
+        （新开分段后还没来得及写入就崩溃），这时向前找到最后一个有记录的分段；
+        分段文件名中的起始序号已经分配出去，也作为序号的下限。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segment_paths()
+        if not segments:
+            return
+        recovered = segments[-1][0]
+        for _, path in reversed(segments):
+            last = None
+            try:
+                for seq, _ in self._iter_segment(path):
+                    last = seq
+            except (OSError, EOFError, zlib.error) as e:
+                logger.warning(f"读取日志分段 {path} 失败: {str(e)}")
+            if last is not None:
+                recovered = max(recovered, last)
+                break
+        self.last_seq = max(self.last_seq, recovered)
+        logger.info(f"日志持久化已恢复，最后序号: {self.last_seq}")
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-journal")
+        return self._executor
+
+    def next_seq(self) -> int:
+        self.last_seq += 1
+        return self.last_seq
+
+    def append(self, seq: int, frame: str):
+        """记录一条已编码的日志，实际写文件在后台完成"""
+        self.recent.append((seq, frame))
+        self.last_seq = max(self.last_seq, seq)
+        if not self.enabled or not self.writable:
+            return
+        self._pending.append((seq, frame.encode("utf-8")))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flusher())
+
+    async def _flusher(self):
+        loop = asyncio.get_running_loop()
+        while self._pending and self.enabled:
+            batch, self._pending = self._pending, []
+            try:
+                await loop.run_in_executor(self._get_executor(), self._write_batch, batch)
+            except OSError as e:
+                logger.error(f"写入日志文件失败，已禁用持久化: {str(e)}")
+                self.enabled = False
+                self._pending.clear()
+
+    def _write_batch(self, batch: List[Tuple[int, bytes]]):
+        for seq, payload in batch:
+            if self._segment_file is None or self._segment_size >= self.segment_bytes:
+                self._rotate(seq)
+            self._segment_file.write(self.RECORD_HEADER.pack(len(payload), seq))
+            self._segment_file.write(payload)
+            self._segment_size += self.RECORD_HEADER.size + len(payload)
+            self.records_written += 1
+            self.bytes_written += self.RECORD_HEADER.size + len(payload)
+        self._segment_file.flush()
+
+    def _rotate(self, first_seq: int):
+        """关闭当前分段（可选压缩），打开以 first_seq 命名的新分段，并清理过旧的分段"""
+        if self._segment_file is not None:
+            closed_path = self._segment_file.name
+            self._segment_file.close()
+            if self.compress:
+                with open(closed_path, "rb") as src, gzip.open(closed_path + ".gz", "wb") as dst:
+                    dst.write(src.read())
+                os.unlink(closed_path)
+        path = os.path.join(self.directory, f"{self.SEGMENT_PREFIX}{first_seq:020d}.log")
+        self._segment_file = open(path, "ab")
+        self._segment_size = 0
+        for _, old_path in self._segment_paths()[:-self.max_segments]:
+            os.unlink(old_path)
+
+    def _read_from_disk(self, since: int, limit: int) -> List[Tuple[int, str]]:
+        segments = self._segment_paths()
+        # 从最后一个起始序号不大于 since+1 的分段开始读
+        start = 0
+        for index, (first_seq, _) in enumerate(segments):
+            if first_seq <= since + 1:
+                start = index
+        records = []
+        for _, path in segments[start:]:
+            for seq, payload in self._iter_segment(path):
+                if seq <= since:
+                    continue
+                records.append((seq, payload.decode("utf-8")))
+                if len(records) >= limit:
+                    return records
+        return records
+
+    async def replay(self, since: int, limit: int = 1000) -> List[Tuple[int, str]]:
+        """返回序号大于 since 的记录 (seq, frame)，最多 limit 条"""
+        limit = max(1, min(limit, LOG_REPLAY_MAX_LIMIT))
+        if not self.enabled or (self.recent and self.recent[0][0] <= since + 1):
+            return [(seq, frame) for seq, frame in self.recent if seq > since][:limit]
+
+        loop = asyncio.get_running_loop()
+        records = await loop.run_in_executor(self._get_executor(), self._read_from_disk, since, limit)
+        # 还在等待写盘的记录从内存补齐
+        last_disk_seq = records[-1][0] if records else since
+        for seq, frame in self.recent:
+            if len(records) >= limit:
+                break
+            if seq > last_disk_seq:
+                records.append((seq, frame))
+        return records
+
+    async def close(self):
+        """写完剩余记录并关闭文件"""
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._segment_file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "last_seq": self.last_seq,
+            "records_written": self.records_written,
+            "bytes_written": self.bytes_written,
+            "pending": len(self._pending),
+            "compress": self.compress,
+        }
+
+
+LOG_INGEST_QUEUE_SIZE = int(os.getenv("LOG_INGEST_QUEUE_SIZE", "5000"))
+LOG_INGEST_PUT_TIMEOUT = float(os.getenv("LOG_INGEST_PUT_TIMEOUT", "0.5"))
+
+
+class LogIngestQueue:
+    """发布者与广播之间的有界接收队列
+
+    发布者只负责入队即可返回，由单个分发协程按顺序执行去重、持久化和广播，
+    保证序号顺序。队列满时最多等待 put_timeout 秒，超时则丢弃并计数。
+    """
+
+    def __init__(self, maxsize: int = LOG_INGEST_QUEUE_SIZE, put_timeout: float = LOG_INGEST_PUT_TIMEOUT):
+        self.maxsize = max(1, maxsize)
+        self.put_timeout = put_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def start(self):
+        """启动分发协程（首次提交时也会自动启动）"""
+        if self._dispatcher is None or self._dispatcher.done():
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def submit(self, log_data: dict) -> bool:
+        """提交一条日志，返回是否成功入队"""
+        self.start()
+        item = (log_data, time.monotonic())
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(item), timeout=self.put_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                logger.warning(f"日志接收队列已满({self.maxsize})，丢弃日志: {log_data.get('source', '')}")
+                return False
+        self.enqueued += 1
+        return True
+
+    async def _dispatch(self):
+        while True:
+            log_data, enqueued_at = await self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            try:
+                await log_pubsub.ingest(log_data)
+            except Exception as e:
+                logger.error(f"广播日志失败: {str(e)}")
+            finally:
+                self.dispatched += 1
+                self._queue.task_done()
+
+    async def stop(self, timeout: float = 5.0):
+        """处理完队列中剩余的日志后停止分发协程"""
+        if self._dispatcher is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"关闭时仍有 {self._queue.qsize()} 条日志未处理")
+        self._dispatcher.cancel()
+        self._dispatcher = None
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth(),
+            "max_size": self.maxsize,
+            "enqueued": self.enqueued,
+            "dispatched": self.dispatched,
+            "dropped": self.dropped,
+            "avg_wait_ms": round(self.total_wait / self.dispatched * 1000, 3) if self.dispatched else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+LOG_FILTER_RULES_FILE = os.getenv("LOG_FILTER_RULES_FILE", os.path.join(os.path.dirname(__file__), "log_filter_rules.json"))
+
+
+class LogFilterRule(BaseModel):
+    """广播前的日志过滤规则"""
+    name: str = Field(description="规则名称，用于统计命中次数")
+    action: str = Field("drop", description="drop: 命中即丢弃；keep: 来源匹配但未命中时丢弃")
+    sources: List[str] = Field(default_factory=list, description="适用的日志来源(不区分大小写)，为空表示全部来源")
+    keywords: List[str] = Field(default_factory=list, description="关键字，按字面匹配")
+    patterns: List[str] = Field(default_factory=list, description="正则表达式")
+
+
+# 默认规则：中控智能体的内部日志只放行重要的状态更新
+DEFAULT_LOG_FILTER_RULES = [
+    LogFilterRule(
+        name="central_agent_internal",
+        action="keep",
+        sources=["中控智能体", "central_agent"],
+        keywords=["攻击完成", "攻击失败", "开始攻击", "攻击结束"],
+    ),
+]
+
+
+class LogFilterStage:
+    """广播前按规则过滤日志，只对适用于该来源的规则求值
+
+    所有规则的关键字转小写后合并成一个按长度降序的字面量分支正则，对转小写后的日志扫描一次，
+    命中的字面量通过映射表找到对应的规则(被更长关键字包含的短关键字一并计入)；
+    正则规则逐条单独编译，保证 \\1 等反向引用按用户写法生效，且只在关键字未命中时才执行。
+    """
+
+    MAX_SOURCE_INDEX = 256
+
+    def __init__(self, rules: List[LogFilterRule]):
+        self.load(rules)
+
+    def load(self, rules: List[LogFilterRule]):
+        """编译规则并重置计数，规则不合法时抛出 ValueError 且保留原规则"""
+        compiled_rules = []
+        keyword_rules: Dict[str, Set[int]] = defaultdict(set)
+        for index, rule in enumerate(rules):
+            if rule.action not in ("drop", "keep"):
+                raise ValueError(f"规则 {rule.name} 的 action 必须是 drop 或 keep")
+            patterns = []
+            for pattern in rule.patterns:
+                try:
+                    patterns.append(re.compile(pattern, re.IGNORECASE))
+                except re.error as e:
+                    raise ValueError(f"规则 {rule.name} 的正则表达式无效: {pattern} ({e})")
+            for keyword in rule.keywords:
+                if keyword:
+                    keyword_rules[keyword.lower()].add(index)
+            compiled_rules.append((index, rule, {source.lower() for source in rule.sources}, patterns))
+
+        # 文本中出现某个关键字时，被它包含的其他关键字也一定出现
+        literal_rules = {
+            literal: frozenset().union(*(ids for keyword, ids in keyword_rules.items() if keyword in literal))
+            for literal in keyword_rules
+        }
+        keyword_matcher = None
+        if literal_rules:
+            # 同一位置优先匹配最长的关键字；不使用 IGNORECASE，正则引擎才能按首字符快速跳过
+            literals = sorted(literal_rules, key=len, reverse=True)
+            keyword_matcher = re.compile("|".join(re.escape(literal) for literal in literals))
+
+        self.rules = rules
+        self._compiled_rules = compiled_rules
+        self._literal_rules = literal_rules
+        self._keyword_matcher = keyword_matcher
+        self._keyword_rule_ids = frozenset().union(*literal_rules.values()) if literal_rules else frozenset()
+        self._source_index: Dict[str, list] = {}
+        self.hits: Dict[str, int] = {rule.name: 0 for rule in rules}
+        self.drops: Dict[str, int] = {rule.name: 0 for rule in rules}
+
+    def _applicable(self, source: str) -> list:
+        """适用于该来源的规则，按来源缓存"""
+        applicable = self._source_index.get(source)
+        if applicable is None:
+            source_lower = source.lower()
+            applicable = [item for item in self._compiled_rules if not item[2] or source_lower in item[2]]
+            if len(self._source_index) >= self.MAX_SOURCE_INDEX:
+                self._source_index.clear()
+            self._source_index[source] = applicable
+        return applicable
+
+    def _keyword_hits(self, message: str, wanted: Set[int]) -> Set[int]:
+        """扫描一次消息，返回 wanted 中关键字命中的规则"""
+        matched: Set[int] = set()
+        text = message.lower()
+        match = self._keyword_matcher.search(text)
+        while match is not None:
+            matched |= self._literal_rules[match.group()] & wanted
+            if matched == wanted:
+                break
+            # 从下一个字符继续，重叠出现的关键字也能被找到
+            match = self._keyword_matcher.search(text, match.start() + 1)
+        return matched
+
+    def allow(self, source: str, message: str) -> bool:
+        """判断日志是否应继续广播"""
+        applicable = self._applicable(source)
+        if not applicable:
+            return True
+
+        keyword_hits = None
+        for index, rule, _, patterns in applicable:
+            hit = False
+            if index in self._keyword_rule_ids:
+                if keyword_hits is None:
+                    wanted = {item[0] for item in applicable} & self._keyword_rule_ids
+                    keyword_hits = self._keyword_hits(message, wanted)
+                hit = index in keyword_hits
+            if not hit:
+                hit = any(pattern.search(message) for pattern in patterns)
+            if hit:
+                self.hits[rule.name] += 1
+            if (rule.action == "drop" and hit) or (rule.action == "keep" and not hit):
+                self.drops[rule.name] += 1
+                logger.debug(f"日志被规则 {rule.name} 过滤: {source} - {message[:50]}")
+                return False
+        return True
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {**rule.model_dump(), "hits": self.hits[rule.name], "drops": self.drops[rule.name]}
+            for rule in self.rules
+        ]
+
+
+def load_log_filter_rules(path: str = LOG_FILTER_RULES_FILE) -> List[LogFilterRule]:
+    """从JSON文件读取过滤规则，文件不存在时使用默认规则"""
+    if not os.path.exists(path):
+        return list(DEFAULT_LOG_FILTER_RULES)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [LogFilterRule(**rule) for rule in json.load(f)]
+    except Exception as e:
+        logger.error(f"读取日志过滤规则失败，使用默认规则: {str(e)}")
+        return list(DEFAULT_LOG_FILTER_RULES)
+
+
+# 多worker部署时的日志发布/订阅配置
+LOG_PUBSUB_BACKEND = os.getenv("LOG_PUBSUB_BACKEND", "memory")  # memory / unix
+LOG_PUBSUB_SOCKET = os.getenv(
+    "LOG_PUBSUB_SOCKET", os.path.join(tempfile.gettempdir(), "aginst_agent_loghub.sock")
+)
+LOG_PUBSUB_RECONNECT_INTERVAL = float(os.getenv("LOG_PUBSUB_RECONNECT_INTERVAL", "0.5"))
+LOG_PUBSUB_MAX_BUFFER = int(os.getenv("LOG_PUBSUB_MAX_BUFFER", str(8 * 1024 * 1024)))
+LOG_PUBSUB_PENDING_MAX = int(os.getenv("LOG_PUBSUB_PENDING_MAX", "10000"))  # 主worker不可用时follower最多暂存的日志条数
+
+
+class InProcessLogPubSub:
+    """单进程部署（默认）：日志在本进程内处理，并直接分发给本进程的订阅者"""
+
+    backend = "memory"
+
+    def __init__(self):
+        self.role = "standalone"
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def ingest(self, log_data: dict) -> Optional[int]:
+        return await broadcast_log(log_data)
+
+    def publish(self, seq: int, log_data: dict, frame: str):
+        fan_out_log(seq, log_data, frame)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "role": self.role}
+
+
+class UnixSocketLogPubSub:
+    """多worker部署：通过Unix套接字在各worker之间共享日志
+
+    抢到文件锁的worker作为主worker（leader），负责去重、过滤、分配序号和写文件，
+    再把处理好的日志帧发布给其他worker；其他worker（follower）把收到的日志转发给主worker，
+    并把主worker发布的日志分发给自己进程内连接的WebSocket客户端。
+    主worker退出后，其余worker重新抢锁，抢到的接替主worker。
+    序号只由主worker分配：主worker不可用期间follower把日志暂存起来，
+    重新连上主worker或自己接替后再提交，不在本地分配序号。
+
+    帧格式：4字节长度 + 1字节类型 + JSON文本。
+    """
+
+    backend = "unix"
+    FRAME_HEADER = struct.Struct(">IB")
+    KIND_INGEST = 1   # follower -> leader：原始日志
+    KIND_RECORD = 2   # leader -> follower：已编号、已编码的日志
+
+    def __init__(self, path: str = LOG_PUBSUB_SOCKET):
+        self.path = path
+        self.role = "starting"
+        self._lock_file = None
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._followers: Set[asyncio.StreamWriter] = set()
+        self._leader_writer: Optional[asyncio.StreamWriter] = None
+        self._follower_task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+        self.forwarded = 0
+        self.published = 0
+        self.received = 0
+        self._pending: deque = deque(maxlen=max(1, LOG_PUBSUB_PENDING_MAX))
+        self.buffered = 0
+        self.buffer_drops = 0
+        self.follower_drops = 0
+
+    def _try_lock(self) -> bool:
+        lock_file = open(self.path + ".lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def start(self):
+        if self._try_lock():
+            await self._become_leader()
+        else:
+            self.role = "follower"
+            log_journal.writable = False
+            self._follower_task = asyncio.create_task(self._follow())
+            # 等待连上主worker，连不上时日志先暂存，不阻塞启动
+            try:
+                await asyncio.wait_for(self._connected.wait(), timeout=LOG_PUBSUB_RECONNECT_INTERVAL * 10)
+            except asyncio.TimeoutError:
+                logger.warning(f"暂时无法连接日志主worker: {self.path}")
+
+    async def _become_leader(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # 接替前一个主worker时，取磁盘和内存中较大的序号：前一个主worker异步写文件，
+        # 磁盘上的序号可能落后于本worker已经收到并分发出去的序号
+        log_journal.writable = True
+        log_journal._recover()
+        self._server = await asyncio.start_unix_server(self._serve_follower, path=self.path)
+        self.role = "leader"
+        logger.info(f"日志发布/订阅主worker已启动: {self.path} (pid={os.getpid()}, 最后序号: {log_journal.last_seq})")
+        while self._pending:
+            await broadcast_log(self._pending.popleft())
+
+    async def _read_frame(self, reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+        header = await reader.readexactly(self.FRAME_HEADER.size)
+        length, kind = self.FRAME_HEADER.unpack(header)
+        return kind, await reader.readexactly(length)
+
+    def _write_frame(self, writer: asyncio.StreamWriter, kind: int, payload: bytes):
+        writer.write(self.FRAME_HEADER.pack(len(payload), kind) + payload)
+
+    async def _serve_follower(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._followers.add(writer)
+        try:
+            while True:
+                kind, payload = await self._read_frame(reader)
+                if kind == self.KIND_INGEST:
+                    await broadcast_log(json.loads(payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"处理follower日志失败: {str(e)}")
+        finally:
+            self._followers.discard(writer)
+            writer.close()
+
+    async def _follow(self):
+        """follower：保持与主worker的连接，主worker不在时尝试接替"""
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionError):
+                if self._try_lock():
+                    await self._become_leader()
+                    return
+                await asyncio.sleep(LOG_PUBSUB_RECONNECT_INTERVAL)
+                continue
+
+            self._leader_writer = writer
+            self._connected.set()
+            logger.info(f"已连接日志主worker: {self.path}")
+            while self._pending:
+                self._write_frame(writer, self.KIND_INGEST, encode_log_frame(self._pending.popleft()).encode("utf-8"))
+                self.forwarded += 1
+            try:
+                while True:
+                    kind, payload = await self._read_frame(reader)
+                    if kind == self.KIND_RECORD:
+                        self._receive(payload)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning("与日志主worker的连接已断开，正在重连")
+            finally:
+                self._leader_writer = None
+                self._connected.clear()
+                writer.close()
+
+    def _receive(self, payload: bytes):
+        frame = payload.decode("utf-8")
+        log_data = json.loads(frame)
+        seq = log_data["seq"]
+        self.received += 1
+        log_journal.append(seq, frame)
+        fan_out_log(seq, log_data, frame)
+
+    async def ingest(self, log_data: dict) -> Optional[int]:
+        if self.role == "follower":
+            writer = self._leader_writer
+            if writer is not None and not writer.is_closing():
+                self._write_frame(writer, self.KIND_INGEST, encode_log_frame(log_data).encode("utf-8"))
+                self.forwarded += 1
+                return None
+            # 主worker暂时不可用时先暂存，等重新连上或接替后再提交，避免分配重复的序号
+            if len(self._pending) == self._pending.maxlen:
+                self.buffer_drops += 1
+            self._pending.append(log_data)
+            self.buffered += 1
+            return None
+        return await broadcast_log(log_data)
+
+    def publish(self, seq: int, log_data: dict, frame: str):
+        fan_out_log(seq, log_data, frame)
+        if self.role != "leader" or not self._followers:
+            return
+        payload = frame.encode("utf-8")
+        for writer in list(self._followers):
+            # follower处理不过来时断开它，由它重连，客户端可通过序号检测缺口并重放
+            if writer.transport.get_write_buffer_size() > LOG_PUBSUB_MAX_BUFFER:
+                self.follower_drops += 1
+                self._followers.discard(writer)
+                writer.close()
+                continue
+            self._write_frame(writer, self.KIND_RECORD, payload)
+        self.published += 1
+
+    async def stop(self):
+        if self._follower_task is not None:
+            self._follower_task.cancel()
+            try:
+                await self._follower_task
+            except asyncio.CancelledError:
+                pass
+            self._follower_task = None
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._followers):
+                writer.close()
+            self._followers.clear()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.role = "stopped"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "role": self.role,
+            "socket": self.path,
+            "followers": len(self._followers),
+            "forwarded": self.forwarded,
+            "published": self.published,
+            "received": self.received,
+            "buffered": self.buffered,
+            "pending": len(self._pending),
+            "buffer_drops": self.buffer_drops,
+            "follower_drops": self.follower_drops,
+        }
+
+
+def create_log_pubsub(backend: str = LOG_PUBSUB_BACKEND):
+    """按配置创建日志发布/订阅层"""
+    if backend == "unix":
+        if fcntl is None or not hasattr(asyncio, "start_unix_server"):
+            logger.warning("当前系统不支持Unix套接字，日志发布/订阅退回单进程模式")
+            return InProcessLogPubSub()
+        return UnixSocketLogPubSub()
+    return InProcessLogPubSub()
+
+
+connected_clients: Dict[WebSocket, LogSubscriber] = {}
+# 按订阅条件索引的订阅者，用于日志分发
+log_subscriber_index = LogSubscriberIndex()
+# 日志接收队列
+log_ingest = LogIngestQueue()
+# 日志去重缓存
+log_cache = LogDedupCache()
+# 日志持久化
+log_journal = LogJournal()
+# 广播前的过滤规则
+log_filter_stage = LogFilterStage(load_log_filter_rules())
+# 监控指标
+log_hub_metrics = LogHubMetrics()
+# 日志发布/订阅（多worker部署时在worker之间共享日志）
+log_pubsub = create_log_pubsub()
+# 广播编码统计：每条日志只编码一次，再把同一个文本帧发给所有订阅者
+broadcast_stats: Dict[str, int] = {
+    "records_encoded": 0,
+    "bytes_encoded": 0,
+    "frames_enqueued": 0,
+    "encodes_saved": 0,
+    "bytes_saved": 0,
+    "records_unmatched": 0,
+    "binary_bytes_encoded": 0,
+}
+
+
+def encode_log_frame(log_data: dict) -> str:
+    """把日志编码为JSON文本帧，优先使用orjson，不可用或失败时回退到标准库"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(log_data).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(log_data, ensure_ascii=False, separators=(",", ":"))
+
+
+# msgpack 传输时用整数代替重复出现的字段名，字典在欢迎消息中下发给客户端
+LOG_FIELD_DICTIONARY = [
+    "timestamp", "level", "source", "message", "seq", "ingest_ts_ns",
+    "attack_info", "stage", "technique", "source_node", "target_node", "status", "progress",
+    "battle_state", "attack_progress", "defense_actions", "type",
+]
+LOG_FIELD_INDEX = {name: index for index, name in enumerate(LOG_FIELD_DICTIONARY)}
+
+
+def _compact_keys(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {LOG_FIELD_INDEX.get(key, key): _compact_keys(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_compact_keys(item) for item in value]
+    return value
+
+
+def encode_log_binary(log_data: dict) -> bytes:
+    """把日志编码为msgpack二进制帧，字段名按 LOG_FIELD_DICTIONARY 替换为整数"""
+    return msgpack.packb(_compact_keys(log_data), use_bin_type=True, default=str)
+
+
+def negotiate_encoding(requested: Optional[str]) -> str:
+    """连接时协商日志编码，未安装msgpack或请求未知编码时回退到json"""
+    if requested == "msgpack" and msgpack is not None:
+        return "msgpack"
+    return "json"
+
+
+def encode_for(subscriber: "LogSubscriber", frame: str) -> Any:
+    """把JSON文本帧转换为订阅者协商的编码（用于补发等非热路径）"""
+    if subscriber.encoding == "msgpack":
+        return encode_log_binary(json.loads(frame))
+    return frame
 
 @app.websocket("/ws/logs")
 async def websocket_logs(websocket: WebSocket):
-    """WebSocket端点，用于实时推送日志"""
+    """WebSocket端点，用于实时推送日志
+
+    连接时可通过 ?encoding=msgpack 请求二进制日志帧，服务器不支持时回退到JSON；
+    permessage-deflate 压缩由WebSocket握手自动协商。
+    """
     await websocket.accept()
-    connected_clients.add(websocket)
+    subscriber = LogSubscriber(websocket)
+    subscriber.encoding = negotiate_encoding(websocket.query_params.get("encoding"))
+    connected_clients[websocket] = subscriber
+    log_subscriber_index.update(subscriber)
+    subscriber.start()
     logger.info(f"WebSocket客户端已连接，当前连接数: {len(connected_clients)}")
     
     # 发送一条欢迎消息
     welcome_message = {
-        "timestamp": asyncio.get_event_loop().time(),
+        "timestamp": time.time(),
         "level": "info",
         "source": "系统",
-        "message": "WebSocket连接已建立，可以接收实时日志"
+        "message": "WebSocket连接已建立，可以接收实时日志",
+        "encoding": subscriber.encoding
     }
-    await websocket.send_json(welcome_message)
+    if subscriber.encoding == "msgpack":
+        welcome_message["field_dictionary"] = LOG_FIELD_DICTIONARY
+    subscriber.enqueue(encode_log_frame(welcome_message), "info")
     
     try:
         while True:
@@ -218,7 +2107,7 @@ async def websocket_logs(websocket: WebSocket):
             
             # 处理心跳消息
             if data == "ping":
-                await websocket.send_text("pong")
+                subscriber.enqueue("pong", "system")
                 continue
                 
             # 如果客户端发送了其他消息，可以在这里处理
@@ -227,79 +2116,204 @@ async def websocket_logs(websocket: WebSocket):
             # 尝试解析JSON消息
             try:
                 message = json.loads(data)
-                # 如果是日志消息，广播给所有客户端
+                if not isinstance(message, dict):
+                    continue
+                # 订阅控制消息
+                if message.get("type") in ("subscribe", "unsubscribe"):
+                    handle_subscription(subscriber, message)
+                    continue
+                # 断线重连后从指定序号开始补发
+                if message.get("type") == "resume":
+                    await handle_resume(subscriber, message)
+                    continue
+                # 如果是日志消息，放入接收队列后立即返回，由分发协程广播给所有客户端
                 if "level" in message and "source" in message and "message" in message:
-                    await broadcast_log(message)
+                    want_ack = message.pop("ack", False)
+                    queued = await log_ingest.submit(message)
+                    if want_ack:
+                        subscriber.enqueue(encode_log_frame({"type": "ack", "queued": queued}), "system")
             except json.JSONDecodeError:
                 logger.warning(f"收到非JSON格式的WebSocket消息: {data}")
             
     except WebSocketDisconnect:
         # 客户端断开连接
-        if websocket in connected_clients:
-            connected_clients.remove(websocket)
+        subscriber.close()
         logger.info(f"WebSocket客户端已断开，当前连接数: {len(connected_clients)}")
     except Exception as e:
         # 其他异常
-        if websocket in connected_clients:
-            connected_clients.remove(websocket)
+        subscriber.close()
         logger.error(f"WebSocket连接异常: {str(e)}")
 
-async def broadcast_log(log_data: dict):
-    """向所有连接的WebSocket客户端广播日志"""
-    if not connected_clients:
+LOG_BATCH_MAX_WINDOW_MS = 1000
+LOG_BATCH_MAX_RECORDS = 500
+
+
+def configure_batching(subscriber: LogSubscriber, options: Any):
+    """设置订阅者的批处理参数，options 为 false/null 时关闭"""
+    if not options:
+        subscriber.batch_window = 0.0
+        subscriber.batch_max = 1
+        return
+    if not isinstance(options, dict):
+        options = {}
+    try:
+        window_ms = int(options.get("window_ms", 20))
+        max_records = int(options.get("max_records", 50))
+    except (TypeError, ValueError):
+        window_ms, max_records = 20, 50
+    subscriber.batch_window = max(0, min(window_ms, LOG_BATCH_MAX_WINDOW_MS)) / 1000
+    subscriber.batch_max = max(2, min(max_records, LOG_BATCH_MAX_RECORDS, subscriber.max_queue))
+
+
+def handle_subscription(subscriber: LogSubscriber, message: dict):
+    """处理客户端的订阅消息
+
+    {"type": "subscribe", "sources": [...], "levels": [...], "stages": [...], "gap_detection": true,
+     "batch": {"window_ms": 20, "max_records": 50}}
+    只接收匹配的日志。再次 subscribe 时只更新消息中出现的字段，其余条件保持不变，
+    某个字段为 null 或 [] 表示该维度不再限制；{"type": "unsubscribe"} 清空过滤条件，恢复接收全部日志。
+    开启 batch 后日志以数组帧发送，"batch": false 关闭。
+    """
+    if "gap_detection" in message:
+        subscriber.gap_detection = bool(message.get("gap_detection"))
+    if "batch" in message:
+        configure_batching(subscriber, message.get("batch"))
+    if message.get("type") == "unsubscribe":
+        subscriber.log_filter = None
+    else:
+        current = subscriber.log_filter.to_dict() if subscriber.log_filter else {}
+        fields = {field: message[field] if field in message else current.get(field)
+                  for field in ("sources", "levels", "stages")}
+        log_filter = LogFilter(**fields)
+        subscriber.log_filter = log_filter if any(fields[field] for field in fields) else None
+    log_subscriber_index.update(subscriber)
+    current = subscriber.log_filter.to_dict() if subscriber.log_filter else None
+    logger.info(f"WebSocket客户端更新订阅: {current}")
+    subscriber.enqueue(encode_log_frame({
+        "type": "subscribed",
+        "filter": current,
+        "gap_detection": subscriber.gap_detection,
+        "batch": {
+            "window_ms": int(subscriber.batch_window * 1000),
+            "max_records": subscriber.batch_max
+        } if subscriber.batch_max > 1 else None,
+        "last_seq": log_journal.last_seq
+    }), "system")
+
+
+async def handle_resume(subscriber: LogSubscriber, message: dict):
+    """处理断线重连的补发请求: {"type": "resume", "since": <seq>}
+
+    按当前订阅条件补发序号大于 since 的日志，最后回复 {"type": "resumed"}。
+    """
+    try:
+        since = int(message.get("since", 0))
+        limit = int(message.get("limit", subscriber.max_queue // 2))
+    except (TypeError, ValueError):
+        subscriber.enqueue(encode_log_frame({"type": "error", "message": "since/limit 必须是整数"}), "system")
         return
+    # 一次补发不超过发送队列的一半，剩余部分由客户端根据 has_more 继续请求
+    limit = max(1, min(limit, subscriber.max_queue // 2))
+
+    records = await log_journal.replay(since, limit)
+    replayed = 0
+    for seq, frame in records:
+        if subscriber.log_filter is not None:
+            record = json.loads(frame)
+            attack_info = record.get("attack_info")
+            stage = attack_info.get("stage") if isinstance(attack_info, dict) else None
+            if not subscriber.log_filter.matches(record.get("source", ""),
+                                                 str(record.get("level", "info")).lower(), stage):
+                continue
+        # 补发的日志按system级别入队，drop_low_level 策略下不会被优先丢弃
+        subscriber.enqueue(encode_for(subscriber, frame), "system", seq)
+        replayed += 1
+    subscriber.enqueue(encode_log_frame({
+        "type": "resumed",
+        "since": since,
+        "count": replayed,
+        "last_seq": records[-1][0] if records else since,
+        "has_more": len(records) >= limit
+    }), "system")
+
+
+# 后端自己生成的任务进度和拓扑状态增量：同样的文本在不同任务、不同时刻都有意义，不参与去重
+UNDEDUPLICATED_LOG_SOURCES = {TOPOLOGY_LOG_SOURCE, AGENT_JOB_LOG_SOURCE, TOPOLOGY_STATUS_SOURCE}
+
 
-    # 创建日志唯一标识符进行去重
-    import hashlib
+async def broadcast_log(log_data: dict) -> Optional[int]:
+    """记录并向所有连接的WebSocket客户端广播日志（仅入队，由各客户端的写协程负责发送）
+
+    返回分配的序号，被去重或过滤掉的日志返回 None。
+    """
+    # 接收时间使用墙上时钟(纳秒)，各进程的日志可以直接比较和排序
+    ingest_ts_ns = time.time_ns()
+
+    # 检查是否是重复日志
     source = log_data.get("source", "")
     message = log_data.get("message", "")
-    log_content = f"{source}:{message}".encode('utf-8')
-    log_id = hashlib.md5(log_content).hexdigest()
-    
-    # 检查是否是重复日志
-    if log_id in log_cache:
+    log_hub_metrics.inc("ingested", source)
+    if source not in UNDEDUPLICATED_LOG_SOURCES and log_cache.is_duplicate(source, message):
         logger.debug(f"跳过重复日志: {source} - {message[:50]}...")
-        return
-    
-    # 添加到缓存
-    log_cache.add(log_id)
-    
-    # 限制缓存大小，避免内存泄漏
-    if len(log_cache) > 1000:
-        # 清理一半的缓存
-        cache_list = list(log_cache)
-        log_cache.clear()
-        log_cache.update(cache_list[-500:])
-
-    # 过滤中控智能体的日志
-    source_lower = source.lower()
-    message_lower = message.lower()
-
-    # 跳过中控智能体的内部日志
-    if source_lower == "中控智能体" or source_lower == "central_agent":
-        # 只允许重要的状态更新通过
-        important_keywords = ["攻击完成", "攻击失败", "开始攻击", "攻击结束"]
-        if not any(keyword in message_lower for keyword in important_keywords):
-            logger.debug(f"过滤中控智能体日志: {message}")
-            return
+        log_hub_metrics.inc("deduplicated", source)
+        return None
 
-    # 添加时间戳
+    # 按过滤规则跳过不需要广播的日志（如中控智能体的内部日志）
+    if not log_filter_stage.allow(source, message):
+        log_hub_metrics.inc("filtered", source)
+        return None
+
+    # 添加时间戳：timestamp 保留发送方的原值，ingest_ts_ns 为后端统一的接收时间
+    log_data["ingest_ts_ns"] = ingest_ts_ns
     if "timestamp" not in log_data:
-        log_data["timestamp"] = asyncio.get_event_loop().time()
+        log_data["timestamp"] = ingest_ts_ns / 1e9
+
+    # 分配全局单调递增的序号，只编码一次，写入日志文件
+    seq = log_journal.next_seq()
+    log_data["seq"] = seq
+    frame = encode_log_frame(log_data)
+    log_journal.append(seq, frame)
+    log_hub_metrics.inc("broadcast", source)
+    broadcast_stats["records_encoded"] += 1
+    broadcast_stats["bytes_encoded"] += len(frame.encode("utf-8"))
+
+    # 交给发布/订阅层，由各worker分发给本地连接的客户端
+    log_pubsub.publish(seq, log_data, frame)
+    return seq
 
-    # 广播消息
-    disconnected_clients = set()
-    for client in connected_clients:
-        try:
-            await client.send_json(log_data)
-        except Exception as e:
-            logger.error(f"向WebSocket客户端发送消息失败: {str(e)}")
-            disconnected_clients.add(client)
 
-    # 移除断开连接的客户端
-    for client in disconnected_clients:
-        if client in connected_clients:
-            connected_clients.remove(client)
+def fan_out_log(seq: int, log_data: dict, frame: str):
+    """把已编号、已编码的日志分发给本进程内匹配的订阅者（只入队，不等待发送完成）"""
+    source = log_data.get("source", "")
+    level = str(log_data.get("level", "info")).lower()
+    attack_info = log_data.get("attack_info")
+    stage = attack_info.get("stage") if isinstance(attack_info, dict) else None
+    recipients = log_subscriber_index.lookup(source, level, stage)
+    if not recipients:
+        broadcast_stats["records_unmatched"] += 1
+        return
+
+    # 每种编码最多编码一次
+    binary_frame: Optional[bytes] = None
+    text_fanout = 0
+    binary_fanout = 0
+    for subscriber in recipients:
+        if subscriber.encoding == "msgpack":
+            if binary_frame is None:
+                binary_frame = encode_log_binary(log_data)
+                broadcast_stats["binary_bytes_encoded"] += len(binary_frame)
+            if subscriber.enqueue(binary_frame, level, seq):
+                binary_fanout += 1
+        elif subscriber.enqueue(frame, level, seq):
+            text_fanout += 1
+
+    broadcast_stats["frames_enqueued"] += text_fanout + binary_fanout
+    if text_fanout > 1:
+        broadcast_stats["encodes_saved"] += text_fanout - 1
+        broadcast_stats["bytes_saved"] += len(frame.encode("utf-8")) * (text_fanout - 1)
+    if binary_fanout > 1:
+        broadcast_stats["encodes_saved"] += binary_fanout - 1
+        broadcast_stats["bytes_saved"] += len(binary_frame) * (binary_fanout - 1)
 
 # -----------------------------
 # Expose the same functionality under the /api prefix so that the
@@ -312,9 +2326,513 @@ async def manage_topology_api(req: TopologyAction):
     """Proxy endpoint matching the frontend expectation (POST /api/topology)."""
     return await manage_topology(req)
 
+@api_router.get("/logs/stats")
+async def get_log_stats():
+    """日志广播统计：编码次数、节省的编码次数和字节数"""
+    return {
+        "json_backend": "orjson" if orjson is not None else "json",
+        "binary_encoding": "msgpack" if msgpack is not None else None,
+        "connected_clients": len(connected_clients),
+        **broadcast_stats,
+        "ingest": log_ingest.stats(),
+        "dedup": log_cache.stats(),
+        "journal": log_journal.stats(),
+        "pubsub": log_pubsub.stats(),
+        "subscribers": log_subscriber_index.stats()
+    }
+
+LOG_INGEST_MAX_BATCH = int(os.getenv("LOG_INGEST_MAX_BATCH", "1000"))
+
+
+class LogRecord(BaseModel):
+    """智能体提交的日志，除下列字段外的其他字段（如 battle_state）原样广播"""
+    model_config = ConfigDict(extra="allow")
+
+    level: str = Field(description="日志级别，例如 info/success/warning/error")
+    source: str = Field(description="日志来源，例如 攻击智能体")
+    message: str = Field(description="日志内容")
+    timestamp: Optional[float] = Field(None, description="发送方时间戳")
+    attack_info: Optional[Dict[str, Any]] = Field(None, description="攻击阶段信息")
+
+
+async def ingest_logs(records: List[LogRecord]) -> Dict[str, Any]:
+    """把已校验的日志放入接收队列，之后与 /ws/logs 走相同的去重和广播流程"""
+    queued = 0
+    for record in records:
+        if await log_ingest.submit(record.model_dump(exclude_none=True)):
+            queued += 1
+    return {
+        "status": "queued",
+        "received": len(records),
+        "queued": queued,
+        "dropped": len(records) - queued
+    }
+
+@api_router.post("/logs")
+async def submit_log(record: LogRecord):
+    """提交单条日志，适用于不需要保持WebSocket长连接的智能体"""
+    return await ingest_logs([record])
+
+@api_router.post("/logs/batch")
+async def submit_log_batch(records: List[LogRecord]):
+    """批量提交日志，一次请求提交缓冲的多条日志"""
+    if len(records) > LOG_INGEST_MAX_BATCH:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many records in one batch: {len(records)} > {LOG_INGEST_MAX_BATCH}"
+        )
+    return await ingest_logs(records)
+
+@api_router.get("/logs/filters")
+async def get_log_filters():
+    """查看当前的日志过滤规则及其命中次数"""
+    return {"rules": log_filter_stage.stats()}
+
+@api_router.put("/logs/filters")
+async def update_log_filters(rules: List[LogFilterRule]):
+    """替换日志过滤规则，并保存到规则文件"""
+    try:
+        log_filter_stage.load(rules)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        with open(LOG_FILTER_RULES_FILE, "w", encoding="utf-8") as f:
+            json.dump([rule.model_dump() for rule in rules], f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        logger.warning(f"保存日志过滤规则失败，规则仅在本次运行中生效: {str(e)}")
+    logger.info(f"日志过滤规则已更新，共 {len(rules)} 条")
+    return {"status": "success", "rules": log_filter_stage.stats()}
+
+@api_router.get("/logs/replay")
+async def replay_logs(since: int = 0, limit: int = 1000):
+    """返回序号大于 since 的历史日志，用于重连补发和演练复盘"""
+    records = await log_journal.replay(since, limit)
+    return {
+        "since": since,
+        "last_seq": records[-1][0] if records else since,
+        "has_more": len(records) >= max(1, min(limit, LOG_REPLAY_MAX_LIMIT)),
+        "records": [json.loads(frame) for _, frame in records]
+    }
+
+COMPOSE_CACHE_DIR = os.getenv("COMPOSE_CACHE_DIR", os.path.join(os.path.dirname(__file__), "compose_cache"))
+COMPOSE_CACHE_MAX_FILES = int(os.getenv("COMPOSE_CACHE_MAX_FILES", "50"))
+# 项目名只用小写字母和数字，docker-compose v1/v2 生成的项目标签一致
+DYNAMIC_TOPOLOGY_PROJECT = os.getenv("DYNAMIC_TOPOLOGY_PROJECT", "dynamictopology")
+TOPOLOGY_APPLY_CONCURRENCY = int(os.getenv("TOPOLOGY_APPLY_CONCURRENCY", "8"))
+TEARDOWN_CONCURRENCY = int(os.getenv("TEARDOWN_CONCURRENCY", "8"))
+TEARDOWN_GRACE_PERIOD = int(os.getenv("TEARDOWN_GRACE_PERIOD", "3"))
+# 部署时给每个容器打上的项目标签，拆除时只处理带此标签的容器
+TOPOLOGY_PROJECT_LABEL = "aginst_agent.project"
+
+
+def canonical_hash(value: Any) -> str:
+    """与键顺序、格式无关的内容哈希"""
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ComposeCache:
+    """动态拓扑compose配置的内容寻址缓存
+
+    配置按规范化后的内容哈希保存为 <hash>.yml，相同的拓扑重复部署时直接复用；
+    current.json 记录当前部署的哈希和每个服务的哈希，用于判断哪些服务发生了变化。
+    文件读写都在单线程执行器中完成，不阻塞事件循环，并且按提交顺序执行。
+    """
+
+    STATE_FILE = "current.json"
+
+    def __init__(self, directory: str = COMPOSE_CACHE_DIR, max_files: int = COMPOSE_CACHE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max(1, max_files)
+        self.hits = 0
+        self.misses = 0
+        # 最近一次读取或写入的当前部署状态，供 stats() 使用
+        self._state: Optional[Dict[str, Any]] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compose-cache")
+        return self._executor
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), func, *args)
+
+    async def compose_file(self, config: Dict[str, Any]) -> Tuple[str, str]:
+        """返回配置的哈希和对应的compose文件路径，文件不存在时写入"""
+        return await self._run(self._compose_file, config)
+
+    def _compose_file(self, config: Dict[str, Any]) -> Tuple[str, str]:
+        digest = canonical_hash(config)
+        path = os.path.join(self.directory, f"{digest[:16]}.yml")
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path)
+            return digest, path
+
+        self.misses += 1
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            yaml.dump(config, f, default_flow_style=False)
+        os.replace(tmp_path, path)
+        self._prune(keep=path)
+        return digest, path
+
+    def _prune(self, keep: str):
+        """超过 max_files 个文件时按修改时间删除最旧的，刚写入的文件和当前部署的文件不删除"""
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".yml")]
+        excess = len(files) - self.max_files
+        if excess <= 0:
+            return
+        current = self._current() or {}
+        protected = {keep, current.get("compose_file")}
+        for path in sorted((p for p in files if p not in protected), key=os.path.getmtime)[:excess]:
+            os.unlink(path)
+
+    @staticmethod
+    def fingerprint(config: Dict[str, Any]) -> Dict[str, Any]:
+        """每个服务单独计算哈希，网络和卷等共享部分合并计算一个哈希"""
+        services = config.get("services") or {}
+        shared = {key: value for key, value in config.items() if key != "services"}
+        return {
+            "services": {name: canonical_hash(spec) for name, spec in services.items()},
+            # 不含网络的服务哈希，用于区分“只改了网络/IP”和其他配置变化
+            "service_cores": {
+                name: canonical_hash({k: v for k, v in (spec or {}).items() if k != "networks"})
+                for name, spec in services.items()
+            },
+            "shared": canonical_hash(shared),
+        }
+
+    async def current(self) -> Optional[Dict[str, Any]]:
+        return await self._run(self._current)
+
+    def _current(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.directory, self.STATE_FILE), "r", encoding="utf-8") as f:
+                self._state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._state = None
+        return self._state
+
+    async def diff(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        """与当前部署比较：unchanged / changed / added / removed，shared_changed 表示网络等共享配置变化"""
+        return await self._run(self._diff, config)
+
+    def _diff(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        digest = canonical_hash(config)
+        fingerprint = self.fingerprint(config)
+        current = self._current()
+        if current is None:
+            return {"hash": digest, "deployed": False, "unchanged": False, "shared_changed": True,
+                    "changed": [], "added": list(fingerprint["services"]), "removed": []}
+        old = current.get("services", {})
+        new = fingerprint["services"]
+        old_cores = current.get("service_cores", {})
+        changed = [name for name in new if name in old and old[name] != new[name]]
+        return {
+            "hash": digest,
+            "deployed": True,
+            "unchanged": digest == current.get("hash"),
+            "shared_changed": fingerprint["shared"] != current.get("shared"),
+            "changed": changed,
+            "network_only": [name for name in changed
+                             if name in old_cores and old_cores[name] == fingerprint["service_cores"][name]],
+            "added": [name for name in new if name not in old],
+            "removed": [name for name in old if name not in new],
+        }
+
+    async def record(self, digest: str, compose_file: str, config: Dict[str, Any]):
+        """记录当前部署的配置"""
+        await self._run(self._record, digest, compose_file, config)
+
+    def _record(self, digest: str, compose_file: str, config: Dict[str, Any]):
+        state = {"hash": digest, "compose_file": compose_file, "deployed_at": time.time(), **self.fingerprint(config)}
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = os.path.join(self.directory, self.STATE_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(self.directory, self.STATE_FILE))
+        self._state = state
+
+    async def clear(self):
+        """拓扑停止后不再有当前部署"""
+        await self._run(self._clear)
+
+    def _clear(self):
+        try:
+            os.unlink(os.path.join(self.directory, self.STATE_FILE))
+        except FileNotFoundError:
+            pass
+        self._state = None
+
+    def stats(self) -> Dict[str, Any]:
+        current = self._state or {}
+        return {"hits": self.hits, "misses": self.misses, "current_hash": current.get("hash"),
+                "deployed_at": current.get("deployed_at")}
+
+
+compose_cache = ComposeCache()
+
+
+def desired_networks(spec: Dict[str, Any]) -> Optional[Dict[str, Optional[str]]]:
+    """服务期望加入的网络及固定IP（未指定IP时为 None）
+
+    与compose一致：没有 networks 时加入项目的 default 网络；
+    设置了 network_mode（host、container:xxx 等）时网络不由compose管理，返回 None。
+    """
+    spec = spec or {}
+    if spec.get("network_mode"):
+        return None
+    networks = spec.get("networks")
+    if not networks:
+        return {"default": None}
+    if isinstance(networks, list):
+        return {name: None for name in networks}
+    return {name: (options or {}).get("ipv4_address") for name, options in networks.items()}
+
+
+class TopologyDiffEngine:
+    """增量拓扑引擎：比较期望的拓扑与正在运行的容器，只执行必要的操作
+
+    操作分为 create（新建）、recreate（配置变化，重建）、start（已停止）、
+    reconnect（只有网络/IP变化，不重建容器）、remove（不再需要的容器），
+    不同类型的操作并发执行，同类的逐容器操作通过有上限的并发执行。
+    """
+
+    def __init__(self, project: str = DYNAMIC_TOPOLOGY_PROJECT, concurrency: int = TOPOLOGY_APPLY_CONCURRENCY):
+        self.project = project
+        self.concurrency = concurrency
+
+    async def network_names(self) -> Dict[str, str]:
+        """compose中的网络名 -> docker中的实际网络名"""
+        result = await run_docker([
+            "docker", "network", "ls", "--filter", f"label={COMPOSE_PROJECT_LABEL}={self.project}",
+            "--format", '{{.Name}}\t{{.Label "com.docker.compose.network"}}'
+        ], check=False)
+        names = {}
+        for line in result.stdout.splitlines():
+            full_name, _, network = line.partition("\t")
+            if network:
+                names[network] = full_name
+        return names
+
+    def plan(self, config: Dict[str, Any], containers: Dict[str, Dict[str, Any]],
+             diff: Dict[str, Any], network_names: Dict[str, str]) -> Dict[str, Any]:
+        """生成操作计划"""
+        services = config.get("services") or {}
+        declared = config.get("networks") or {}
+
+        def full_name(network: str) -> str:
+            options = declared.get(network) or {}
+            return options.get("name") or network_names.get(network) or f"{self.project}_{network}"
+
+        plan: Dict[str, Any] = {"create": [], "recreate": [], "start": [], "reconnect": [], "remove": [], "unchanged": []}
+        for name, spec in services.items():
+            container = containers.get(name)
+            if container is None:
+                plan["create"].append(name)
+                continue
+            if name in diff.get("changed", []) and name not in diff.get("network_only", []):
+                plan["recreate"].append(name)
+                continue
+            stopped = not container.get("State", {}).get("Running", False)
+            if stopped:
+                plan["start"].append({"service": name, "id": container.get("Id", "")})
+
+            # 比较网络和IP，有差异时只调整网络连接（network_mode 的服务不比较）
+            networks = desired_networks(spec)
+            live = container.get("NetworkSettings", {}).get("Networks") or {}
+            wanted = {full_name(network): ip for network, ip in (networks or {}).items()}
+            steps = []
+            for network in (live if networks is not None else ()):
+                if network not in wanted:
+                    steps.append({"action": "disconnect", "network": network})
+            for network, ip in wanted.items():
+                if network not in live:
+                    steps.append({"action": "connect", "network": network, "ip": ip})
+                elif ip and live[network].get("IPAddress") != ip:
+                    steps.append({"action": "disconnect", "network": network})
+                    steps.append({"action": "connect", "network": network, "ip": ip})
+            if steps:
+                plan["reconnect"].append({"service": name, "id": container.get("Id", ""), "steps": steps})
+            elif not stopped:
+                plan["unchanged"].append(name)
+
+        for name, container in containers.items():
+            if name not in services:
+                plan["remove"].append({"service": name, "id": container.get("Id", "")})
+        return plan
+
+    async def apply(self, plan: Dict[str, Any], compose_file: str, on_output=None) -> Dict[str, Any]:
+        """并发执行操作计划，返回每类操作的结果"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        errors: List[str] = []
+
+        async def limited(args: List[str]):
+            async with semaphore:
+                result = await run_docker(args, check=False, on_output=on_output)
+            if result.returncode != 0:
+                errors.append(f"{' '.join(args[:4])}: {result.stderr.strip()}")
+
+        async def reconnect(item: Dict[str, Any]):
+            # 同一容器的网络调整必须按顺序执行（先断开再以新IP连接）
+            async with semaphore:
+                for step in item["steps"]:
+                    args = ["docker", "network", step["action"]]
+                    if step["action"] == "connect" and step.get("ip"):
+                        args += ["--ip", step["ip"]]
+                    result = await run_docker(args + [step["network"], item["id"]], check=False)
+                    if result.returncode != 0:
+                        errors.append(f"{item['service']} {step['action']} {step['network']}: {result.stderr.strip()}")
+                        break
+
+        operations = []
+        targets = plan["create"] + plan["recreate"]
+        if targets:
+            operations.append(limited(dynamic_compose_cmd(compose_file, "up", "-d", "--no-deps", *targets)))
+        started: Optional[asyncio.Task] = None
+        if plan["start"]:
+            started = asyncio.ensure_future(limited(["docker", "start", *(item["id"] for item in plan["start"])]))
+            operations.append(started)
+        starting = {item["id"] for item in plan["start"]}
+
+        async def start_then_reconnect(item: Dict[str, Any]):
+            # 已停止的容器先启动，再调整它的网络
+            if item["id"] in starting:
+                await started
+            await reconnect(item)
+
+        operations += [start_then_reconnect(item) for item in plan["reconnect"]]
+        operations += [limited(["docker", "rm", "-f", item["id"]]) for item in plan["remove"]]
+        await asyncio.gather(*operations)
+        return {"errors": errors}
+
+    @staticmethod
+    def summary(plan: Dict[str, Any]) -> Dict[str, List[str]]:
+        return {
+            "create": plan["create"],
+            "recreate": plan["recreate"],
+            "start": [item["service"] for item in plan["start"]],
+            "reconnect": [item["service"] for item in plan["reconnect"]],
+            "remove": [item["service"] for item in plan["remove"]],
+            "unchanged": plan["unchanged"],
+        }
+
+
+topology_engine = TopologyDiffEngine()
+
+
+def with_project_label(config: Dict[str, Any], project: str = DYNAMIC_TOPOLOGY_PROJECT) -> Dict[str, Any]:
+    """返回给每个服务加上项目标签的配置副本（labels 为列表或字典两种写法都支持）"""
+    services = {}
+    for name, spec in (config.get("services") or {}).items():
+        spec = dict(spec or {})
+        labels = spec.get("labels") or {}
+        if isinstance(labels, list):
+            labels = [item for item in labels if not item.startswith(TOPOLOGY_PROJECT_LABEL + "=")]
+            labels.append(f"{TOPOLOGY_PROJECT_LABEL}={project}")
+        else:
+            labels = {**labels, TOPOLOGY_PROJECT_LABEL: project}
+        spec["labels"] = labels
+        services[name] = spec
+    return {**config, "services": services}
+
+
+async def teardown_project(project: str = DYNAMIC_TOPOLOGY_PROJECT, concurrency: int = TEARDOWN_CONCURRENCY,
+                           grace_period: int = TEARDOWN_GRACE_PERIOD, on_output=None) -> Dict[str, Any]:
+    """拆除一个拓扑项目：只处理带项目标签的容器，并发停止并删除，最后清理项目的网络"""
+    # 兼容加项目标签之前部署的容器，同时按compose的项目标签查找
+    queries = await asyncio.gather(*(
+        run_docker(["docker", "ps", "-aq", "--filter", f"label={label}={project}"], check=False)
+        for label in (TOPOLOGY_PROJECT_LABEL, COMPOSE_PROJECT_LABEL)
+    ))
+    container_ids = list(dict.fromkeys(cid for result in queries for cid in result.stdout.split()))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    errors: List[str] = []
+
+    async def remove(container_id: str):
+        async with semaphore:
+            # 先给容器 grace_period 秒正常退出，超时由 docker stop 强制结束，再删除容器
+            await run_docker(["docker", "stop", "-t", str(grace_period), container_id], check=False)
+            result = await run_docker(["docker", "rm", "-f", container_id], check=False)
+        if result.returncode != 0:
+            errors.append(f"{container_id}: {result.stderr.strip()}")
+        elif on_output is not None:
+            await on_output(f"已删除容器 {container_id[:12]}")
+
+    await asyncio.gather(*(remove(cid) for cid in container_ids))
+
+    # 容器删除后再清理项目的网络
+    networks = (await run_docker(
+        ["docker", "network", "ls", "-q", "--filter", f"label={COMPOSE_PROJECT_LABEL}={project}"], check=False
+    )).stdout.split()
+    if networks:
+        result = await run_docker(["docker", "network", "rm", *networks], check=False)
+        if result.returncode != 0:
+            errors.append(f"network rm: {result.stderr.strip()}")
+    return {"containers": len(container_ids), "networks": len(networks), "errors": errors}
+
+
+def dynamic_compose_cmd(compose_file: str, *args: str) -> List[str]:
+    """动态拓扑使用固定的项目名，不同版本的配置部署到同一个compose项目中"""
+    return ["docker-compose", "-p", DYNAMIC_TOPOLOGY_PROJECT, "-f", compose_file,
+            "--project-directory", TEMPLATES_DIR, *args]
+
+
 class DynamicTopologyAction(BaseModel):
     action: str  # start | stop | status
     config: Dict[str, Any] = Field(description="Dynamic Docker compose configuration")
+    async_job: bool = Field(False, description="为 true 时 start/stop 立即返回任务ID，进度通过 /ws/logs 推送")
+
+@api_router.get("/topology/status_cache")
+async def get_topology_status_cache():
+    """拓扑状态缓存的命中情况和docker事件流状态"""
+    return topology_status.stats()
+
+@api_router.get("/topology/jobs")
+async def list_topology_jobs():
+    """最近的编排任务"""
+    return {"jobs": [job.to_dict() for job in reversed(topology_jobs.jobs.values())]}
+
+@api_router.get("/topology/jobs/{job_id}")
+async def get_topology_job(job_id: str):
+    """查询编排任务的状态、进度和结果"""
+    job = topology_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job.to_dict()
+
+@api_router.get("/jobs")
+async def list_jobs(kind: Optional[str] = None):
+    """最近的编排任务和智能体任务，按创建时间倒序"""
+    jobs = sorted([*topology_jobs.jobs.values(), *agent_jobs.jobs.values()], key=lambda job: job.created_at, reverse=True)
+    return {"jobs": [job.to_dict() for job in jobs if kind is None or job.kind == kind]}
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """查询任务状态和结果；wait>0 时长轮询，最多等待 wait 秒（不超过 JOB_LONG_POLL_MAX）直到任务结束"""
+    job = find_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    if wait > 0 and not job.done and job.task is not None:
+        await asyncio.wait({job.task}, timeout=min(wait, JOB_LONG_POLL_MAX))
+    return job.to_dict()
+
+@api_router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """取消正在执行的任务"""
+    job = find_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    manager = topology_jobs if topology_jobs.get(job_id) is job else agent_jobs
+    if not manager.cancel(job):
+        raise HTTPException(status_code=409, detail=f"Job '{job_id}' already {job.status}")
+    await asyncio.wait({job.task})
+    return job.to_dict()
 
 @api_router.post("/topology/dynamic")
 async def manage_dynamic_topology(req: DynamicTopologyAction):
@@ -328,67 +2846,90 @@ async def manage_dynamic_topology(req: DynamicTopologyAction):
     logger.info(f"Received dynamic topology action: {req.action}")
 
     if req.action == "start":
-        return await start_dynamic_topology(req.config)
+        return await run_topology_job("dynamic_start", start_dynamic_topology, req.config, async_job=req.async_job)
     elif req.action == "stop":
-        return await stop_dynamic_topology()
+        return await run_topology_job("dynamic_stop", stop_dynamic_topology, async_job=req.async_job)
     elif req.action == "status":
         return await get_dynamic_topology_status()
     else:
         raise HTTPException(status_code=400, detail=f"Unknown action: {req.action}")
 
-async def start_dynamic_topology(config: Dict[str, Any]):
-    """启动动态生成的拓扑"""
-    try:
-        # 创建临时的docker-compose文件
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yml', delete=False) as f:
-            yaml.dump(config, f, default_flow_style=False)
-            temp_compose_file = f.name
-
-        logger.info(f"Created temporary compose file: {temp_compose_file}")
-        logger.info(f"Config content: {yaml.dump(config, default_flow_style=False)}")
+async def start_dynamic_topology(config: Dict[str, Any], job: Optional[OrchestrationJob] = None):
+    """启动动态生成的拓扑
 
-        # 使用docker-compose启动容器
-        cmd = ["docker-compose", "-f", temp_compose_file, "up", "-d"]
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=TEMPLATES_DIR)
-
-        if result.returncode != 0:
-            logger.error(f"Docker compose up failed: {result.stderr}")
-            raise HTTPException(status_code=500, detail=f"Failed to start containers: {result.stderr}")
+    配置按内容哈希缓存。已有部署且网络等共享配置未变化时，由增量引擎比较期望的拓扑与运行中的容器，
+    只执行必要的新建、重建、启动、网络调整和删除；与当前部署完全相同且无需任何操作时直接返回 already up。
+    首次部署或共享配置变化时整体执行 docker-compose up。
+    """
+    try:
+        config = with_project_label(config)
+        diff = await compose_cache.diff(config)
+        digest, compose_file = await compose_cache.compose_file(config)
+        logger.info(f"Dynamic topology config {digest[:16]}: {compose_file}")
+        services = list(config.get("services") or {})
+
+        if diff["deployed"] and not diff["shared_changed"]:
+            # 按项目标签列出容器，新配置中已删除的服务的容器也在其中，才能生成 remove 操作
+            containers = await project_containers(DYNAMIC_TOPOLOGY_PROJECT)
+            plan = topology_engine.plan(config, containers, diff, await topology_engine.network_names())
+            applied = topology_engine.summary(plan)
+
+            if diff["unchanged"] and len(applied["unchanged"]) == len(services) and not plan["remove"]:
+                logger.info(f"Dynamic topology {digest[:16]} is already up")
+                return {
+                    "status": "success",
+                    "message": f"Dynamic topology already up with {len(services)} services",
+                    "already_up": True,
+                    "config_hash": digest,
+                    "plan": applied,
+                    "running_services": [container_service_info(name, containers[name]) for name in services],
+                    "failed_services": []
+                }
 
-        # 获取运行状态 - 使用更简单的方法
-        status_cmd = ["docker-compose", "-f", temp_compose_file, "ps", "--services"]
-        status_result = subprocess.run(status_cmd, capture_output=True, text=True, cwd=TEMPLATES_DIR)
+            logger.info(f"Dynamic topology plan: {applied}")
+            outcome = await topology_engine.apply(plan, compose_file, on_output=job_output(job))
+            if outcome["errors"]:
+                logger.error(f"Applying topology changes failed: {outcome['errors']}")
+                raise HTTPException(status_code=500, detail=f"Failed to apply topology changes: {outcome['errors']}")
+        else:
+            # 使用docker-compose启动全部容器
+            cmd = dynamic_compose_cmd(compose_file, "up", "-d", "--remove-orphans")
+            result = await run_docker(cmd, cwd=TEMPLATES_DIR, check=False, on_output=job_output(job))
+
+            if result.returncode != 0:
+                logger.error(f"Docker compose up failed: {result.stderr}")
+                raise HTTPException(status_code=500, detail=f"Failed to start containers: {result.stderr}")
+            applied = {"create": services, "recreate": [], "start": [], "reconnect": [], "remove": [], "unchanged": []}
+        await compose_cache.record(digest, compose_file, config)
+
+        # 并发检查所有服务是否就绪
+        service_specs = config.get("services") or {}
+        containers = await compose_containers(compose_file, cwd=TEMPLATES_DIR, project=DYNAMIC_TOPOLOGY_PROJECT)
+        results = await readiness_checker.wait(
+            {name: info.get("Id", "") for name, info in containers.items() if name in service_specs},
+            probes={name: readiness_probe_for(name, spec) for name, spec in service_specs.items()},
+            on_progress=job_output(job)
+        )
 
         running_services = []
         failed_services = []
+        for service_name in service_specs:
+            verdict = results.get(service_name) or {
+                "name": service_name, "status": "failed", "state": "not_created", "error": "Container not created"
+            }
+            if verdict["status"] == "running":
+                running_services.append(verdict)
+            else:
+                failed_services.append(verdict)
 
-        if status_result.returncode == 0:
-            services = status_result.stdout.strip().split('\n')
-            for service_name in services:
-                if service_name:
-                    # 检查每个服务的状态
-                    check_cmd = ["docker-compose", "-f", temp_compose_file, "ps", service_name]
-                    check_result = subprocess.run(check_cmd, capture_output=True, text=True, cwd=TEMPLATES_DIR)
-
-                    if "Up" in check_result.stdout:
-                        running_services.append({
-                            "name": service_name,
-                            "status": "running"
-                        })
-                    else:
-                        failed_services.append({
-                            "name": service_name,
-                            "status": "failed"
-                        })
-        else:
-            logger.warning(f"Failed to get service status: {status_result.stderr}")
-
-        # 清理临时文件
-        os.unlink(temp_compose_file)
+        topology_status.invalidate(DYNAMIC_STATUS_KEY)
 
         return {
             "status": "success",
             "message": f"Dynamic topology started with {len(running_services)} services",
+            "already_up": False,
+            "config_hash": digest,
+            "plan": applied,
             "running_services": running_services,
             "failed_services": failed_services
         }
@@ -397,26 +2938,33 @@ async def start_dynamic_topology(config: Dict[str, Any]):
         logger.error(f"Failed to start dynamic topology: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to start dynamic topology: {str(e)}")
 
-async def stop_dynamic_topology():
-    """停止动态拓扑"""
+async def stop_dynamic_topology(job: Optional[OrchestrationJob] = None):
+    """停止动态拓扑：只拆除本项目部署的容器和网络，不影响主机上的其他容器"""
     try:
-        # 停止所有运行的容器
-        cmd = ["docker", "stop", "$(docker", "ps", "-q)"]
-        result = subprocess.run(" ".join(cmd), shell=True, capture_output=True, text=True)
+        result = await teardown_project(on_output=job_output(job))
+        await compose_cache.clear()
+        topology_status.invalidate(DYNAMIC_STATUS_KEY)
+        if result["errors"]:
+            logger.warning(f"Dynamic topology teardown errors: {result['errors']}")
 
         return {
             "status": "success",
-            "message": "Dynamic topology stopped"
+            "message": f"Dynamic topology stopped ({result['containers']} containers, {result['networks']} networks removed)",
+            **result
         }
     except Exception as e:
         logger.error(f"Failed to stop dynamic topology: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to stop dynamic topology: {str(e)}")
 
 async def get_dynamic_topology_status():
-    """获取动态拓扑状态"""
+    """获取动态拓扑状态（优先使用由docker事件保持最新的缓存）"""
+    return await topology_status.get(DYNAMIC_STATUS_KEY, _docker_ps_status)
+
+async def _docker_ps_status():
+    """查询当前运行中的容器"""
     try:
         cmd = ["docker", "ps", "--format", "json"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = await run_docker(cmd, check=False)
 
         if result.returncode != 0:
             raise HTTPException(status_code=500, detail="Failed to get container status")
@@ -428,6 +2976,7 @@ async def get_dynamic_topology_status():
                 if line:
                     container = json.loads(line)
                     running_services.append({
+                        "id": container.get("ID", ""),
                         "name": container.get("Names", ""),
                         "status": container.get("State", ""),
                         "image": container.get("Image", "")
@@ -443,20 +2992,212 @@ async def get_dynamic_topology_status():
         logger.error(f"Failed to get dynamic topology status: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get status: {str(e)}")
 
+# ---------------------------------------------------------------------------
+# 下游智能体的共享连接池
+# ---------------------------------------------------------------------------
+
+CENTRAL_AGENT_URL = os.getenv("CENTRAL_AGENT_URL", "http://localhost:8006")
+ATTACK_AGENT_URL = os.getenv("ATTACK_AGENT_URL", "http://localhost:8004")
+SCENARIO_AGENT_URL = os.getenv("SCENARIO_AGENT_URL", "http://localhost:8007")
+AGENT_POOL_MAX_CONNECTIONS = int(os.getenv("AGENT_POOL_MAX_CONNECTIONS", "20"))
+AGENT_POOL_MAX_KEEPALIVE = int(os.getenv("AGENT_POOL_MAX_KEEPALIVE", "10"))
+AGENT_POOL_KEEPALIVE_EXPIRY = float(os.getenv("AGENT_POOL_KEEPALIVE_EXPIRY", "60"))
+AGENT_CONNECT_TIMEOUT = float(os.getenv("AGENT_CONNECT_TIMEOUT", "2"))
+AGENT_POOL_TIMEOUT = float(os.getenv("AGENT_POOL_TIMEOUT", "10"))
+
+
+def agent_timeout(seconds: float) -> httpx.Timeout:
+    """按路由设置的超时：读写总时长各不相同，建立连接和等待连接池的时间统一较短"""
+    return httpx.Timeout(seconds, connect=AGENT_CONNECT_TIMEOUT, pool=AGENT_POOL_TIMEOUT)
+
+
+class AgentClients:
+    """每个下游智能体一个长连接池（keep-alive），应用启动时创建、关闭时释放"""
+
+    def __init__(self, base_urls: Dict[str, str]):
+        self.base_urls = base_urls
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _create(self, base_url: str) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            timeout=agent_timeout(30.0),
+            limits=httpx.Limits(
+                max_connections=AGENT_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=AGENT_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=AGENT_POOL_KEEPALIVE_EXPIRY
+            )
+        )
+
+    async def start(self):
+        for name, base_url in self.base_urls.items():
+            if name not in self.clients:
+                self.clients[name] = self._create(base_url)
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """取得智能体的连接池，未启动时（例如直接调用路由函数）按需创建"""
+        client = self.clients.get(name)
+        if client is None or client.is_closed:
+            client = self.clients[name] = self._create(self.base_urls[name])
+        return client
+
+    async def close(self):
+        clients, self.clients = self.clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+agent_clients = AgentClients({
+    "central": CENTRAL_AGENT_URL,
+    "attack": ATTACK_AGENT_URL,
+    "scenario": SCENARIO_AGENT_URL,
+})
+
+# ---------------------------------------------------------------------------
+# 智能体健康注册表
+# ---------------------------------------------------------------------------
+
+AGENT_HEALTH_INTERVAL = float(os.getenv("AGENT_HEALTH_INTERVAL", "5"))
+AGENT_HEALTH_TIMEOUT = float(os.getenv("AGENT_HEALTH_TIMEOUT", "1"))
+AGENT_HEALTH_RISE = int(os.getenv("AGENT_HEALTH_RISE", "2"))  # 连续成功几次才标记为可用
+AGENT_HEALTH_FALL = int(os.getenv("AGENT_HEALTH_FALL", "2"))  # 连续失败几次才标记为不可用
+
+
+def default_health_targets() -> Dict[str, str]:
+    """需要检查的智能体和MCP服务：智能体检查 /health，MCP服务只检查端口能否连接"""
+    return {
+        "central": f"{CENTRAL_AGENT_URL}/health",
+        "attack": f"{ATTACK_AGENT_URL}/health",
+        "scenario": f"{SCENARIO_AGENT_URL}/health",
+        "evaluate": os.getenv("EVALUATE_AGENT_HEALTH_URL", "http://localhost:8014/health"),
+        "attack_service": "tcp://localhost:8001",
+        "scenario_service": "tcp://localhost:8002",
+        "evaluate_service": "tcp://localhost:8005",
+    }
+
+
+class AgentHealthRegistry:
+    """在后台定期检查各智能体和MCP服务，缓存可用状态
+
+    状态切换带滞后：连续 rise 次成功才标记为可用，连续 fall 次失败才标记为不可用，
+    避免偶发的超时导致路由来回切换。尚未检查过的目标视为可用。
+    代理路由失败时可以调用 report_failure 立即计入一次失败，不必等下一轮检查。
+    """
+
+    def __init__(self, targets: Dict[str, str], interval: float = AGENT_HEALTH_INTERVAL,
+                 timeout: float = AGENT_HEALTH_TIMEOUT, rise: int = AGENT_HEALTH_RISE, fall: int = AGENT_HEALTH_FALL):
+        self.targets = targets
+        self.interval = interval
+        self.timeout = timeout
+        self.rise = rise
+        self.fall = fall
+        self.states: Dict[str, Dict[str, Any]] = {
+            name: {"up": None, "successes": 0, "failures": 0, "last_checked": None, "last_change": None,
+                   "latency_ms": None, "error": None}
+            for name in targets
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def is_up(self, name: str) -> bool:
+        state = self.states.get(name)
+        return state is None or state["up"] is not False
+
+    def _record(self, name: str, ok: bool, error: Optional[str] = None, latency_ms: Optional[float] = None):
+        state = self.states[name]
+        state["last_checked"] = time.time()
+        state["latency_ms"] = latency_ms
+        state["error"] = error
+        if ok:
+            state["successes"] += 1
+            state["failures"] = 0
+            changed = state["up"] is None or (not state["up"] and state["successes"] >= self.rise)
+            new_state = True
+        else:
+            state["failures"] += 1
+            state["successes"] = 0
+            changed = state["up"] is None or (state["up"] and state["failures"] >= self.fall)
+            new_state = False
+        if changed and state["up"] != new_state:
+            state["up"] = new_state
+            state["last_change"] = time.time()
+            logger.info(f"智能体 {name} 状态变为 {'可用' if new_state else '不可用'}" + (f": {error}" if error else ""))
+
+    def report_failure(self, name: str, error: Exception):
+        """代理请求连接失败时计入一次失败"""
+        if name in self.states:
+            self._record(name, False, f"{type(error).__name__}: {error}")
+
+    async def check(self, name: str):
+        url = self.targets[name]
+        started = time.monotonic()
+        try:
+            if url.startswith("tcp://"):
+                host, _, port = url[len("tcp://"):].partition(":")
+                _, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port)), timeout=self.timeout)
+                writer.close()
+            else:
+                if self._client is None or self._client.is_closed:
+                    self._client = httpx.AsyncClient(timeout=self.timeout)
+                response = await self._client.get(url)
+                response.raise_for_status()
+        except Exception as e:
+            self._record(name, False, f"{type(e).__name__}: {e}")
+            return
+        self._record(name, True, latency_ms=round((time.monotonic() - started) * 1000, 1))
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(name) for name in self.targets))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            name: {"target": self.targets[name], **state}
+            for name, state in self.states.items()
+        }
+
+
+agent_health = AgentHealthRegistry(default_health_targets())
+
 # 添加攻击智能体相关的API
 class AttackRequest(BaseModel):
     target_host: str = Field(description="攻击目标的主机地址，例如 http://127.0.0.1:8005")
+    async_job: bool = Field(False, description="为 true 时立即返回任务ID，进度和结果通过 /ws/logs 推送，也可通过 /api/jobs/{job_id} 查询")
 
 @api_router.post("/attack/execute_full_attack")
 async def execute_full_attack(req: AttackRequest):
     """
     接收来自前端的攻击请求，并转发给中控智能体
     """
+    return await run_job(agent_jobs, "attack_full", _execute_full_attack, req,
+                         async_job=req.async_job, params={"target_host": req.target_host})
+
+async def _execute_full_attack(req: AttackRequest, job: Optional[OrchestrationJob] = None):
     logger.info(f"Received attack request for target: {req.target_host}")
     
     try:
         # 中控智能体的URL
-        central_agent_url = "http://localhost:8006/process_command"
+        central_agent_url = f"{CENTRAL_AGENT_URL}/process_command"
         
         # 记录请求开始
         logger.info(f"Forwarding attack request to central agent at {central_agent_url}")
@@ -474,98 +3215,66 @@ async def execute_full_attack(req: AttackRequest):
         logger.info(f"Payload to central agent: {central_agent_payload}")
         
         # 使用httpx发送请求到中控智能体
-        async with httpx.AsyncClient() as client:
-            try:
-                # 尝试连接中控智能体
-                try:
-                    # 先检查中控智能体是否可用
-                    logger.info("正在检查中控智能体连接状态...")
-                    check_response = await client.get(
-                        "http://localhost:8006/docs",
-                        timeout=2.0
-                    )
-                    logger.info(f"中控智能体连接检查成功，状态码: {check_response.status_code}")
-                except httpx.TimeoutException as e:
-                    logger.error(f"中控智能体连接超时: {str(e)}")
-                    raise httpx.RequestError(f"Central agent timeout: {str(e)}", request=None)
-                except httpx.ConnectError as e:
-                    logger.error(f"中控智能体连接被拒绝: {str(e)}")
-                    raise httpx.RequestError(f"Central agent connection refused: {str(e)}", request=None)
-                except Exception as e:
-                    logger.error(f"中控智能体连接检查失败: {type(e).__name__}: {str(e)}")
-                    raise httpx.RequestError(f"Central agent unavailable: {str(e)}", request=None)
-                
-                # 发送请求到中控智能体
-                logger.info(f"正在向中控智能体发送攻击请求: {central_agent_url}")
-                logger.info(f"请求载荷: {central_agent_payload}")
-                response = await client.post(
-                    central_agent_url,
-                    json=central_agent_payload,
-                    timeout=400.0  # 增加超时时间，因为中控智能体需要调用LLM分析+攻击智能体执行(300s)
-                )
-                logger.info(f"中控智能体响应状态码: {response.status_code}")
-            except httpx.RequestError as e:
-                logger.error(f"中控智能体请求错误: {type(e).__name__}: {str(e)}")
-                # 如果中控智能体不可用，直接调用攻击智能体
-                logger.warning("中控智能体不可用，尝试直接调用攻击智能体")
-
-                # 尝试连接攻击智能体
-                try:
-                    # 先检查攻击智能体是否可用
-                    logger.info("正在检查攻击智能体连接状态...")
-                    check_response = await client.get(
-                        "http://localhost:8004/docs",
-                        timeout=2.0
-                    )
-                    logger.info(f"攻击智能体连接检查成功，状态码: {check_response.status_code}")
-                except httpx.TimeoutException as e:
-                    logger.error(f"攻击智能体连接超时: {str(e)}")
-                    return {
-                        "status": "error",
-                        "message": "Both central agent and attack agent are unavailable (timeout).",
-                        "error_details": f"Central agent error: {str(e)}, Attack agent timeout"
-                    }
-                except httpx.ConnectError as e:
-                    logger.error(f"攻击智能体连接被拒绝: {str(e)}")
-                    return {
-                        "status": "error",
-                        "message": "Both central agent and attack agent are unavailable (connection refused).",
-                        "error_details": f"Central agent error: {str(e)}, Attack agent connection refused"
-                    }
-                except Exception as e:
-                    logger.error(f"攻击智能体连接检查失败: {type(e).__name__}: {str(e)}")
-                    # 如果攻击智能体也不可用，返回模拟数据
-                    return {
-                        "status": "simulated",
-                        "message": "Both central agent and attack agent are unavailable. Using simulated data.",
-                        "final_output": "模拟攻击过程：\n1. 扫描目标主机\n2. 发现开放端口\n3. 生成钓鱼邮件\n4. 发送钓鱼邮件\n5. 攻击成功，获取到目标凭据",
-                        "error_details": f"Central agent error: {str(e)}, Attack agent error: {str(e)}"
-                    }
-                
-                # 发送请求到攻击智能体
-                attack_agent_url = "http://localhost:8004/execute_full_attack"
-                attack_payload = {"target_host": req.target_host}
-                logger.info(f"正在向攻击智能体发送请求: {attack_agent_url}")
-                logger.info(f"攻击智能体请求载荷: {attack_payload}")
-                response = await client.post(
-                    attack_agent_url,
-                    json=attack_payload,
-                    timeout=60.0
-                )
-                logger.info(f"攻击智能体响应状态码: {response.status_code}")
-            
-            # 检查响应状态
-            response.raise_for_status()
-            
-            # 获取响应数据
-            result = response.json()
-            
-            # 记录成功响应
-            logger.info(f"Central agent responded successfully: {result}")
-            
-            # 返回中控智能体的响应
-            return result
-            
+        client = agent_clients.get("central")
+        try:
+            # 由健康注册表判断中控智能体是否可用，不再在每次请求前探测
+            if not agent_health.is_up("central"):
+                logger.warning("健康检查显示中控智能体不可用")
+                raise httpx.RequestError(f"Central agent unavailable: {agent_health.states['central']['error']}", request=None)
+
+            # 发送请求到中控智能体
+            if job is not None:
+                await job.report(f"中控智能体正在分析并执行对 {req.target_host} 的攻击")
+            logger.info(f"正在向中控智能体发送攻击请求: {central_agent_url}")
+            logger.info(f"请求载荷: {central_agent_payload}")
+            response = await client.post(
+                central_agent_url,
+                json=central_agent_payload,
+                timeout=agent_timeout(400.0)  # 增加超时时间，因为中控智能体需要调用LLM分析+攻击智能体执行(300s)
+            )
+            logger.info(f"中控智能体响应状态码: {response.status_code}")
+        except httpx.RequestError as e:
+            logger.error(f"中控智能体请求错误: {type(e).__name__}: {str(e)}")
+            if isinstance(e, httpx.ConnectError):
+                agent_health.report_failure("central", e)
+            # 如果中控智能体不可用，直接调用攻击智能体
+            logger.warning("中控智能体不可用，尝试直接调用攻击智能体")
+
+            if not agent_health.is_up("attack"):
+                logger.error("健康检查显示攻击智能体也不可用")
+                return {
+                    "status": "error",
+                    "message": "Both central agent and attack agent are unavailable.",
+                    "error_details": f"Central agent error: {str(e)}, Attack agent error: {agent_health.states['attack']['error']}"
+                }
+
+            # 发送请求到攻击智能体
+            if job is not None:
+                await job.report("中控智能体不可用，改由攻击智能体直接执行", level="warning")
+            client = agent_clients.get("attack")
+            attack_agent_url = f"{ATTACK_AGENT_URL}/execute_full_attack"
+            attack_payload = {"target_host": req.target_host}
+            logger.info(f"正在向攻击智能体发送请求: {attack_agent_url}")
+            logger.info(f"攻击智能体请求载荷: {attack_payload}")
+            response = await client.post(
+                attack_agent_url,
+                json=attack_payload,
+                timeout=agent_timeout(60.0)
+            )
+            logger.info(f"攻击智能体响应状态码: {response.status_code}")
+
+        # 检查响应状态
+        response.raise_for_status()
+
+        # 获取响应数据
+        result = response.json()
+
+        # 记录成功响应
+        logger.info(f"Central agent responded successfully: {result}")
+
+        # 返回中控智能体的响应
+        return result
+
     except httpx.HTTPStatusError as e:
         error_msg = f"HTTP error occurred when contacting attack agent: {e.response.status_code} {e.response.text}"
         logger.error(f"HTTP状态错误: {error_msg}")
@@ -598,31 +3307,31 @@ async def execute_random_social_attack(req: dict):
     
     try:
         # 攻击智能体的URL
-        attack_agent_url = "http://localhost:8004/execute_random_social_attack"
+        attack_agent_url = f"{ATTACK_AGENT_URL}/execute_random_social_attack"
         
         # 记录请求开始
         logger.info(f"Forwarding social engineering attack request to attack agent at {attack_agent_url}")
         
         # 使用httpx发送请求到攻击智能体
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                attack_agent_url,
-                json=req,
-                timeout=30.0
-            )
-            
-            # 检查响应状态
-            response.raise_for_status()
-            
-            # 获取响应数据
-            result = response.json()
-            
-            # 记录成功响应
-            logger.info(f"Attack agent responded successfully: {result}")
-            
-            # 返回攻击智能体的响应
-            return result
-            
+        client = agent_clients.get("attack")
+        response = await client.post(
+            attack_agent_url,
+            json=req,
+            timeout=agent_timeout(30.0)
+        )
+
+        # 检查响应状态
+        response.raise_for_status()
+
+        # 获取响应数据
+        result = response.json()
+
+        # 记录成功响应
+        logger.info(f"Attack agent responded successfully: {result}")
+
+        # 返回攻击智能体的响应
+        return result
+
     except httpx.HTTPStatusError as e:
         error_msg = f"HTTP error occurred when contacting attack agent: {e.response.status_code} {e.response.text}"
         logger.error(error_msg)
@@ -646,16 +3355,16 @@ async def parse_apt_scenario():
 
     try:
         # 场景智能体的URL
-        scenario_agent_url = "http://localhost:8007/parse_apt_scenario"
+        scenario_agent_url = f"{SCENARIO_AGENT_URL}/parse_apt_scenario"
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(scenario_agent_url, timeout=30.0)
-            response.raise_for_status()
+        client = agent_clients.get("scenario")
+        response = await client.get(scenario_agent_url, timeout=agent_timeout(30.0))
+        response.raise_for_status()
 
-            result = response.json()
-            logger.info("APT场景解析成功")
+        result = response.json()
+        logger.info("APT场景解析成功")
 
-            return result
+        return result
 
     except httpx.HTTPStatusError as e:
         error_msg = f"场景智能体HTTP错误: {e.response.status_code} {e.response.text}"
@@ -670,8 +3379,131 @@ async def parse_apt_scenario():
         logger.error(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
+# ---------------------------------------------------------------------------
+# 场景分析结果缓存：相同提示词的并发请求合并为一次调用，结果缓存一段时间
+# ---------------------------------------------------------------------------
+
+SCENARIO_CACHE_TTL = float(os.getenv("SCENARIO_CACHE_TTL", "600"))  # 0 表示只合并并发请求，不缓存结果
+SCENARIO_CACHE_MAX_ENTRIES = int(os.getenv("SCENARIO_CACHE_MAX_ENTRIES", "256"))
+SCENARIO_CACHE_NEGATIVE_TTL = float(os.getenv("SCENARIO_CACHE_NEGATIVE_TTL", "0"))  # 没有可用数据的结果的缓存秒数，0 表示不缓存
+
+
+def normalize_prompt(prompt: str) -> str:
+    """统一全角/半角、大小写、空白和结尾标点，使只有书写差异的提示词得到相同的键"""
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    text = re.sub(r"(?<=[\u2e80-\u9fff]) | (?=[\u2e80-\u9fff])", "", text)  # 中文字符两侧的空白没有意义
+    return text.rstrip("。.!！?？~～ ")
+
+
+class ScenarioResultCache:
+    """按 (接口, 规范化提示词) 缓存场景智能体的结果
+
+    同一个键同时只有一个请求发往场景智能体，其余请求等待同一个结果；
+    带有可用数据的结果保留 ttl 秒，没有可用数据的结果(例如没有拓扑数据)只保留 negative_ttl 秒，
+    失败不缓存，下一个请求会重新调用。
+    """
+
+    def __init__(self, ttl: float = SCENARIO_CACHE_TTL, max_entries: int = SCENARIO_CACHE_MAX_ENTRIES,
+                 negative_ttl: float = SCENARIO_CACHE_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.unusable = 0
+
+    @staticmethod
+    def key(kind: str, prompt: str) -> Tuple[str, str]:
+        return kind, hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+
+    async def get(self, kind: str, prompt: str, loader, refresh: bool = False, usable=None):
+        """返回缓存或正在进行的调用结果，都没有时调用 loader()；refresh=True 时忽略已缓存的结果
+
+        usable(result) 返回 False 的结果按 negative_ttl 缓存。
+        """
+        key = self.key(kind, prompt)
+        entry = self.entries.get(key)
+        if entry is not None and not refresh:
+            if time.monotonic() < entry[0]:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            pending = asyncio.ensure_future(self._load(key, loader, usable))
+            self._inflight[key] = pending
+            pending.add_done_callback(lambda f: self._inflight.pop(key, None) if self._inflight.get(key) is f else None)
+        return await asyncio.shield(pending)
+
+    async def _load(self, key: Tuple[str, str], loader, usable=None):
+        result = await loader()
+        ttl = self.ttl
+        if usable is not None and not usable(result):
+            self.unusable += 1
+            ttl = min(ttl, self.negative_ttl)
+        if ttl > 0:
+            self.entries[key] = (time.monotonic() + ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "unusable": self.unusable,
+            "ttl": self.ttl,
+            "negative_ttl": self.negative_ttl,
+        }
+
+
+def scenario_data(result: Any) -> Any:
+    """场景智能体成功响应中的 data 字段，响应不成功时返回 None"""
+    if not isinstance(result, dict) or result.get("status") != "success":
+        return None
+    return result.get("data")
+
+
+def has_topology_data(result: Any) -> bool:
+    """综合处理的结果中有拓扑数据(raw_tool_data)才值得缓存"""
+    data = scenario_data(result)
+    return isinstance(data, dict) and bool(data.get("raw_tool_data"))
+
+
+scenario_cache = ScenarioResultCache()
+
+
 class ScenarioAnalysisRequest(BaseModel):
     prompt: str = Field(description="用户输入的场景描述")
+    async_job: bool = Field(False, description="为 true 时立即返回任务ID（仅 process_request 支持），结果通过 /ws/logs 推送")
+    refresh: bool = Field(False, description="为 true 时不使用缓存的分析结果，重新调用场景智能体")
+
+@api_router.get("/scenario/cache")
+async def get_scenario_cache():
+    """场景分析结果缓存的命中和合并情况"""
+    return scenario_cache.stats()
+
+@api_router.delete("/scenario/cache")
+async def clear_scenario_cache():
+    """清空缓存的场景分析结果"""
+    scenario_cache.clear()
+    return scenario_cache.stats()
 
 @api_router.post("/scenario/analyze_prompt")
 async def analyze_scenario_prompt(req: ScenarioAnalysisRequest):
@@ -682,20 +3514,23 @@ async def analyze_scenario_prompt(req: ScenarioAnalysisRequest):
 
     try:
         # 场景智能体的URL
-        scenario_agent_url = "http://localhost:8007/analyze_prompt"
+        scenario_agent_url = f"{SCENARIO_AGENT_URL}/analyze_prompt"
 
-        async with httpx.AsyncClient() as client:
+        async def analyze():
+            client = agent_clients.get("scenario")
             response = await client.post(
                 scenario_agent_url,
                 json={"prompt": req.prompt},
-                timeout=30.0
+                timeout=agent_timeout(30.0)
             )
             response.raise_for_status()
+            return response.json()
 
-            result = response.json()
-            logger.info("场景提示词分析成功")
+        result = await scenario_cache.get("analyze_prompt", req.prompt, analyze, refresh=req.refresh,
+                                          usable=lambda r: bool(scenario_data(r)))
+        logger.info("场景提示词分析成功")
 
-            return result
+        return result
 
     except httpx.HTTPStatusError as e:
         error_msg = f"场景智能体HTTP错误: {e.response.status_code} {e.response.text}"
@@ -715,30 +3550,38 @@ async def process_scenario_request(req: ScenarioAnalysisRequest):
     """
     综合处理场景请求：分析提示词 -> 生成场景 -> 返回拓扑数据
     """
+    return await run_job(agent_jobs, "scenario_process", _process_scenario_request, req,
+                         async_job=req.async_job, params={"prompt": req.prompt[:100]})
+
+async def _process_scenario_request(req: ScenarioAnalysisRequest, job: Optional[OrchestrationJob] = None):
     logger.info(f"收到综合场景处理请求: {req.prompt[:100]}...")
 
     try:
         # 场景智能体的URL
-        scenario_agent_url = "http://localhost:8007/process_scenario_request"
+        scenario_agent_url = f"{SCENARIO_AGENT_URL}/process_scenario_request"
 
         logger.info(f"开始调用场景智能体: {scenario_agent_url}")
         logger.info(f"请求内容: {req.prompt}")
+        if job is not None:
+            await job.report("场景智能体正在分析提示词并生成场景")
 
-        async with httpx.AsyncClient() as client:
+        async def process():
+            client = agent_clients.get("scenario")
             response = await client.post(
                 scenario_agent_url,
                 json={"prompt": req.prompt},
-                timeout=300.0  # 增加超时时间到5分钟
+                timeout=agent_timeout(300.0)  # 增加超时时间到5分钟
             )
-
             logger.info(f"场景智能体响应状态码: {response.status_code}")
             response.raise_for_status()
+            return response.json()
 
-            result = response.json()
-            logger.info("综合场景处理成功")
-            logger.info(f"响应数据长度: {len(str(result))} 字符")
+        result = await scenario_cache.get("process_request", req.prompt, process, refresh=req.refresh,
+                                          usable=has_topology_data)
+        logger.info("综合场景处理成功")
+        logger.info(f"响应数据长度: {len(str(result))} 字符")
 
-            return result
+        return result
 
     except httpx.HTTPStatusError as e:
         error_msg = f"场景智能体HTTP错误: {e.response.status_code} {e.response.text}"
@@ -759,36 +3602,43 @@ async def process_scenario_request(req: ScenarioAnalysisRequest):
 
 class ContainerDeploymentRequest(BaseModel):
     topology_data: Dict[str, Any] = Field(description="拓扑数据用于容器部署")
+    async_job: bool = Field(False, description="为 true 时立即返回任务ID，进度和结果通过 /ws/logs 推送")
 
 @api_router.post("/scenario/deploy_containers")
 async def deploy_scenario_containers(req: ContainerDeploymentRequest):
     """
     部署场景容器 - 转发到场景智能体
     """
+    return await run_job(agent_jobs, "scenario_deploy", _deploy_scenario_containers, req, async_job=req.async_job,
+                         params={"nodes": len(req.topology_data.get("nodes", []))})
+
+async def _deploy_scenario_containers(req: ContainerDeploymentRequest, job: Optional[OrchestrationJob] = None):
     logger.info("收到场景容器部署请求")
 
     try:
         # 场景智能体的URL
-        scenario_agent_url = "http://localhost:8007/deploy_containers"
+        scenario_agent_url = f"{SCENARIO_AGENT_URL}/deploy_containers"
 
         logger.info(f"开始调用场景智能体: {scenario_agent_url}")
         logger.info(f"拓扑数据节点数: {len(req.topology_data.get('nodes', []))}")
+        if job is not None:
+            await job.report(f"场景智能体正在部署 {len(req.topology_data.get('nodes', []))} 个节点的容器")
+
+        client = agent_clients.get("scenario")
+        response = await client.post(
+            scenario_agent_url,
+            json={"topology_data": req.topology_data},
+            timeout=agent_timeout(300.0)  # 5分钟超时
+        )
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                scenario_agent_url,
-                json={"topology_data": req.topology_data},
-                timeout=300.0  # 5分钟超时
-            )
-
-            logger.info(f"场景智能体响应状态码: {response.status_code}")
-            response.raise_for_status()
+        logger.info(f"场景智能体响应状态码: {response.status_code}")
+        response.raise_for_status()
 
-            result = response.json()
-            logger.info("场景容器部署成功")
-            logger.info(f"响应数据: {result}")
+        result = response.json()
+        logger.info("场景容器部署成功")
+        logger.info(f"响应数据: {result}")
 
-            return result
+        return result
 
     except httpx.HTTPStatusError as e:
         error_msg = f"场景智能体HTTP错误: {e.response.status_code} {e.response.text}"
@@ -816,25 +3666,25 @@ async def deploy_apt_ready_scenario():
 
     try:
         # 场景智能体的URL
-        scenario_agent_url = "http://localhost:8007/deploy_apt_ready"
+        scenario_agent_url = f"{SCENARIO_AGENT_URL}/deploy_apt_ready"
 
         logger.info(f"开始调用场景智能体: {scenario_agent_url}")
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                scenario_agent_url,
-                json={},
-                timeout=300.0  # 5分钟超时
-            )
+        client = agent_clients.get("scenario")
+        response = await client.post(
+            scenario_agent_url,
+            json={},
+            timeout=agent_timeout(300.0)  # 5分钟超时
+        )
 
-            logger.info(f"场景智能体响应状态码: {response.status_code}")
-            response.raise_for_status()
+        logger.info(f"场景智能体响应状态码: {response.status_code}")
+        response.raise_for_status()
 
-            result = response.json()
-            logger.info("apt-ready场景容器部署成功")
-            logger.info(f"响应数据: {result}")
+        result = response.json()
+        logger.info("apt-ready场景容器部署成功")
+        logger.info(f"响应数据: {result}")
 
-            return result
+        return result
 
     except httpx.HTTPStatusError as e:
         error_msg = f"场景智能体HTTP错误: {e.response.status_code} {e.response.text}"
@@ -856,4 +3706,85 @@ async def deploy_apt_ready_scenario():
 # Register router
 app.include_router(api_router)
 
-# 启动命令示例：uvicorn backend.main:app --reload --port 8080 
\ No newline at end of file
+@app.get("/api/health")
+async def get_agent_health():
+    """各智能体和MCP服务的健康状态（来自后台定期检查的缓存）"""
+    agents = agent_health.snapshot()
+    return {
+        "status": "ok" if all(agent_health.is_up(name) for name in agents) else "degraded",
+        "agents": agents
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """以Prometheus文本格式导出日志中心的监控指标"""
+    lines = []
+    for counter, help_text in LogHubMetrics.COUNTERS.items():
+        name = f"loghub_messages_{counter}_total"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for source, value in log_hub_metrics.counters[counter].items():
+            lines.append(f"{name}{_format_labels({'source': source})} {value}")
+
+    gauges = [
+        ("loghub_connected_clients", "当前连接的WebSocket客户端数", len(connected_clients)),
+        ("loghub_ingest_queue_depth", "接收队列中等待分发的日志数", log_ingest.depth()),
+        ("loghub_ingest_dropped_total", "接收队列满时丢弃的日志数", log_ingest.dropped),
+        ("loghub_journal_last_seq", "最后分配的日志序号", log_journal.last_seq),
+        ("loghub_event_loop_lag_seconds_last", "最近一次测得的事件循环延迟", log_hub_metrics.last_event_loop_lag),
+    ]
+    for name, help_text, value in gauges:
+        metric_type = "counter" if name.endswith("_total") else "gauge"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+
+    subscribers = list(connected_clients.values())
+    lines += ["# HELP loghub_client_queue_depth 每个客户端发送队列中的消息数",
+              "# TYPE loghub_client_queue_depth gauge"]
+    lines += [f"loghub_client_queue_depth{_format_labels({'client': sub.client_id})} {len(sub.queue)}"
+              for sub in subscribers]
+    lines += ["# HELP loghub_client_dropped_total 每个客户端因队列溢出丢弃的消息数",
+              "# TYPE loghub_client_dropped_total counter"]
+    lines += [f"loghub_client_dropped_total{_format_labels({'client': sub.client_id})} {sub.dropped_count}"
+              for sub in subscribers]
+    lines += ["# HELP loghub_client_send_seconds 每个客户端单帧发送耗时",
+              "# TYPE loghub_client_send_seconds histogram"]
+    for sub in subscribers:
+        lines += sub.send_latency.render("loghub_client_send_seconds", {"client": sub.client_id})
+
+    lines += ["# HELP loghub_event_loop_lag_seconds 事件循环延迟",
+              "# TYPE loghub_event_loop_lag_seconds histogram"]
+    lines += log_hub_metrics.event_loop_lag.render("loghub_event_loop_lag_seconds", {})
+    return "\n".join(lines) + "\n"
+
+@app.on_event("startup")
+async def start_log_ingest():
+    """启动日志分发协程、发布/订阅层和事件循环延迟监控"""
+    await log_pubsub.start()
+    await agent_clients.start()
+    agent_health.start()
+    log_ingest.start()
+    log_hub_metrics.start_lag_monitor()
+
+@app.on_event("shutdown")
+async def close_log_journal():
+    """关闭时处理完接收队列中的日志，并把未写完的日志写入文件"""
+    log_hub_metrics.stop_lag_monitor()
+    await log_ingest.stop()
+    await log_pubsub.stop()
+    await log_journal.close()
+    await topology_status.stop()
+    await close_docker_api_client()
+    await agent_health.stop()
+    await agent_clients.close()
+
+# 启动命令示例：uvicorn backend.main:app --reload --port 8080
+if __name__ == "__main__":
+    import uvicorn
+    # BACKEND_WORKERS>1 时启动多个worker，日志通过Unix套接字在worker之间共享
+    workers = int(os.getenv("BACKEND_WORKERS", "1"))
+    if workers > 1:
+        os.environ.setdefault("LOG_PUBSUB_BACKEND", "unix")
+        uvicorn.run("main:app", host="0.0.0.0", port=8080, workers=workers, ws_per_message_deflate=True)
+    else:
+        # 启用 permessage-deflate，客户端在握手时声明支持即可压缩日志流
+        uvicorn.run(app, host="0.0.0.0", port=8080, ws_per_message_deflate=True) 
\ No newline at end of file
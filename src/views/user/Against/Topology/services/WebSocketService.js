@@ -63,6 +63,12 @@ class WebSocketService {
           this.connected = true;
           this.reconnectCount = 0;
           
+          // 请求后端合并短时间内的日志，减少攻击高峰期的帧数
+          this.ws.send(JSON.stringify({
+            type: 'subscribe',
+            batch: { window_ms: 20, max_records: 50 }
+          }));
+          
           // 发送一个心跳消息，确保连接正常
           this.sendPing();
           
@@ -106,15 +112,20 @@ class WebSocketService {
               return;
             }
             
-            console.debug('收到WebSocket消息:', JSON.stringify(message, null, 2));
+            // 批量帧是日志数组，逐条分发
+            const messages = Array.isArray(message) ? message : [message];
             
-            // 调用所有消息处理器
-            this.messageHandlers.forEach(handler => {
-              try {
-                handler(message);
-              } catch (error) {
-                console.error('消息处理器执行错误:', error);
-              }
+            messages.forEach(item => {
+              console.debug('收到WebSocket消息:', JSON.stringify(item, null, 2));
+              
+              // 调用所有消息处理器
+              this.messageHandlers.forEach(handler => {
+                try {
+                  handler(item);
+                } catch (error) {
+                  console.error('消息处理器执行错误:', error);
+                }
+              });
             });
           } catch (error) {
             console.error('处理WebSocket消息失败:', error);
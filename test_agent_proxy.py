@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+测试后端转发到各智能体的代理路由
+使用本地启动的假智能体服务，不需要真实的中控/攻击/场景智能体
+"""
+
+import sys
+import os
+import time
+import socket
+import asyncio
+import tempfile
+import threading
+
+os.environ.setdefault("LOG_JOURNAL_DIR", tempfile.mkdtemp(prefix="log_journal_"))
+os.environ.setdefault("LOG_FILTER_RULES_FILE", os.path.join(tempfile.mkdtemp(), "log_filter_rules.json"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import uvicorn
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.testclient import TestClient
+import main as backend
+
+
+def create_fake_agent():
+    """假智能体：记录每个请求的来源端口（同一端口说明复用了同一个连接）和调用次数"""
+    agent = FastAPI()
+    agent.state.client_ports = []
+    agent.state.calls = {}
+    agent.state.healthy = True
+    agent.state.delay = 0.0
+
+    @agent.middleware("http")
+    async def record(request: Request, call_next):
+        agent.state.client_ports.append(request.client.port)
+        agent.state.calls[request.url.path] = agent.state.calls.get(request.url.path, 0) + 1
+        return await call_next(request)
+
+    @agent.get("/health")
+    async def health():
+        if not agent.state.healthy:
+            raise HTTPException(status_code=503, detail="unhealthy")
+        return {"status": "healthy"}
+
+    @agent.post("/analyze_prompt")
+    async def analyze_prompt(body: dict):
+        await asyncio.sleep(agent.state.delay)
+        return {"status": "success", "data": {"prompt": body["prompt"]}}
+
+    @agent.post("/process_scenario_request")
+    async def process_scenario_request(body: dict):
+        await asyncio.sleep(agent.state.delay)
+        # 提示词中含“无拓扑”时模拟智能体没有调用生成工具，没有拓扑数据
+        raw_tool_data = None if "无拓扑" in body["prompt"] else {"nodes": [{"id": "web"}]}
+        return {"status": "success", "data": {"prompt": body["prompt"], "agent_output": "",
+                                              "raw_tool_data": raw_tool_data}}
+
+    @agent.post("/deploy_containers")
+    async def deploy_containers(body: dict):
+        await asyncio.sleep(agent.state.delay)
+        return {"success": True, "nodes": len(body["topology_data"].get("nodes", []))}
+
+    @agent.post("/process_command")
+    async def process_command(body: dict):
+        await asyncio.sleep(agent.state.delay)
+        return {"status": "success", "agent": "central", "target_host": body["target_host"]}
+
+    @agent.post("/execute_full_attack")
+    async def execute_full_attack(body: dict):
+        await asyncio.sleep(agent.state.delay)
+        return {"status": "success", "agent": "attack", "target_host": body["target_host"]}
+
+    return agent
+
+
+class AgentServer:
+    """在后台线程中运行假智能体"""
+
+    def __init__(self, app):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def use_agents(**urls):
+    """让后端把请求转发到假智能体，健康注册表不检查任何目标（全部视为可用）"""
+    for name, url in urls.items():
+        setattr(backend, f"{name.upper()}_AGENT_URL", url)
+    backend.agent_clients = backend.AgentClients({
+        "central": backend.CENTRAL_AGENT_URL,
+        "attack": backend.ATTACK_AGENT_URL,
+        "scenario": backend.SCENARIO_AGENT_URL,
+    })
+    backend.agent_health = backend.AgentHealthRegistry({}, interval=3600)
+    backend.scenario_cache = backend.ScenarioResultCache()
+
+
+def test_pooled_agent_clients():
+    """测试转发请求复用同一个长连接，应用关闭时释放连接池"""
+    print("🧪 测试智能体连接池...")
+
+    fake = create_fake_agent()
+    with AgentServer(fake) as server:
+        use_agents(scenario=server.url)
+        with TestClient(backend.app) as client:
+            for i in range(5):
+                result = client.post("/api/scenario/analyze_prompt", json={"prompt": f"提示词{i}"}).json()
+                assert result["data"]["prompt"] == f"提示词{i}"
+            pool = backend.agent_clients.get("scenario")
+        assert len(set(fake.state.client_ports)) == 1, fake.state.client_ports
+        assert pool.is_closed
+    print(f"✅ 5次转发复用了 {len(set(fake.state.client_ports))} 个连接，关闭时连接池已释放")
+    print()
+
+
+def test_agent_health_registry():
+    """测试健康检查的滞后切换、/api/health 输出，以及中控不可用时立即切换到攻击智能体"""
+    print("🧪 测试智能体健康注册表...")
+
+    central = create_fake_agent()
+    attack = create_fake_agent()
+    with AgentServer(central) as central_server, AgentServer(attack) as attack_server:
+        use_agents(central=central_server.url, attack=attack_server.url)
+        backend.agent_health = backend.AgentHealthRegistry({
+            "central": f"{central_server.url}/health",
+            "attack": f"{attack_server.url}/health",
+        }, interval=3600, rise=2, fall=2)
+        registry = backend.agent_health
+
+        with TestClient(backend.app) as client:
+            client.portal.call(registry.check_all)
+            assert registry.is_up("central") and registry.is_up("attack")
+            assert client.get("/api/health").json()["status"] == "ok"
+
+            # 一次失败不切换，连续两次失败才标记为不可用
+            central.state.healthy = False
+            client.portal.call(registry.check_all)
+            assert registry.is_up("central")
+            client.portal.call(registry.check_all)
+            assert not registry.is_up("central")
+            health = client.get("/api/health").json()
+            assert health["status"] == "degraded"
+            assert health["agents"]["central"]["up"] is False
+            assert "503" in health["agents"]["central"]["error"]
+
+            # 中控不可用时直接转发到攻击智能体，不再探测 /docs
+            started = time.monotonic()
+            result = client.post("/api/attack/execute_full_attack", json={"target_host": "127.0.0.1"}).json()
+            elapsed = time.monotonic() - started
+            assert result["agent"] == "attack", result
+            assert central.state.calls.get("/process_command", 0) == 0
+            assert "/docs" not in central.state.calls and "/docs" not in attack.state.calls
+
+            # 恢复后同样需要连续两次成功
+            central.state.healthy = True
+            client.portal.call(registry.check_all)
+            assert not registry.is_up("central")
+            client.portal.call(registry.check_all)
+            assert registry.is_up("central")
+            result = client.post("/api/attack/execute_full_attack", json={"target_host": "127.0.0.1"}).json()
+            assert result["agent"] == "central", result
+
+            # 两个都不可用时立即返回错误
+            central.state.healthy = attack.state.healthy = False
+            for _ in range(2):
+                client.portal.call(registry.check_all)
+            result = client.post("/api/attack/execute_full_attack", json={"target_host": "127.0.0.1"}).json()
+            assert result["status"] == "error", result
+        assert registry._task is None
+    print(f"✅ 健康状态滞后切换正常，故障切换耗时 {elapsed * 1000:.0f}ms")
+    print()
+
+
+def test_agent_jobs():
+    """测试攻击和场景操作作为后台任务提交：立即返回任务ID，结果通过WebSocket推送，可长轮询和取消"""
+    print("🧪 测试智能体后台任务...")
+
+    fake = create_fake_agent()
+    fake.state.delay = 0.5
+    with AgentServer(fake) as server:
+        use_agents(central=server.url, attack=server.url, scenario=server.url)
+        with TestClient(backend.app) as client, client.websocket_connect("/ws/logs") as ws:
+            ws.receive_json()
+            ws.send_json({"type": "subscribe", "sources": [backend.AGENT_JOB_LOG_SOURCE]})
+            assert ws.receive_json()["type"] == "subscribed"
+
+            started = time.monotonic()
+            response = client.post("/api/attack/execute_full_attack", json={"target_host": "10.0.0.5", "async_job": True})
+            assert response.status_code == 202
+            assert time.monotonic() - started < 0.3
+            job_id = response.json()["job_id"]
+
+            records = []
+            while True:
+                record = ws.receive_json()
+                assert record["job_id"] == job_id
+                records.append(record)
+                if record["job_status"] in ("succeeded", "failed", "cancelled"):
+                    break
+            assert records[-1]["job_status"] == "succeeded"
+            assert records[-1]["job_result"]["target_host"] == "10.0.0.5"
+            assert any("中控智能体" in r["message"] for r in records)
+
+            job = client.get(f"/api/jobs/{job_id}").json()
+            assert job["status"] == "succeeded" and job["result"]["agent"] == "central"
+            print(f"✅ 攻击任务立即返回，推送 {len(records)} 条进度，结果随最后一条推送")
+
+            # 长轮询等待场景生成完成
+            job_id = client.post("/api/scenario/process_request", json={"prompt": "办公网", "async_job": True}).json()["job_id"]
+            job = client.get(f"/api/jobs/{job_id}", params={"wait": 5}).json()
+            assert job["status"] == "succeeded" and job["result"]["data"]["prompt"] == "办公网"
+            print("✅ 长轮询在任务完成时返回结果")
+
+            # 取消正在执行的部署任务
+            fake.state.delay = 5
+            job_id = client.post("/api/scenario/deploy_containers",
+                                 json={"topology_data": {"nodes": [1, 2]}, "async_job": True}).json()["job_id"]
+            job = client.get(f"/api/jobs/{job_id}", params={"wait": 0.2}).json()
+            assert job["status"] == "running" and job["params"]["nodes"] == 2
+            job = client.post(f"/api/jobs/{job_id}/cancel").json()
+            assert job["status"] == "cancelled"
+            assert client.post(f"/api/jobs/{job_id}/cancel").status_code == 409
+            assert client.get("/api/jobs/unknown").status_code == 404
+            kinds = [j["kind"] for j in client.get("/api/jobs").json()["jobs"]]
+            assert kinds[:3] == ["scenario_deploy", "scenario_process", "attack_full"], kinds
+            print("✅ 部署任务已取消")
+
+            # 不带 async_job 时保持原来的同步返回
+            fake.state.delay = 0
+            result = client.post("/api/scenario/process_request", json={"prompt": "同步"}).json()
+            assert result["data"]["prompt"] == "同步" and result["job_id"]
+
+            # 智能体返回的不是字典时原样返回
+            async def returns_list(job=None):
+                return [1, 2]
+
+            assert client.portal.call(backend.run_job, backend.agent_jobs, "list_result", returns_list) == [1, 2]
+
+            # 多worker部署时任务记录不在各worker之间共享，拒绝 async_job
+            original = backend.log_pubsub
+            backend.log_pubsub = backend.UnixSocketLogPubSub(os.path.join(tempfile.mkdtemp(), "loghub.sock"))
+            try:
+                response = client.post("/api/attack/execute_full_attack", json={"target_host": "10.0.0.5", "async_job": True})
+                assert response.status_code == 400 and "BACKEND_WORKERS" in response.json()["detail"]
+            finally:
+                backend.log_pubsub = original
+            print("✅ 非字典结果原样返回，多worker部署时拒绝 async_job")
+    print()
+
+
+def test_scenario_request_coalescing():
+    """测试相同提示词的并发请求只调用一次场景智能体，之后的请求命中缓存"""
+    print("🧪 测试场景分析请求合并...")
+
+    fake = create_fake_agent()
+    fake.state.delay = 0.3
+    with AgentServer(fake) as server:
+        use_agents(scenario=server.url)
+        with TestClient(backend.app) as client:
+            prompts = ["办公网钓鱼场景", "  办公网钓鱼场景。", "办公网\t钓鱼场景！", "办公网钓鱼场景", "办公网钓鱼场景?"]
+
+            async def submit_all():
+                requests = [backend.ScenarioAnalysisRequest(prompt=p) for p in prompts]
+                return await asyncio.gather(*(backend.analyze_scenario_prompt(r) for r in requests))
+
+            results = client.portal.call(submit_all)
+            assert fake.state.calls["/analyze_prompt"] == 1
+            assert all(result is results[0] for result in results)
+            stats = client.get("/api/scenario/cache").json()
+            assert stats["misses"] == 1 and stats["coalesced"] == 4 and stats["entries"] == 1
+
+            # 完成后的相同请求直接返回缓存结果
+            assert client.post("/api/scenario/analyze_prompt", json={"prompt": "办公网钓鱼场景"}).json() == results[0]
+            assert fake.state.calls["/analyze_prompt"] == 1
+            # 不同接口、不同提示词、refresh 都会重新调用
+            client.post("/api/scenario/process_request", json={"prompt": "办公网钓鱼场景"})
+            client.post("/api/scenario/analyze_prompt", json={"prompt": "工控网场景"})
+            client.post("/api/scenario/analyze_prompt", json={"prompt": "办公网钓鱼场景", "refresh": True})
+            assert fake.state.calls["/analyze_prompt"] == 3
+            assert fake.state.calls["/process_scenario_request"] == 1
+
+            # 没有拓扑数据的结果不缓存，下一次请求重新调用
+            for _ in range(2):
+                result = client.post("/api/scenario/process_request", json={"prompt": "无拓扑的场景"}).json()
+                assert result["data"]["raw_tool_data"] is None
+            assert fake.state.calls["/process_scenario_request"] == 3
+            assert client.get("/api/scenario/cache").json()["unusable"] == 2
+
+            # 失败的结果不缓存
+            server.server.should_exit = True
+            while server.thread.is_alive():
+                time.sleep(0.01)
+            assert client.post("/api/scenario/analyze_prompt", json={"prompt": "新场景"}).status_code == 503
+            assert client.delete("/api/scenario/cache").json()["entries"] == 0
+            assert backend.scenario_cache.stats()["inflight"] == 0
+    print(f"✅ {len(prompts)} 个并发请求合并为 1 次调用，重复请求命中缓存")
+    print()
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试智能体代理路由...\n")
+
+    test_pooled_agent_clients()
+    test_agent_health_registry()
+    test_agent_jobs()
+    test_scenario_request_coalescing()
+
+    print("✅ 所有测试完成！")
+
+if __name__ == "__main__":
+    main()
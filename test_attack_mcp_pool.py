@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+测试攻击智能体的MCP会话池
+使用假的MCP客户端，不需要启动攻击服务
+"""
+
+import sys
+import os
+import asyncio
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "agents", "attack_agent"))
+
+from mcp_pool import MCPSessionPool
+
+
+class FakeResult:
+    def __init__(self, text):
+        self.content = [type("Block", (), {"text": text})()]
+
+
+class FakeClient:
+    """假MCP客户端：记录进入/退出上下文的任务，alive=False 模拟服务重启后会话失效"""
+
+    instances = []
+
+    def __init__(self, url, delay=0.0):
+        self.url = url
+        self.delay = delay
+        self.alive = True
+        self.calls = []
+        self.enter_task = None
+        self.exit_task = None
+        FakeClient.instances.append(self)
+
+    async def __aenter__(self):
+        await asyncio.sleep(0.01)
+        self.enter_task = asyncio.current_task()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.exit_task = asyncio.current_task()
+
+    async def ping(self):
+        if not self.alive:
+            raise ConnectionError("session lost")
+        return True
+
+    async def call_tool(self, name, arguments):
+        self.calls.append(name)
+        if not self.alive:
+            raise ConnectionError("session lost")
+        if name == "fail":
+            raise ValueError("tool error")
+        if name == "slow":
+            await asyncio.sleep(1)
+        await asyncio.sleep(self.delay)
+        return FakeResult(arguments.get("text", name))
+
+
+def make_pool(**kwargs):
+    FakeClient.instances = []
+    return MCPSessionPool("http://attack-service/mcp/", client_factory=lambda url: FakeClient(url, delay=0.01),
+                          **kwargs)
+
+
+def test_session_reuse():
+    """测试并发和连续的工具调用复用池中的会话"""
+    print("🧪 测试会话复用...")
+
+    async def run():
+        pool = make_pool(size=2)
+        results = await asyncio.gather(*(pool.call_tool("echo", {"text": str(i)}) for i in range(10)))
+        assert [r.content[0].text for r in results] == [str(i) for i in range(10)]
+        for _ in range(5):
+            await pool.call_tool("echo", {"text": "again"})
+        stats = pool.stats()
+        assert pool.opened == 2 and stats["tools"]["echo"]["calls"] == 15
+        assert stats["tools"]["echo"]["avg_ms"] > 0 and stats["idle"] == 2
+        await pool.close()
+        # 会话在同一个任务中进入和退出（anyio的取消作用域要求）
+        for client in FakeClient.instances:
+            assert client.enter_task is client.exit_task is not None
+        return stats
+
+    stats = asyncio.run(run())
+    print(f"✅ 15次调用只建立了 {stats['opened']} 个会话")
+    print()
+
+
+def test_reconnect_and_retry():
+    """测试会话断开时重新连接并重试一次，工具报错和超时不重试"""
+    print("🧪 测试重连与重试...")
+
+    async def run():
+        pool = make_pool(size=2, call_timeout=0.2)
+
+        # 工具本身报错：会话仍可用，不重试也不重建
+        try:
+            await pool.call_tool("fail", {})
+            assert False, "应抛出工具错误"
+        except ValueError:
+            pass
+        assert pool.opened == 1 and sum(c.calls.count("fail") for c in FakeClient.instances) == 1
+
+        # 超时的调用可能已经执行，不重试
+        try:
+            await pool.call_tool("slow", {})
+            assert False, "应超时"
+        except asyncio.TimeoutError:
+            pass
+        assert sum(c.calls.count("slow") for c in FakeClient.instances) == 1
+        assert pool.stats()["tools"]["slow"]["errors"] == 1
+
+        # 服务重启：已有会话全部失效，换新会话重试一次
+        await asyncio.gather(pool.call_tool("echo", {}), pool.call_tool("echo", {}))
+        for client in FakeClient.instances:
+            client.alive = False
+        result = await pool.call_tool("echo", {"text": "恢复"})
+        assert result.content[0].text == "恢复"
+        assert pool.reconnects == 1 and pool.stats()["open"] == 1
+        await pool.close()
+        return pool.stats()
+
+    stats = asyncio.run(run())
+    print(f"✅ 重连 {stats['reconnects']} 次，工具错误和超时未重试")
+    print()
+
+
+def test_health_check():
+    """测试后台健康检查关闭失效的空闲会话"""
+    print("🧪 测试空闲会话健康检查...")
+
+    async def run():
+        pool = make_pool(size=2, health_interval=0.05)
+        await pool.call_tool("echo", {})
+        FakeClient.instances[0].alive = False
+        await asyncio.sleep(0.2)
+        stats = pool.stats()
+        assert stats["health_failures"] == 1 and stats["idle"] == 0 and stats["open"] == 0
+        await pool.call_tool("echo", {})
+        assert pool.opened == 2
+        await pool.close()
+        assert all(client.exit_task is client.enter_task for client in FakeClient.instances)
+
+    asyncio.run(run())
+    print("✅ 失效的空闲会话被关闭，下次调用时重新连接")
+    print()
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试攻击服务MCP会话池...\n")
+
+    test_session_reuse()
+    test_reconnect_and_retry()
+    test_health_check()
+
+    print("✅ 所有测试完成！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+测试后端日志中心(/ws/logs)的脚本
+验证订阅者队列、广播等逻辑，无需启动其他智能体
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+# 日志文件写到临时目录，不污染 backend/log_journal
+os.environ.setdefault("LOG_JOURNAL_DIR", tempfile.mkdtemp(prefix="log_journal_"))
+os.environ.setdefault("LOG_FILTER_RULES_FILE", os.path.join(tempfile.mkdtemp(), "log_filter_rules.json"))
+
+from fastapi.testclient import TestClient
+import main as backend
+
+
+class SlowWebSocket:
+    """模拟一个永远发不完消息的慢客户端"""
+
+    async def send_text(self, data):
+        await asyncio.sleep(3600)
+
+    async def send_json(self, data):
+        await asyncio.sleep(3600)
+
+    async def close(self, code=1000):
+        pass
+
+
+class RecordingWebSocket:
+    """记录已发送帧的客户端"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        pass
+
+
+def test_broadcast_to_all_clients():
+    """测试日志广播到所有客户端"""
+    print("🧪 测试日志广播...")
+
+    with TestClient(backend.app) as client, client.websocket_connect("/ws/logs") as ws_a, client.websocket_connect("/ws/logs") as ws_b:
+        # 欢迎消息
+        assert ws_a.receive_json()["source"] == "系统"
+        assert ws_b.receive_json()["source"] == "系统"
+
+        ws_a.send_text("ping")
+        assert ws_a.receive_text() == "pong"
+
+        saved_before = backend.broadcast_stats["encodes_saved"]
+        ws_a.send_json({"level": "info", "source": "攻击智能体", "message": "测试广播消息"})
+        assert ws_a.receive_json()["message"] == "测试广播消息"
+        assert ws_b.receive_json()["message"] == "测试广播消息"
+        print("✅ 两个客户端都收到了广播")
+
+        # 两个订阅者共享同一次编码
+        assert backend.broadcast_stats["encodes_saved"] == saved_before + 1
+        stats = client.get("/api/logs/stats").json()
+        print(f"✅ 广播统计: {stats}")
+
+    assert not backend.connected_clients
+    print()
+
+
+def test_subscriber_overflow_policies():
+    """测试订阅者队列溢出策略"""
+    print("🧪 测试队列溢出策略...")
+
+    async def run():
+        subscriber = backend.LogSubscriber(SlowWebSocket(), max_queue=3, overflow_policy="drop_oldest")
+        for i in range(5):
+            subscriber.enqueue(i, "info")
+        assert [frame for _, frame, _ in subscriber.queue] == [2, 3, 4]
+        assert subscriber.dropped_count == 2
+        print(f"✅ drop_oldest: {list(subscriber.queue)}")
+
+        subscriber = backend.LogSubscriber(SlowWebSocket(), max_queue=3, overflow_policy="drop_low_level")
+        for i, level in enumerate(["info", "error", "info", "error", "warning", "info"]):
+            subscriber.enqueue(i, level)
+        assert [level for level, _, _ in subscriber.queue] == ["error", "error", "warning"]
+        print(f"✅ drop_low_level: {list(subscriber.queue)}")
+
+        ws = SlowWebSocket()
+        subscriber = backend.LogSubscriber(ws, max_queue=2, overflow_policy="disconnect")
+        backend.connected_clients[ws] = subscriber
+        for i in range(3):
+            subscriber.enqueue(i, "error")
+        assert subscriber.closed and ws not in backend.connected_clients
+        print("✅ disconnect: 慢客户端已被断开")
+        await asyncio.sleep(0)
+
+        # 开启缺口检测后，记录被丢弃的序号范围
+        subscriber = backend.LogSubscriber(SlowWebSocket(), max_queue=2, overflow_policy="drop_oldest")
+        subscriber.gap_detection = True
+        for seq in range(1, 6):
+            subscriber.enqueue("frame", "info", seq)
+        assert subscriber._missed == {"first_seq": 1, "last_seq": 3, "count": 3}
+        print(f"✅ 缺口检测: {subscriber._missed}")
+
+    asyncio.run(run())
+    print()
+
+
+def test_subscription_filters():
+    """测试/ws/logs订阅过滤"""
+    print("🧪 测试订阅过滤...")
+
+    with TestClient(backend.app) as client, client.websocket_connect("/ws/logs") as judge, client.websocket_connect("/ws/logs") as publisher:
+        judge.receive_json()
+        publisher.receive_json()
+
+        judge.send_json({"type": "subscribe", "sources": ["攻击智能体"], "stages": ["delivery"]})
+        ack = judge.receive_json()
+        assert ack["type"] == "subscribed" and ack["filter"]["sources"] == ["攻击智能体"]
+
+        publisher.send_json({"level": "info", "source": "威胁阻断智能体", "message": "订阅测试-阻断IP"})
+        publisher.send_json({"level": "info", "source": "攻击智能体", "message": "订阅测试-扫描",
+                             "attack_info": {"stage": "reconnaissance"}})
+        publisher.send_json({"level": "info", "source": "攻击智能体", "message": "订阅测试-投递",
+                             "attack_info": {"stage": "delivery"}})
+
+        # 发布者未订阅，收到全部三条；裁判只收到匹配的一条
+        for _ in range(3):
+            publisher.receive_json()
+        assert judge.receive_json()["message"] == "订阅测试-投递"
+        print("✅ 只收到匹配来源和阶段的日志")
+
+        # 再次订阅只更新出现的字段，来源条件保留，阶段条件被清空
+        judge.send_json({"type": "subscribe", "levels": ["error"], "stages": None})
+        ack = judge.receive_json()
+        assert ack["filter"] == {"sources": ["攻击智能体"], "levels": ["error"], "stages": []}
+        publisher.send_json({"level": "info", "source": "攻击智能体", "message": "订阅测试-普通"})
+        publisher.send_json({"level": "error", "source": "威胁阻断智能体", "message": "订阅测试-阻断失败"})
+        publisher.send_json({"level": "error", "source": "攻击智能体", "message": "订阅测试-攻击失败"})
+        for _ in range(3):
+            publisher.receive_json()
+        assert judge.receive_json()["message"] == "订阅测试-攻击失败"
+        stats = client.get("/api/logs/stats").json()["subscribers"]
+        assert stats["subscribers"] == 2 and stats["levels"] == {"*": 1, "error": 1}
+        print(f"✅ 合并订阅条件，订阅者索引: {stats}")
+
+        judge.send_json({"type": "unsubscribe"})
+        assert judge.receive_json()["filter"] is None
+    assert len(backend.log_subscriber_index) == 0
+    print()
+
+
+def test_http_ingest():
+    """测试HTTP日志提交接口"""
+    print("🧪 测试HTTP日志提交...")
+
+    with TestClient(backend.app) as client, client.websocket_connect("/ws/logs") as ws:
+        ws.receive_json()
+
+        result = client.post("/api/logs", json={"level": "info", "source": "评估智能体", "message": "HTTP提交测试"}).json()
+        assert result["queued"] == 1
+        assert ws.receive_json()["message"] == "HTTP提交测试"
+
+        batch = [
+            {"level": "info", "source": "评估智能体", "message": "批量提交-1", "battle_state": {"status": "ongoing"}},
+            {"level": "info", "source": "评估智能体", "message": "批量提交-1"},
+            {"level": "info", "source": "评估智能体", "message": "批量提交-2"},
+        ]
+        result = client.post("/api/logs/batch", json=batch).json()
+        assert result["queued"] == 3
+        # 重复的第二条在分发时被去重
+        first = ws.receive_json()
+        assert first["battle_state"] == {"status": "ongoing"}
+        assert ws.receive_json()["message"] == "批量提交-2"
+        print(f"✅ 批量提交: {result}")
+
+        assert client.post("/api/logs/batch", json=[{"level": "info"}]).status_code == 422
+        print("✅ 缺少字段的日志被拒绝")
+    print()
+
+
+def test_ingest_queue():
+    """测试接收队列的背压与丢弃"""
+    print("🧪 测试接收队列...")
+
+    with TestClient(backend.app) as client, client.websocket_connect("/ws/logs") as ws:
+        ws.receive_json()
+        ws.send_json({"level": "info", "source": "攻击智能体", "message": "接收队列测试", "ack": True})
+        frames = [ws.receive_json(), ws.receive_json()]
+        ack = next(frame for frame in frames if frame.get("type") == "ack")
+        record = next(frame for frame in frames if frame.get("type") != "ack")
+        assert ack["queued"] and "ack" not in record
+        print(f"✅ 发布者收到确认: {ack}")
+
+        stats = client.get("/api/logs/stats").json()["ingest"]
+        assert stats["dispatched"] >= 1
+        print(f"✅ 接收队列统计: {stats}")
+
+    async def run():
+        # 分发协程未运行时队列很快被填满，超时后丢弃
+        ingest = backend.LogIngestQueue(maxsize=1, put_timeout=0.01)
+        ingest._queue = asyncio.Queue(maxsize=1)
+        ingest._dispatcher = asyncio.create_task(asyncio.sleep(3600))
+        assert await ingest.submit({"source": "测试", "message": "1"})
+        assert not await ingest.submit({"source": "测试", "message": "2"})
+        assert ingest.dropped == 1
+        ingest._dispatcher.cancel()
+        print("✅ 队列满时超时丢弃")
+
+    asyncio.run(run())
+    print()
+
+
+def test_micro_batching():
+    """测试日志批量合并发送"""
+    print("🧪 测试批量发送...")
+
+    async def run():
+        subscriber = backend.LogSubscriber(SlowWebSocket())
+        backend.configure_batching(subscriber, {"window_ms": 10, "max_records": 3})
+        for seq in range(1, 5):
+            subscriber.enqueue('{"seq":%d}' % seq, "info", seq)
+        subscriber.enqueue('{"type":"gap"}', "system")
+        frame, count = subscriber._next_frame()
+        assert frame == '[{"seq":1},{"seq":2},{"seq":3}]' and count == 3
+        # 控制消息不与日志合并
+        assert subscriber._next_frame() == ('{"seq":4}', 1)
+        assert subscriber._next_frame() == ('{"type":"gap"}', 1)
+        print("✅ 按条数合并，控制消息单独发送")
+
+        # 控制消息不等待批处理窗口：窗口内入队的控制消息连同之前的日志立即发出
+        ws = RecordingWebSocket()
+        subscriber = backend.LogSubscriber(ws)
+        backend.configure_batching(subscriber, {"window_ms": 1000, "max_records": 10})
+        subscriber.start()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        subscriber.enqueue('{"seq":1}', "info", 1)
+        await asyncio.sleep(0.05)
+        subscriber.enqueue('{"type":"resumed"}', "system")
+        while len(ws.sent) < 2:
+            await asyncio.sleep(0.01)
+        assert ws.sent == ['{"seq":1}', '{"type":"resumed"}'] and loop.time() - started < 0.5
+        subscriber.enqueue('{"type":"subscribed"}', "system")
+        await asyncio.sleep(0.05)
+        assert ws.sent[-1] == '{"type":"subscribed"}' and subscriber._control_pending == 0
+        subscriber.close()
+        print(f"✅ 控制消息在 {(loop.time() - started) * 1000:.0f}ms 内送达，未等待1秒的批处理窗口")
+
+    asyncio.run(run())
+
+    with TestClient(backend.app) as client, client.websocket_connect("/ws/logs") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "subscribe", "batch": {"window_ms": 50, "max_records": 10}})
+        assert ws.receive_json()["batch"] == {"window_ms": 50, "max_records": 10}
+        for i in range(3):
+            ws.send_json({"level": "info", "source": "攻击智能体", "message": f"批量测试-{i}"})
+        received = []
+        while len(received) < 3:
+            frame = ws.receive_json()
+            received.extend(frame if isinstance(frame, list) else [frame])
+        assert [r["message"] for r in received] == ["批量测试-0", "批量测试-1", "批量测试-2"]
+        print("✅ 窗口内的日志按序送达")
+    print()
+
+
+def test_journal_replay():
+    """测试日志持久化与重连补发"""
+    print("🧪 测试日志补发...")
+
+    with TestClient(backend.app) as client:
+        with client.websocket_connect("/ws/logs") as ws:
+            ws.receive_json()
+            ws.send_json({"level": "info", "source": "攻击智能体", "message": "补发测试-1"})
+            first = ws.receive_json()
+            ws.send_json({"level": "info", "source": "攻击智能体", "message": "补发测试-2"})
+            second = ws.receive_json()
+            assert second["seq"] == first["seq"] + 1
+            assert second["ingest_ts_ns"] >= first["ingest_ts_ns"]
+
+        # 通过HTTP接口补发
+        replay = client.get("/api/logs/replay", params={"since": first["seq"] - 1}).json()
+        assert [r["message"] for r in replay["records"]] == ["补发测试-1", "补发测试-2"]
+        print(f"✅ HTTP补发: {replay['last_seq']}")
+
+        # 通过WebSocket握手补发
+        with client.websocket_connect("/ws/logs") as ws:
+            ws.receive_json()
+            ws.send_json({"type": "resume", "since": first["seq"]})
+            assert ws.receive_json()["message"] == "补发测试-2"
+            resumed = ws.receive_json()
+            assert resumed["type"] == "resumed" and resumed["count"] == 1
+            print(f"✅ WebSocket补发: {resumed}")
+    print()
+
+
+def test_journal_segments():
+    """测试日志分段、压缩和重启恢复"""
+    print("🧪 测试日志分段...")
+
+    async def run():
+        directory = tempfile.mkdtemp(prefix="log_journal_")
+        journal = backend.LogJournal(directory, segment_bytes=1024, compress=True, memory_records=10)
+        for _ in range(100):
+            seq = journal.next_seq()
+            journal.append(seq, '{"seq": %d, "message": "%s"}' % (seq, "x" * 50))
+        await journal.close()
+        names = sorted(os.listdir(directory))
+        assert len(names) > 1 and names[0].endswith(".gz")
+        print(f"✅ 生成分段: {len(names)} 个")
+
+        # 重启后从文件恢复序号，并能读到内存中已没有的旧记录
+        journal = backend.LogJournal(directory, segment_bytes=1024, compress=True, memory_records=10)
+        assert journal.last_seq == 100
+        records = await journal.replay(since=10, limit=5)
+        assert [seq for seq, _ in records] == [11, 12, 13, 14, 15]
+        await journal.close()
+        print("✅ 重启恢复序号并从文件补发")
+
+        # 最新分段为空（新开分段后崩溃）时向前找有记录的分段，序号不回退
+        directory = tempfile.mkdtemp(prefix="log_journal_")
+        journal = backend.LogJournal(directory, memory_records=10)
+        for _ in range(5):
+            seq = journal.next_seq()
+            journal.append(seq, '{"seq": %d}' % seq)
+        await journal.close()
+        open(os.path.join(directory, f"{backend.LogJournal.SEGMENT_PREFIX}{6:020d}.log"), "wb").close()
+        journal = backend.LogJournal(directory, memory_records=10)
+        assert journal.last_seq == 6, journal.last_seq
+        journal.last_seq = 50
+        journal._recover()
+        assert journal.last_seq == 50
+        await journal.close()
+        print("✅ 空的最新分段不会导致序号回退")
+
+    asyncio.run(run())
+    print()
+
+
+def test_msgpack_transport():
+    """测试协商msgpack二进制日志帧"""
+    print("🧪 测试二进制传输...")
+
+    if backend.msgpack is None:
+        print("⚠️ 未安装msgpack，跳过")
+        return
+
+    with TestClient(backend.app) as client, client.websocket_connect("/ws/logs?encoding=msgpack") as ws:
+        welcome = ws.receive_json()
+        assert welcome["encoding"] == "msgpack"
+        fields = welcome["field_dictionary"]
+
+        ws.send_json({"level": "info", "source": "攻击智能体", "message": "二进制传输测试",
+                      "attack_info": {"stage": "delivery"}})
+        record = backend.msgpack.unpackb(ws.receive_bytes(), strict_map_key=False)
+        record = {fields[key]: value for key, value in record.items()}
+        assert record["message"] == "二进制传输测试"
+        assert record["attack_info"] == {fields.index("stage"): "delivery"}
+        print(f"✅ 二进制日志帧: {record}")
+    print()
+
+
+def test_filter_rules():
+    """测试广播前的过滤规则"""
+    print("🧪 测试过滤规则...")
+
+    stage = backend.LogFilterStage(backend.DEFAULT_LOG_FILTER_RULES)
+    assert not stage.allow("中控智能体", "正在调用LLM分析")
+    assert stage.allow("中控智能体", "开始攻击目标主机")
+    assert stage.allow("攻击智能体", "正在调用LLM分析")
+    print("✅ 默认规则：中控智能体只放行重要状态")
+
+    stage = backend.LogFilterStage([
+        backend.LogFilterRule(name="heartbeat", keywords=["心跳"]),
+        backend.LogFilterRule(name="debug_dump", patterns=[r"debug\s*dump"], sources=["攻击智能体"]),
+    ])
+    assert not stage.allow("防御协调器", "收到心跳")
+    assert not stage.allow("攻击智能体", "DEBUG dump: ...")
+    assert stage.allow("防御协调器", "DEBUG dump: ...")
+    stats = {rule["name"]: rule for rule in stage.stats()}
+    assert stats["heartbeat"]["drops"] == 1 and stats["debug_dump"]["hits"] == 1
+    print(f"✅ 规则命中统计: {[(r['name'], r['hits'], r['drops']) for r in stage.stats()]}")
+
+    # 不同来源的规则使用重叠的关键字时，各条规则都能看到自己的命中
+    stage = backend.LogFilterStage([
+        backend.LogFilterRule(name="coordinator_attack", sources=["防御协调器"], keywords=["攻击"]),
+        backend.LogFilterRule(name="any_attack_done", action="keep", keywords=["攻击完成", "攻击"]),
+        *backend.DEFAULT_LOG_FILTER_RULES,
+    ])
+    assert stage.allow("中控智能体", "攻击完成")
+    assert not stage.allow("防御协调器", "检测到攻击")
+    stats = {rule["name"]: rule for rule in stage.stats()}
+    assert stats["central_agent_internal"]["hits"] == 1 and stats["central_agent_internal"]["drops"] == 0
+    assert stats["any_attack_done"]["hits"] == 1 and stats["coordinator_attack"]["drops"] == 1
+    print("✅ 重叠关键字的规则分别命中")
+
+    # 每条正则单独编译，前面规则中的分组不会改变后面规则反向引用的编号
+    stage = backend.LogFilterStage([
+        backend.LogFilterRule(name="tagged", patterns=[r"\[(tag)\]"], keywords=["Heartbeat"]),
+        backend.LogFilterRule(name="repeated_word", patterns=[r"\b(\w+) \1\b"]),
+    ])
+    assert not stage.allow("攻击智能体", "retry retry")
+    assert stage.allow("攻击智能体", "retry once")
+    assert not stage.allow("攻击智能体", "HEARTBEAT ok")
+    stats = {rule["name"]: rule for rule in stage.stats()}
+    assert stats["repeated_word"]["drops"] == 1 and stats["tagged"]["drops"] == 1
+    print("✅ 反向引用按规则各自的分组编号生效")
+
+    with TestClient(backend.app) as client:
+        assert client.put("/api/logs/filters", json=[{"name": "bad", "patterns": ["("]}]).status_code == 400
+        rules = [rule.model_dump() for rule in backend.DEFAULT_LOG_FILTER_RULES]
+        assert client.put("/api/logs/filters", json=rules).status_code == 200
+        assert client.get("/api/logs/filters").json()["rules"][0]["name"] == "central_agent_internal"
+        print("✅ 规则可通过接口更新")
+    print()
+
+
+def test_metrics_endpoint():
+    """测试 /metrics 监控指标"""
+    print("🧪 测试监控指标...")
+
+    with TestClient(backend.app) as client, client.websocket_connect("/ws/logs") as ws:
+        ws.receive_json()
+        ws.send_json({"level": "info", "source": "指标测试", "message": "指标测试消息"})
+        ws.receive_json()
+        ws.send_json({"level": "info", "source": "指标测试", "message": "指标测试消息"})
+
+        text = client.get("/metrics").text
+        assert 'loghub_messages_broadcast_total{source="指标测试"} 1' in text
+        assert "loghub_connected_clients 1" in text
+        assert "loghub_client_send_seconds_bucket" in text
+        assert "loghub_event_loop_lag_seconds_count" in text
+        print("✅ 指标导出正常")
+    print()
+
+
+def test_dedup_cache():
+    """测试带时间窗口的LRU去重缓存"""
+    print("🧪 测试日志去重缓存...")
+
+    cache = backend.LogDedupCache(max_entries=2, ttl=60)
+    assert not cache.is_duplicate("攻击智能体", "攻击者扫描防火墙")
+    assert cache.is_duplicate("攻击智能体", "攻击者扫描防火墙")
+    assert not cache.is_duplicate("攻击智能体", "攻击者生成钓鱼邮件")
+
+    # 第一条刚被访问过，容量满时淘汰的应是最久未使用的第二条
+    assert cache.is_duplicate("攻击智能体", "攻击者扫描防火墙")
+    assert not cache.is_duplicate("攻击智能体", "攻击者发送钓鱼邮件")
+    assert cache.evictions == 1
+    assert cache.is_duplicate("攻击智能体", "攻击者扫描防火墙")
+    assert not cache.is_duplicate("攻击智能体", "攻击者生成钓鱼邮件")
+    print(f"✅ LRU淘汰: {cache.stats()}")
+
+    cache = backend.LogDedupCache(max_entries=10, ttl=0)
+    assert not cache.is_duplicate("攻击智能体", "重复消息")
+    assert not cache.is_duplicate("攻击智能体", "重复消息")
+    assert cache.expirations == 1
+    print(f"✅ 窗口过期: {cache.stats()}")
+    print()
+
+
+def test_unix_pubsub():
+    """测试多worker部署时通过Unix套接字共享日志，以及主worker退出后的接替"""
+    print("🧪 测试多worker日志发布/订阅...")
+
+    path = os.path.join(tempfile.mkdtemp(), "loghub.sock")
+
+    async def scenario():
+        original = backend.log_pubsub
+        leader = backend.UnixSocketLogPubSub(path)
+        follower = backend.UnixSocketLogPubSub(path)
+        backend.log_pubsub = leader
+        try:
+            await leader.start()
+            await follower.start()
+            assert leader.role == "leader" and follower.role == "follower"
+
+            # follower收到的日志转发给主worker处理，再由主worker发布给所有worker
+            assert await follower.ingest({"level": "info", "source": "攻击智能体", "message": "多worker共享日志"}) is None
+            for _ in range(100):
+                if follower.received:
+                    break
+                await asyncio.sleep(0.02)
+            assert follower.forwarded == 1 and follower.received == 1
+            assert leader.published == 1 and leader.stats()["followers"] == 1
+            print(f"✅ 转发与发布: {leader.stats()}")
+
+            # 主worker退出后follower接替
+            await leader.stop()
+            for _ in range(100):
+                if follower.role == "leader":
+                    break
+                await asyncio.sleep(0.02)
+            assert follower.role == "leader"
+            print("✅ 主worker退出后follower已接替")
+        finally:
+            await follower.stop()
+            await leader.stop()
+            backend.log_pubsub = original
+            backend.log_journal.writable = True
+
+    async def leader_down():
+        """主worker不可用期间follower暂存日志，接替后按不回退的序号处理"""
+        original = backend.log_pubsub, backend.LOG_PUBSUB_RECONNECT_INTERVAL
+        backend.LOG_PUBSUB_RECONNECT_INTERVAL = 0.05
+        down_path = os.path.join(tempfile.mkdtemp(), "loghub.sock")
+        # 持有锁但不提供服务，模拟主worker挂起
+        blocker = backend.UnixSocketLogPubSub(down_path)
+        assert blocker._try_lock()
+        follower = backend.UnixSocketLogPubSub(down_path)
+        backend.log_pubsub = follower
+        try:
+            await follower.start()
+            assert follower.role == "follower"
+            assert await follower.ingest({"level": "info", "source": "攻击智能体", "message": "主worker不可用时的日志"}) is None
+            assert follower.stats()["pending"] == 1
+
+            # 本worker已收到的序号超过磁盘上的序号，接替后不能回退
+            backend.log_journal.last_seq += 1000
+            expected = backend.log_journal.last_seq + 1
+            blocker._lock_file.close()
+            blocker._lock_file = None
+            for _ in range(100):
+                if follower.role == "leader" and not follower.stats()["pending"]:
+                    break
+                await asyncio.sleep(0.02)
+            assert follower.role == "leader" and follower.stats()["buffered"] == 1
+            seq, frame = backend.log_journal.recent[-1]
+            assert seq == expected and "主worker不可用时的日志" in frame
+            print(f"✅ 主worker不可用时暂存日志，接替后分配序号 {seq}")
+        finally:
+            await follower.stop()
+            backend.log_pubsub, backend.LOG_PUBSUB_RECONNECT_INTERVAL = original
+            backend.log_journal.writable = True
+
+    with TestClient(backend.app) as client:
+        client.portal.call(scenario)
+        client.portal.call(leader_down)
+    print()
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试后端日志中心...\n")
+
+    test_broadcast_to_all_clients()
+    test_subscriber_overflow_policies()
+    test_subscription_filters()
+    test_http_ingest()
+    test_ingest_queue()
+    test_micro_batching()
+    test_journal_replay()
+    test_journal_segments()
+    test_msgpack_transport()
+    test_filter_rules()
+    test_metrics_endpoint()
+    test_dedup_cache()
+    test_unix_pubsub()
+
+    print("✅ 所有测试完成！")
+
+if __name__ == "__main__":
+    main()
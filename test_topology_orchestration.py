@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+"""
+测试后端拓扑编排：异步执行docker命令、编排任务与进度推送
+使用临时目录中的假 docker / docker-compose 命令，不需要真实的Docker环境
+"""
+
+import sys
+import os
+import json
+import time
+import asyncio
+import tempfile
+import subprocess
+
+os.environ.setdefault("LOG_JOURNAL_DIR", tempfile.mkdtemp(prefix="log_journal_"))
+os.environ.setdefault("LOG_FILTER_RULES_FILE", os.path.join(tempfile.mkdtemp(), "log_filter_rules.json"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from fastapi.testclient import TestClient
+import main as backend
+
+# 假的docker命令：记录每次调用，按状态文件返回输出
+FAKE_DOCKER = r'''
+import json, os, sys, time
+
+args = sys.argv[1:]
+tool = os.path.basename(sys.argv[0])
+with open(os.environ["FAKE_DOCKER_LOG"], "a") as f:
+    f.write(json.dumps([tool] + args) + "\n")
+with open(os.environ["FAKE_DOCKER_STATE"]) as f:
+    state = json.load(f)
+services = state["services"]
+time.sleep(state.get("delay", 0))
+
+def inspect(name, svc):
+    return {
+        "Id": svc["id"], "Name": "/" + name, "Created": "2024-01-01T00:00:00Z",
+        "Config": {"Image": svc.get("image", "nginx"), "Labels": {"com.docker.compose.service": name, **svc.get("labels", {})}},
+        "State": {"Running": svc.get("running", True), "Status": "running" if svc.get("running", True) else "exited",
+                  "Error": svc.get("error", ""), "ExitCode": 0 if svc.get("running", True) else 1, "Health": {"Status": svc["health"]} if "health" in svc else None},
+        "NetworkSettings": {"Networks": {net: {"IPAddress": ip} for net, ip in svc.get("networks", {"net": svc.get("ip", "")}).items()},
+                            "Ports": {}},
+    }
+
+if tool == "docker-compose":
+    # 跳过 -p / -f / --project-directory 等全局选项，记下compose文件
+    compose_file = None
+    while args and args[0] in ("-p", "-f", "--project-directory"):
+        if args[0] == "-f":
+            compose_file = args[1]
+        args = args[2:]
+    if args[:2] == ["up", "-d"]:
+        for name in services:
+            sys.stderr.write(f"Creating {name} ... done\n")
+    elif args[0] == "ps" and "--services" in args:
+        print("\n".join(services))
+    elif args[:2] == ["ps", "-q"]:
+        # 与compose一致，只列出compose文件中声明的服务的容器
+        declared = services
+        if compose_file and os.path.exists(compose_file):
+            import yaml
+            with open(compose_file) as f:
+                declared = (yaml.safe_load(f) or {}).get("services") or {}
+        names = args[2:] or [name for name in services if name in declared]
+        print("\n".join(services[n]["id"] for n in names if n in services))
+    elif args[0] == "ps":
+        for name in args[1:]:
+            print(f"{name}   {'Up' if services[name].get('running', True) else 'Exit 1'}")
+elif args[0] == "inspect":
+    by_id = {svc["id"]: (name, svc) for name, svc in services.items()}
+    print(json.dumps([inspect(*by_id[i]) for i in args[1:] if i in by_id]))
+elif args[:2] == ["ps", "-q"]:
+    print("\n".join(svc["id"] for svc in services.values()))
+elif args[:2] == ["ps", "-aq"]:
+    key, _, value = args[args.index("--filter") + 1][len("label="):].partition("=")
+    print("\n".join(svc["id"] for svc in services.values() if svc.get("labels", {}).get(key) == value))
+elif args[:2] == ["network", "ls"]:
+    for network, full_name in state.get("networks", {}).items():
+        print(full_name if "-q" in args else f"{full_name}\t{network}")
+elif args[0] == "stop":
+    time.sleep(state.get("stop_delay", 0))
+elif args[0] == "events" and state.get("events_file"):
+    # 持续输出测试追加到事件文件中的事件
+    position = 0
+    while True:
+        with open(state["events_file"]) as f:
+            f.seek(position)
+            data = f.read()
+            position = f.tell()
+        for line in data.splitlines():
+            print(line, flush=True)
+        time.sleep(0.05)
+sys.exit(state.get("exit_code", 0))
+'''
+
+
+def install_fake_docker(services, **extra):
+    """在PATH最前面放入假的 docker / docker-compose，返回调用记录文件路径"""
+    bin_dir = tempfile.mkdtemp(prefix="fake_docker_")
+    for tool in ("docker", "docker-compose"):
+        path = os.path.join(bin_dir, tool)
+        with open(path, "w") as f:
+            f.write(f"#!{sys.executable}\n{FAKE_DOCKER}")
+        os.chmod(path, 0o755)
+    log_path = os.path.join(bin_dir, "calls.log")
+    state_path = os.path.join(bin_dir, "state.json")
+    open(log_path, "w").close()
+    with open(state_path, "w") as f:
+        json.dump({"services": services, **extra}, f)
+    # 拓扑模板指向临时目录中的 lab.yml，服务与假docker的状态一致
+    with open(os.path.join(bin_dir, "lab.yml"), "w") as f:
+        json.dump({"services": {name: {"image": "nginx"} for name in services}}, f)
+    backend.TEMPLATES_DIR = bin_dir
+    backend.compose_cache = backend.ComposeCache(os.path.join(bin_dir, "compose_cache"))
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+    os.environ["FAKE_DOCKER_LOG"] = log_path
+    os.environ["FAKE_DOCKER_STATE"] = state_path
+    return log_path
+
+
+def update_fake_docker(**state):
+    """修改假docker的状态"""
+    with open(os.environ["FAKE_DOCKER_STATE"]) as f:
+        current = json.load(f)
+    current.update(state)
+    with open(os.environ["FAKE_DOCKER_STATE"], "w") as f:
+        json.dump(current, f)
+
+
+def read_calls(log_path):
+    with open(log_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_run_docker():
+    """测试异步执行命令：逐行回调输出、返回码检查和超时"""
+    print("🧪 测试异步命令执行...")
+
+    async def scenario():
+        lines = []
+
+        async def on_output(line):
+            lines.append(line)
+
+        script = "import sys; print('第一行'); sys.stderr.write('进度\\n')"
+        result = await backend.run_docker([sys.executable, "-c", script], on_output=on_output)
+        assert result.returncode == 0 and result.stdout == "第一行\n"
+        assert sorted(lines) == sorted(["第一行", "进度"])
+
+        try:
+            await backend.run_docker([sys.executable, "-c", "import sys; sys.exit(3)"])
+            assert False, "返回码非0应抛出异常"
+        except subprocess.CalledProcessError as e:
+            assert e.returncode == 3
+        assert (await backend.run_docker([sys.executable, "-c", "import sys; sys.exit(3)"], check=False)).returncode == 3
+
+        try:
+            await backend.run_docker([sys.executable, "-c", "import time; time.sleep(10)"], timeout=0.2)
+            assert False, "超时应抛出异常"
+        except subprocess.TimeoutExpired:
+            pass
+
+    asyncio.run(scenario())
+    print("✅ 输出回调、返回码检查和超时正常")
+    print()
+
+
+def test_topology_job():
+    """测试拓扑启动作为后台任务执行，事件循环不被阻塞，进度推送到日志中心"""
+    print("🧪 测试拓扑编排任务...")
+
+    install_fake_docker({
+        "web": {"id": "c1", "ip": "192.168.100.10"},
+        "db": {"id": "c2", "ip": "192.168.100.20"},
+    }, delay=0.3)
+
+    with TestClient(backend.app) as client, client.websocket_connect("/ws/logs") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "subscribe", "sources": [backend.TOPOLOGY_LOG_SOURCE]})
+        assert ws.receive_json()["type"] == "subscribed"
+
+        started = time.monotonic()
+        response = client.post("/api/topology", json={"action": "start", "template": "lab", "async_job": True})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        # 任务在后台执行时其他请求立即返回
+        assert client.get("/api/logs/stats").status_code == 200
+        assert time.monotonic() - started < 0.3
+
+        messages = []
+        while True:
+            record = ws.receive_json()
+            assert record["job_id"] == job_id
+            messages.append(record["message"])
+            if record["job_status"] in ("succeeded", "failed"):
+                break
+        assert any("Creating web" in m for m in messages)
+
+        job = client.get(f"/api/topology/jobs/{job_id}").json()
+        assert job["status"] == "succeeded"
+        assert {s["name"] for s in job["result"]["running_services"]} == {"web", "db"}
+        print(f"✅ 后台任务完成，推送进度 {len(messages)} 条")
+
+        # 不带 async_job 时等待完成后返回结果，兼容原来的调用方式
+        result = client.post("/api/topology", json={"action": "stop", "template": "lab"}).json()
+        assert result["status"] == "stopped" and result["job_id"]
+        assert client.get("/api/topology/jobs/unknown").status_code == 404
+        print("✅ 同步调用返回结果和任务ID")
+
+        # 同类任务连续执行时，第二个任务的进度不会被当作重复日志丢弃
+        async def same_progress(job=None):
+            await job.report("相同的进度")
+            return {}
+
+        async def run_twice():
+            jobs = [backend.agent_jobs.submit("noop", same_progress) for _ in range(2)]
+            for job in jobs:
+                await backend.agent_jobs.wait(job)
+            for _ in range(100):
+                counts = [sum(1 for _, frame in backend.log_journal.recent if job.job_id in frame) for job in jobs]
+                if counts == [3, 3]:
+                    break
+                await asyncio.sleep(0.02)
+            return counts
+
+        assert client.portal.call(run_twice) == [3, 3]
+        print("✅ 同类任务的进度分别推送")
+    print()
+
+
+def test_compose_ps_batch():
+    """测试状态查询只调用固定次数的docker命令，与服务数量无关"""
+    print("🧪 测试批量查询容器状态...")
+
+    services = {f"host{i}": {"id": f"c{i}", "ip": f"192.168.100.{i}"} for i in range(22)}
+    services["host3"]["running"] = False
+    services["host3"]["error"] = "exit 1"
+    log_path = install_fake_docker(services)
+    # compose文件中多定义一个尚未创建容器的服务
+    with open(os.path.join(backend.TEMPLATES_DIR, "lab.yml"), "w") as f:
+        json.dump({"services": {**{name: {} for name in services}, "pending": {}}}, f)
+
+    result = asyncio.run(backend._compose_ps(os.path.join(backend.TEMPLATES_DIR, "lab.yml")))
+    calls = read_calls(log_path)
+    assert len(calls) == 2, calls
+    assert calls[1][:2] == ["docker", "inspect"] and len(calls[1]) == 2 + 22
+
+    assert len(result["running_services"]) == 21
+    assert {s["name"]: s["status"] for s in result["failed_services"]} == {"host3": "stopped", "pending": "not_created"}
+    host = next(s for s in result["all_services"] if s["name"] == "host5")
+    assert host["ip"] == "192.168.100.5" and host["id"] == "c5"
+    print(f"✅ 22个服务只调用了 {len(calls)} 次docker命令")
+    print()
+
+
+def test_status_cache():
+    """测试拓扑状态缓存：重复查询不再调用docker，容器事件更新缓存并推送增量"""
+    print("🧪 测试拓扑状态缓存...")
+
+    events_file = os.path.join(tempfile.mkdtemp(), "events.jsonl")
+    open(events_file, "w").close()
+    services = {f"host{i}": {"id": f"c{i}", "ip": f"192.168.100.{i}"} for i in range(3)}
+    log_path = install_fake_docker(services, events_file=events_file)
+
+    def compose_calls():
+        return [c for c in read_calls(log_path) if c[0] == "docker-compose"]
+
+    with TestClient(backend.app) as client, client.websocket_connect("/ws/logs") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "subscribe", "sources": [backend.TOPOLOGY_STATUS_SOURCE]})
+        assert ws.receive_json()["type"] == "subscribed"
+
+        request = {"action": "status", "template": "lab"}
+        first = client.post("/api/topology", json=request).json()
+        assert len(first["running_services"]) == 3
+        for _ in range(5):
+            assert client.post("/api/topology", json=request).json() == first
+        assert len(compose_calls()) == 1
+        print(f"✅ 重复查询命中缓存: {client.get('/api/topology/status_cache').json()}")
+
+        # 容器退出：事件触发单个容器的查询，缓存更新并推送增量
+        services["host1"]["running"] = False
+        update_fake_docker(services=services)
+        event = {"Type": "container", "Action": "die", "time": int(time.time()),
+                 "Actor": {"ID": "c1", "Attributes": {"com.docker.compose.service": "host1", "name": "host1"}}}
+        with open(events_file, "a") as f:
+            f.write(json.dumps(event) + "\n")
+
+        delta = ws.receive_json()
+        assert delta["topology_delta"]["topology"] == "lab"
+        assert delta["topology_delta"]["service"]["name"] == "host1"
+        assert delta["topology_delta"]["service"]["status"] == "stopped"
+
+        status = client.post("/api/topology", json=request).json()
+        assert [s["name"] for s in status["failed_services"]] == ["host1"]
+        assert len(compose_calls()) == 1
+        print("✅ 容器事件更新缓存并推送增量")
+    print()
+
+
+def test_readiness_checks():
+    """测试启动动态拓扑后并发检查服务就绪：容器状态、healthcheck 和 TCP 探测"""
+    print("🧪 测试服务就绪检查...")
+
+    services = {
+        "web": {"id": "c1", "ip": "127.0.0.1"},
+        "db": {"id": "c2", "ip": "127.0.0.1", "health": "starting"},
+        "broken": {"id": "c3", "running": False, "error": "exec format error"},
+        "cnt-sql": {"id": "c4", "ip": "127.0.0.1"},
+    }
+    install_fake_docker(services)
+    original = backend.readiness_checker
+    backend.readiness_checker = backend.ReadinessChecker(interval=0.05, timeout=1.5, probe_timeout=0.5)
+
+    async def scenario():
+        server = await asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        config = {"services": {
+            "web": {"image": "nginx", "labels": [f"{backend.READINESS_PROBE_LABEL}=tcp:{port}"]},
+            "db": {"image": "mysql"},
+            "broken": {"image": "busybox"},
+            "cnt-sql": {"image": "mysql"},
+            "not-created": {"image": "busybox"},
+        }}
+
+        async def become_healthy():
+            await asyncio.sleep(0.3)
+            services["db"]["health"] = "healthy"
+            update_fake_docker(services=services)
+
+        healthy = asyncio.create_task(become_healthy())
+        # cnt-sql 按节点类型配置的探测端口无人监听，应超时失败
+        backend.READINESS_PROBES["cnt-sql"] = "tcp:1"
+        try:
+            result = await backend.start_dynamic_topology(config)
+        finally:
+            del backend.READINESS_PROBES["cnt-sql"]
+            server.close()
+            await healthy
+        return result
+
+    try:
+        result = asyncio.run(scenario())
+    finally:
+        backend.readiness_checker = original
+
+    running = {s["name"]: s for s in result["running_services"]}
+    failed = {s["name"]: s for s in result["failed_services"]}
+    assert set(running) == {"web", "db"}
+    assert running["web"]["probe"]["ok"] and running["db"]["health"] == "healthy"
+    assert failed["broken"]["error"] == "exec format error"
+    assert failed["cnt-sql"]["probe"]["ok"] is False
+    assert failed["not-created"]["state"] == "not_created"
+    print(f"✅ 就绪: {sorted(running)}，失败: {sorted(failed)}")
+    print()
+
+
+def test_compose_cache():
+    """测试动态拓扑配置的内容寻址缓存：相同配置直接返回，变化时只启动变化的服务"""
+    print("🧪 测试compose配置缓存...")
+
+    dmz = f"{backend.DYNAMIC_TOPOLOGY_PROJECT}_dmz"
+    labels = {backend.COMPOSE_PROJECT_LABEL: backend.DYNAMIC_TOPOLOGY_PROJECT}
+    services = {name: {"id": f"c-{name}", "ip": "127.0.0.1", "networks": {dmz: "127.0.0.1"}, "labels": labels}
+                for name in ("web", "db")}
+    log_path = install_fake_docker(services, networks={"dmz": dmz})
+
+    def deploy(config):
+        before = len(read_calls(log_path))
+        result = asyncio.run(backend.start_dynamic_topology(config))
+        ups = [c for c in read_calls(log_path)[before:] if "up" in c]
+        return result, ups
+
+    def up_targets(call):
+        return call[call.index("-d") + 1:]
+
+    config = {
+        "services": {"web": {"image": "nginx", "networks": ["dmz"]}, "db": {"image": "mysql", "networks": ["dmz"]}},
+        "networks": {"dmz": {"driver": "bridge"}},
+    }
+    result, ups = deploy(config)
+    assert not result["already_up"] and len(ups) == 1 and up_targets(ups[0]) == ["--remove-orphans"]
+    assert ups[0][ups[0].index("-p") + 1] == backend.DYNAMIC_TOPOLOGY_PROJECT
+
+    # 键顺序不同但内容相同：不再执行 up
+    reordered = {"networks": {"dmz": {"driver": "bridge"}},
+                 "services": {"db": {"networks": ["dmz"], "image": "mysql"}, "web": {"image": "nginx", "networks": ["dmz"]}}}
+    result, ups = deploy(reordered)
+    assert result["already_up"] and ups == [] and result["config_hash"] == backend.canonical_hash(backend.with_project_label(config))
+    print("✅ 相同拓扑直接返回 already up")
+
+    # 修改一个服务：只对这个服务执行 up
+    config["services"]["db"]["image"] = "mysql:8"
+    result, ups = deploy(config)
+    assert up_targets(ups[0]) == ["--no-deps", "db"]
+    assert result["plan"]["recreate"] == ["db"] and result["plan"]["unchanged"] == ["web"]
+    assert sorted(s["name"] for s in result["running_services"]) == ["db", "web"]
+
+    # 网络配置变化时整体 up
+    config["networks"]["dmz"]["driver"] = "macvlan"
+    result, ups = deploy(config)
+    assert up_targets(ups[0]) == ["--remove-orphans"]
+    print(f"✅ 只对变化的服务执行 up: {backend.compose_cache.stats()}")
+
+    # 缓存文件数不超过上限，当前部署的文件不会被清理
+    cache = backend.ComposeCache(tempfile.mkdtemp(prefix="compose_cache_"), max_files=2)
+
+    async def fill():
+        digest, deployed = await cache.compose_file({"services": {"s0": {}}})
+        await cache.record(digest, deployed, {"services": {"s0": {}}})
+        for i in range(1, 5):
+            await cache.compose_file({"services": {f"s{i}": {}}})
+        return deployed
+
+    deployed = asyncio.run(fill())
+    files = [name for name in os.listdir(cache.directory) if name.endswith(".yml")]
+    assert len(files) == 2 and os.path.basename(deployed) in files, files
+    assert cache.stats()["current_hash"] == backend.canonical_hash({"services": {"s0": {}}})
+    print(f"✅ 缓存只保留 {len(files)} 个文件，当前部署的文件保留")
+    print()
+
+
+def test_topology_engine():
+    """测试增量拓扑引擎：只执行必要的新建、重建、启动、网络调整和删除"""
+    print("🧪 测试增量拓扑引擎...")
+
+    dmz = f"{backend.DYNAMIC_TOPOLOGY_PROJECT}_dmz"
+    labels = {backend.COMPOSE_PROJECT_LABEL: backend.DYNAMIC_TOPOLOGY_PROJECT}
+    services = {
+        "web": {"id": "c-web", "ip": "192.168.1.10", "networks": {dmz: "192.168.1.10"}, "labels": labels},
+        "db": {"id": "c-db", "ip": "192.168.1.20", "networks": {dmz: "192.168.1.20"}, "labels": labels},
+        "cache": {"id": "c-cache", "ip": "192.168.1.30", "networks": {dmz: "192.168.1.30"}, "labels": labels},
+    }
+    log_path = install_fake_docker(services, networks={"dmz": dmz})
+
+    def node(image, ip):
+        return {"image": image, "networks": {"dmz": {"ipv4_address": ip}}}
+
+    config = {
+        "services": {"web": node("nginx", "192.168.1.10"), "db": node("mysql", "192.168.1.20"),
+                     "cache": node("redis", "192.168.1.30")},
+        "networks": {"dmz": {"driver": "bridge"}},
+    }
+    asyncio.run(backend.start_dynamic_topology(config))
+
+    # 运行中的环境：cache 已停止，多了一个不再需要的 old；
+    # old 不在新的compose文件中，compose ps 不会列出它，只能按项目标签找到
+    services["cache"]["running"] = False
+    services["old"] = {"id": "c-old", "networks": {dmz: "192.168.1.99"}, "labels": labels}
+    update_fake_docker(services=services)
+
+    config["services"]["web"] = node("nginx", "192.168.1.11")   # 只改IP
+    config["services"]["cache"] = node("redis", "192.168.1.31")  # 已停止且改了IP
+    config["services"]["db"] = node("mysql:8", "192.168.1.20")  # 改镜像
+    config["services"]["ws"] = node("ubuntu", "192.168.1.40")   # 新增节点
+    before = len(read_calls(log_path))
+    result = asyncio.run(backend.start_dynamic_topology(config))
+    calls = read_calls(log_path)[before:]
+
+    assert result["plan"] == {"create": ["ws"], "recreate": ["db"], "start": ["cache"], "reconnect": ["web", "cache"],
+                              "remove": ["old"], "unchanged": []}
+    ups = [c for c in calls if "up" in c]
+    assert len(ups) == 1 and ups[0][ups[0].index("-d") + 1:] == ["--no-deps", "ws", "db"]
+    assert ["docker", "start", "c-cache"] in calls
+    assert ["docker", "rm", "-f", "c-old"] in calls
+    assert ["docker", "network", "disconnect", dmz, "c-web"] in calls
+    assert ["docker", "network", "connect", "--ip", "192.168.1.11", dmz, "c-web"] in calls
+    # 同一容器先启动再调整网络
+    assert calls.index(["docker", "start", "c-cache"]) < calls.index(["docker", "network", "disconnect", dmz, "c-cache"])
+    print(f"✅ 增量操作: {result['plan']}")
+
+    # 没有 networks 的服务在 default 网络上，network_mode 的服务不比较网络，都不需要调整
+    engine = backend.TopologyDiffEngine()
+
+    def live(*networks):
+        return {"Id": "c", "State": {"Running": True},
+                "NetworkSettings": {"Networks": {network: {"IPAddress": ""} for network in networks}}}
+
+    plan = engine.plan(
+        {"services": {"web": {"image": "nginx"}, "probe": {"image": "busybox", "network_mode": "host"}}},
+        {"web": live(f"{backend.DYNAMIC_TOPOLOGY_PROJECT}_default"), "probe": live("host")},
+        {}, {}
+    )
+    assert plan["reconnect"] == [] and sorted(plan["unchanged"]) == ["probe", "web"], plan
+    print("✅ default 网络和 network_mode 的服务保持不变")
+    print()
+
+
+def test_scoped_teardown():
+    """测试拆除动态拓扑只处理带项目标签的容器，并发执行并清理网络"""
+    print("🧪 测试按项目拆除拓扑...")
+
+    project = backend.DYNAMIC_TOPOLOGY_PROJECT
+    services = {f"node{i}": {"id": f"c{i}", "labels": {backend.TOPOLOGY_PROJECT_LABEL: project}} for i in range(6)}
+    # 加项目标签之前部署的容器只有compose的项目标签
+    services["legacy"] = {"id": "c-legacy", "labels": {backend.COMPOSE_PROJECT_LABEL: project}}
+    services["central-agent"] = {"id": "c-agent", "labels": {}}
+    log_path = install_fake_docker(services, networks={"dmz": f"{project}_dmz"}, stop_delay=0.4)
+
+    started = time.monotonic()
+    result = asyncio.run(backend.stop_dynamic_topology())
+    elapsed = time.monotonic() - started
+    calls = read_calls(log_path)
+
+    removed = {c[-1] for c in calls if c[1:3] == ["rm", "-f"]}
+    assert removed == {f"c{i}" for i in range(6)} | {"c-legacy"}
+    assert all(c[:4] == ["docker", "stop", "-t", str(backend.TEARDOWN_GRACE_PERIOD)] for c in calls if c[1] == "stop")
+    assert ["docker", "network", "rm", f"{project}_dmz"] in calls
+    assert result["containers"] == 7 and result["networks"] == 1
+    # 7个容器各需0.4秒停止，并发执行远小于串行的2.8秒
+    assert elapsed < 2.0, elapsed
+    print(f"✅ 拆除 {result['containers']} 个容器耗时 {elapsed:.2f}s，未影响其他容器")
+
+    # 部署时给每个服务加上项目标签
+    labeled = backend.with_project_label({"services": {"a": {"labels": ["x=1"]}, "b": {"labels": {"y": "2"}}, "c": {}}})
+    assert labeled["services"]["a"]["labels"] == ["x=1", f"{backend.TOPOLOGY_PROJECT_LABEL}={project}"]
+    assert labeled["services"]["b"]["labels"] == {"y": "2", backend.TOPOLOGY_PROJECT_LABEL: project}
+    assert labeled["services"]["c"]["labels"] == {backend.TOPOLOGY_PROJECT_LABEL: project}
+    print("✅ 部署时添加项目标签")
+    print()
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试拓扑编排...\n")
+
+    test_run_docker()
+    test_topology_job()
+    test_compose_ps_batch()
+    test_status_cache()
+    test_readiness_checks()
+    test_compose_cache()
+    test_topology_engine()
+    test_scoped_teardown()
+
+    print("✅ 所有测试完成！")
+
+if __name__ == "__main__":
+    main()